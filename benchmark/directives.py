@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Benchmark directives against a synthetic large system.
+
+Fixtures are generated in a temporary directory, at a configurable scale:
+
+- ``PATH`` directories containing executables (some of them shadowing each
+  other), and a ``python3`` interpreter;
+- a dpkg status database;
+- a dynamic linker cache (``ld.so.cache``);
+- a deep texmf tree, with its ``ls-R`` database (and a ``kpsepath`` stub);
+- a site directory containing distributions (``.dist-info`` directories).
+
+For each directive, are measured:
+
+- collection (:meth:`InventoryDirective.load`, without any cache): time and
+  peak memory of Python allocations (memory of subprocesses is not measured);
+- rendering (:meth:`InventoryDirective.render`, and expansion of tables):
+  time and peak memory;
+- a whole Sphinx build of a document containing only this directive (which
+  includes ``run()``, pickling the document, and writing HTML): time.
+
+Results are written as JSON, and can be compared with a previous result file.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+# pylint: disable=wrong-import-position
+from docutils import nodes
+from sphinx.cmd.build import build_main
+
+from sphinxcontrib.packages import PackagesDomain, __version__, ldcache, table
+
+#: Configuration used to collect records (no cache, no snapshot, no limits).
+CONFIG = types.SimpleNamespace(
+    packages_cache_dir=None,
+    packages_snapshot=None,
+    packages_command_timeout=None,
+    packages_command_max_output=None,
+)
+
+#: Number of directories of ``PATH``.
+PATH_DIRECTORIES = 10
+
+
+def touch(path, mode=0o644):
+    """Create an empty file ``path``."""
+    os.close(os.open(path, os.O_CREAT | os.O_WRONLY, mode))
+
+
+def write_executables(root, scale):
+    """Create ``PATH`` directories containing ``scale`` executables.
+
+    One executable out of twenty has the same name as an executable of the
+    previous directory (which shadows it).
+    """
+    directories = [
+        os.path.join(root, f"bin{number}") for number in range(PATH_DIRECTORIES)
+    ]
+    for number, directory in enumerate(directories):
+        os.makedirs(directory)
+        for index in range(number, scale, PATH_DIRECTORIES):
+            name = f"tool{index - 1 if index % 20 == 0 and index else index}"
+            touch(os.path.join(directory, name), 0o755)
+    os.symlink(sys.executable, os.path.join(directories[0], "python3"))
+    return directories
+
+
+def write_dpkg(root, scale):
+    """Create a dpkg administrative directory containing ``scale`` installed packages."""
+    admindir = os.path.join(root, "dpkg")
+    os.makedirs(admindir)
+    with open(os.path.join(admindir, "status"), "w", encoding="utf8") as file:
+        for index in range(scale):
+            file.write(
+                f"Package: package{index}\n"
+                "Status: install ok installed\n"
+                f"Section: section{index % 40}\n"
+                "Installed-Size: 1024\n"
+                "Architecture: amd64\n"
+                f"Version: {index % 10}.{index % 7}-{index % 3}\n"
+                f"Homepage: https://example.com/package{index}\n"
+                f"Description: Summary of package {index}\n"
+                " Long description of the package,\n"
+                " on several lines.\n"
+                "\n"
+            )
+    return admindir
+
+
+def write_ldcache(root, scale):
+    """Create a (new format) dynamic linker cache, with ``scale`` libraries."""
+    header = struct.Struct("<" + ldcache.NEW_HEADER)
+    entry = struct.Struct("<" + ldcache.NEW_ENTRY)
+    strings = bytearray()
+    entries = []
+    start = header.size + scale * entry.size
+    for index in range(scale):
+        name = f"libsynthetic{index}.so.{index % 7}".encode("utf8")
+        key = start + len(strings)
+        strings += name + b"\0"
+        value = start + len(strings)
+        strings += b"/usr/lib/x86_64-linux-gnu/" + name + b"\0"
+        flags = 0x0303 if index % 5 else 0x0003
+        entries.append(entry.pack(flags, key, value, 0, 0))
+
+    path = os.path.join(root, "ld.so.cache")
+    with open(path, "wb") as file:
+        # Flags 2: little endian
+        file.write(header.pack(ldcache.NEW_MAGIC, scale, len(strings), 2, 0))
+        file.write(b"".join(entries))
+        file.write(strings)
+    return path
+
+
+def write_texmf(root, scale, directory):
+    """Create a deep texmf tree with ``scale`` files, its ``ls-R``, and a ``kpsepath`` stub.
+
+    The stub is written into ``directory``.
+    """
+    texmf = os.path.join(root, "texmf")
+    listing = {}
+    for index in range(scale):
+        relative = os.path.join(
+            "tex", "latex", f"group{index % 10}", f"sub{index % 100}", f"pkg{index}"
+        )
+        os.makedirs(os.path.join(texmf, relative), exist_ok=True)
+        name = f"pkg{index}.{'cls' if index % 10 == 0 else 'sty'}"
+        touch(os.path.join(texmf, relative, name))
+        listing[relative] = [name]
+        # Parent directories list their subdirectories
+        while relative:
+            parent = os.path.dirname(relative)
+            listing.setdefault(parent, [])
+            if os.path.basename(relative) not in listing[parent]:
+                listing[parent].append(os.path.basename(relative))
+            relative = parent
+
+    with open(os.path.join(texmf, "ls-R"), "w", encoding="utf8") as file:
+        file.write(
+            "% ls-R -- filename database for kpathsea; do not change this line.\n"
+        )
+        for relative in sorted(listing):
+            file.write(f"\n./{relative}:\n" if relative else "\n./:\n")
+            file.write("".join(f"{name}\n" for name in listing[relative]))
+
+    kpsepath = os.path.join(directory, "kpsepath")
+    with open(kpsepath, "w", encoding="utf8") as file:
+        file.write(f"#!/bin/sh\necho '.:!!{texmf}/tex//'\n")
+    os.chmod(kpsepath, 0o755)
+    return texmf
+
+
+def write_site(root, scale):
+    """Create a site directory containing ``scale`` distributions."""
+    site = os.path.join(root, "site-packages")
+    for index in range(scale):
+        name = f"synthetic{index}"
+        os.makedirs(os.path.join(site, name))
+        touch(os.path.join(site, name, "__init__.py"))
+        distinfo = os.path.join(site, f"{name}-{index % 10}.{index % 7}.dist-info")
+        os.makedirs(distinfo)
+        with open(os.path.join(distinfo, "METADATA"), "w", encoding="utf8") as file:
+            file.write(
+                f"Metadata-Version: 2.1\nName: {name}\n"
+                f"Version: {index % 10}.{index % 7}\n"
+            )
+        with open(
+            os.path.join(distinfo, "top_level.txt"), "w", encoding="utf8"
+        ) as file:
+            file.write(f"{name}\n")
+    return site
+
+
+def fixtures(root, scale):
+    """Create fixtures in ``root``, and set the environment to use them.
+
+    Return the list of ``(name, options)`` of the benchmarked directives.
+    """
+    directories = write_executables(root, scale)
+    admindir = write_dpkg(root, scale)
+    cache = write_ldcache(root, scale)
+    write_texmf(root, scale, directories[0])
+    site = write_site(root, max(1, scale // 5))
+
+    os.environ["PATH"] = os.pathsep.join(directories)
+    os.environ["PYTHONPATH"] = site
+    return [
+        ("platform", {}),
+        ("pyversions", {}),
+        ("bin", {"shadowed": None}),
+        ("deb", {"admindir": admindir}),
+        ("c", {"ldcache": cache}),
+        ("latex", {}),
+        ("python3", {"bin": sys.executable, "metadata": None}),
+    ]
+
+
+def measure(function, *args):
+    """Call ``function(*args)``.
+
+    Return its result, its duration, and the peak memory of Python
+    allocations (which is measured in another call, since tracing memory
+    slows down execution).
+    """
+    gc.collect()
+    begin = time.perf_counter()
+    result = function(*args)
+    duration = time.perf_counter() - begin
+
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+def render(directive, records):
+    """Render ``records``, and expand compact tables (as done at write time)."""
+    container = nodes.container("", *directive.render(records))
+    for compact in list(container.findall(table.inventory_table)):
+        compact.replace_self(compact.expand())
+    return container
+
+
+def build(root, name, options):
+    """Build a Sphinx project containing only directive ``name``; return its duration."""
+    source = tempfile.mkdtemp(dir=root)
+    with open(os.path.join(source, "conf.py"), "w", encoding="utf8") as file:
+        file.write('extensions = ["sphinxcontrib.packages"]\n')
+    with open(os.path.join(source, "index.rst"), "w", encoding="utf8") as file:
+        file.write(f"Benchmark\n=========\n\n.. packages:{name}::\n")
+        for key, value in options.items():
+            file.write(f"   :{key}: {'' if value is None else value}\n")
+    begin = time.perf_counter()
+    build_main(["-q", "-E", "-b", "html", source, os.path.join(source, "_build")])
+    return time.perf_counter() - begin
+
+
+def run(root, name, options):
+    """Benchmark directive ``name`` (with ``options``) once; return the results."""
+    directive = PackagesDomain.inventories[name].from_options(name, dict(options))
+    records, collect_time, collect_peak = measure(directive.load, CONFIG)
+    __container, render_time, render_peak = measure(render, directive, records)
+    return {
+        "records": len(records),
+        "collect": {"time": collect_time, "peak": collect_peak},
+        "render": {"time": render_time, "peak": render_peak},
+        "build": {"time": build(root, name, options)},
+    }
+
+
+def total_time(result):
+    """Return the sum of the durations of ``result``."""
+    return sum(result[step]["time"] for step in ("collect", "render", "build"))
+
+
+def benchmark(root, directives, repeat):
+    """Benchmark ``directives`` (list of ``(name, options)``); return the best results."""
+    results = {}
+    for name, options in directives:
+        results[name] = min(
+            (run(root, name, options) for _ in range(repeat)), key=total_time
+        )
+        print_result(name, results[name])
+    return results
+
+
+def print_result(name, result, previous=None):
+    """Print ``result`` of directive ``name`` (compared to ``previous``, if any)."""
+
+    def ratio(step, measure_name):
+        if previous is None or name not in previous:
+            return ""
+        before = previous[name][step].get(measure_name)
+        if not before:
+            return ""
+        return f" ({result[step][measure_name] / before:>5.2f}x)"
+
+    print(
+        f"{name:<11} {result['records']:>7} records"
+        f"  collect {result['collect']['time']:>7.3f}s{ratio('collect', 'time')}"
+        f" {result['collect']['peak'] / 2**20:>6.1f}MiB{ratio('collect', 'peak')}"
+        f"  render {result['render']['time']:>7.3f}s{ratio('render', 'time')}"
+        f" {result['render']['peak'] / 2**20:>6.1f}MiB{ratio('render', 'peak')}"
+        f"  build {result['build']['time']:>7.3f}s{ratio('build', 'time')}"
+    )
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument(
+        "--scale",
+        type=int,
+        default=10000,
+        help=(
+            "Number of executables, Debian packages, libraries and LaTeX "
+            "files (and a fifth of it of python distributions)."
+        ),
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Number of runs of each directive."
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        metavar="DIRECTIVE",
+        help="Only benchmark this directive (can be repeated).",
+    )
+    parser.add_argument(
+        "--output", "-o", help="Write results into this file (as JSON)."
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE", help="Compare results with this result file."
+    )
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Do not remove fixtures (their directory is printed).",
+    )
+    arguments = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="packages-benchmark-")
+    environ = dict(os.environ)
+    try:
+        print(f"Generating fixtures (scale {arguments.scale}) in '{root}'…")
+        directives = [
+            (name, options)
+            for name, options in fixtures(root, arguments.scale)
+            if not arguments.only or name in arguments.only
+        ]
+        results = benchmark(root, directives, arguments.repeat)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        if not arguments.keep:
+            shutil.rmtree(root)
+
+    if arguments.compare:
+        with open(arguments.compare, encoding="utf8") as file:
+            previous = json.load(file)
+        print(f"\nCompared to '{arguments.compare}' ({previous['version']}):")
+        for name, result in results.items():
+            print_result(name, result, previous["results"])
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf8") as file:
+            json.dump(
+                {
+                    "version": __version__,
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "scale": arguments.scale,
+                    "repeat": arguments.repeat,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
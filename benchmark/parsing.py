@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Compare the parsing of command outputs, line by line and by chunks.
+
+Synthetic outputs of ``ldconfig -p``, ``dpkg-query`` and ``list_modules.py``
+are parsed:
+
+- line by line, into dictionaries (as it was done in version 1.2.0);
+- by chunks, into records (see :mod:`sphinxcontrib.packages.parsing`).
+
+Time and peak memory (of the parsed records) are displayed.
+"""
+
+import argparse
+import gc
+import io
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+# pylint: disable=wrong-import-position
+from sphinxcontrib.packages import CDirective, DebDirective, PyDirective
+
+DEB_FIELDS = ["section", "package", "version", "homepage", "summary"]
+
+LEGACY_REGEXPS = {
+    "c": r"^(?P<library>[^ ]*) \((?P<arch>[^)]*)\) => (?P<path>.*)$",
+    "deb": "ii *\t" + r"\t".join(rf"(?P<{key}>[^\t]*)" for key in DEB_FIELDS),
+    "python": (
+        r"\t".join(rf"(?P<{key}>[^\t]*)" for key in ["package", "version", "path"])
+        + r"(\t(?P<error>.*))?"
+    ),
+}
+
+
+def ldconfig_output(size):
+    """Return a synthetic output of ``ldconfig -p``, with ``size`` libraries."""
+    lines = [f"{size} libs found in cache `/etc/ld.so.cache'"]
+    for number in range(size):
+        arch = "libc6,x86-64" if number % 3 else "libc6"
+        lines.append(
+            f"\tlibsynthetic{number}.so.{number % 7} ({arch})"
+            f" => /usr/lib/x86_64-linux-gnu/libsynthetic{number}.so.{number % 7}"
+        )
+    return ("\n".join(lines) + "\n").encode("utf8")
+
+
+def dpkg_output(size):
+    """Return a synthetic output of ``dpkg-query``, with ``size`` packages."""
+    return "".join(
+        f"ii \tsection{number % 40}\tpackage{number}\t{number % 10}.{number}-1\t"
+        f"https://example.com/{number}\tSummary of package number {number}\n"
+        for number in range(size)
+    ).encode("utf8")
+
+
+def modules_output(size):
+    """Return a synthetic output of ``list_modules.py``, with ``size`` modules."""
+    return "".join(
+        f"module{number}\t{number % 5}.{number % 11}\t"
+        f"/usr/lib/python3/dist-packages/module{number}/__init__.py\t\n"
+        for number in range(size)
+    ).encode("utf8")
+
+
+def legacy(regexp, output):
+    """Parse ``output`` as it was done in version 1.2.0."""
+    compiled_re = re.compile(regexp)
+    records = []
+    for line in output:
+        match = compiled_re.match(line.decode("utf8").strip())
+        if match:
+            records.append(match.groupdict())
+    return records
+
+
+def current(directive, output):
+    """Parse ``output`` using the parser of ``directive``."""
+    return list(directive.parser.iter_records(output))
+
+
+def measure(function, argument, data, repeat):
+    """Parse ``data`` using ``function``.
+
+    Return the number of records, the duration (best of ``repeat`` runs), and
+    the peak memory (which is measured in another run, since tracing memory
+    slows down parsing).
+    """
+    durations = []
+    for _ in range(repeat):
+        gc.collect()
+        begin = time.perf_counter()
+        records = function(argument, io.BytesIO(data))
+        durations.append(time.perf_counter() - begin)
+        del records
+
+    gc.collect()
+    tracemalloc.start()
+    records = function(argument, io.BytesIO(data))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return len(records), min(durations), peak
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument(
+        "--size", type=int, default=100000, help="Number of lines of each output."
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Number of runs of each parser."
+    )
+    arguments = parser.parse_args()
+
+    cases = [
+        ("c", ldconfig_output, CDirective.from_options("c", {})),
+        ("deb", dpkg_output, DebDirective.from_options("deb", {})),
+        ("python", modules_output, PyDirective.from_options("python", {})),
+    ]
+    print(
+        f"{'Output':<8} {'Parser':<8} {'Records':>8} {'Time (s)':>9} {'Peak (MiB)':>11}"
+    )
+    for name, generate, directive in cases:
+        data = generate(arguments.size)
+        for label, function, argument in [
+            ("legacy", legacy, LEGACY_REGEXPS[name]),
+            ("current", current, directive),
+        ]:
+            count, duration, peak = measure(function, argument, data, arguments.repeat)
+            print(
+                f"{name:<8} {label:<8} {count:>8}"
+                f" {duration:>9.3f} {peak / 2**20:>11.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -20,14 +20,12 @@ http://packages.readthedocs.io
 """
 
 import collections
-import glob
 import importlib.resources
 import operator
 import os
 import platform
-import re
-import subprocess
-import sys
+import shutil
+import time
 
 import distro
 from docutils import nodes
@@ -37,118 +35,220 @@ from docutils.statemachine import StringList
 from sphinx.domains import Domain
 from sphinx.util.nodes import nested_parse_with_titles
 
+from . import (
+    dependencies,
+    dpkg,
+    export,
+    handlers,
+    instrument,
+    kpathsea,
+    ldcache,
+    matrix,
+    parsing,
+    shard,
+    snapshot,
+    table,
+)
+from .cache import InventoryCache
+from .command import Command
+from .diff import DiffDirective
+from .prefetch import PREFETCHER
+from .selection import Selection, pattern
+from .system import (
+    iter_paths,
+    module_directory,
+    python_interpreters,
+    python_versions,
+    scan_path,
+)
+from .table import node_or_str, simple_bulletlist, simple_compound
+
 __version__ = "1.2.0"
 
 
-def node_or_str(text):
-    """Return argument, converted to a node if necessary."""
-    if isinstance(text, str):
-        return nodes.paragraph(text=text)
-    return text
+class InventoryDirective(Directive):
+    """Abstract directive displaying records collected on the host machine.
 
+    Collection (:meth:`collect`) is separated from rendering (:meth:`render`),
+    so that records can be cached, or collected before the document is parsed
+    (see :mod:`sphinxcontrib.packages.prefetch`).
+    """
 
-def simple_compound(*items):
-    """Return a compound node."""
-    compound = nodes.compound()
-    for item in items:
-        compound.append(item)
-    return compound
+    has_content = False
 
+    #: Options which do not change which records are collected (e.g. options
+    #: changing how they are rendered): they are not part of the cache key.
+    render_options = frozenset()
 
-def simple_link(text, target):
-    """Returns a link node to `target`, displaying `text`."""
-    container = nodes.paragraph()
-    reference = nodes.reference("", "", internal=False, refuri=target)
-    reference.append(nodes.paragraph(text=text))
-    container.append(reference)
-    return container
+    #: Fields (of exported rows, see :meth:`export`) identifying a row, when
+    #: comparing inventories (see :class:`DiffDirective`). If empty,
+    #: inventories of this directive cannot be compared.
+    diff_key = ()
+    #: Fields (of exported rows) compared between inventories.
+    diff_values = ()
 
+    @classmethod
+    def from_options(cls, name, options):
+        """Return an instance of this directive, which is only meant to collect records.
 
-def simple_table(ncolumns, headers, body):
-    """Return a table node.
+        Since it is not attached to any document, such an instance cannot be run.
+        """
+        directive = cls.__new__(cls)
+        directive.name = name
+        directive.arguments = []
+        directive.options = options
+        directive.content = StringList()
+        return directive
+
+    def cache_key(self):
+        """Return a key identifying the records of this directive."""
+        # Sphinx domains wrap directives into local classes: skip them
+        cls = next(
+            cls for cls in type(self).__mro__ if "<locals>" not in cls.__qualname__
+        )
+        options = tuple(
+            sorted(
+                (key, value)
+                for key, value in self.options.items()
+                if key not in self.render_options
+            )
+        )
+        return (cls.__module__, cls.__qualname__, options)
 
-    :param int ncolumns: Number of columns.
-    :param list headers: Headers, as a list of nodes (or strings), or ``None``,
-        if there is no headers.
-    :param list body: Body, as a list of lists of nodes (or strings).
-    """
+    def fingerprint_paths(self):
+        """Return the list of paths the records depend on.
 
-    def _build_table_row(data):
-        """Return the node corresponding to a row of the table."""
-        row = nodes.row()
-        for cell in data:
-            entry = nodes.entry()
-            row += entry
-            entry.append(node_or_str(cell))
-        return row
-
-    table = nodes.table()
-    tgroup = nodes.tgroup(cols=2)
-    table += tgroup
-    for colwidth in [10] * ncolumns:
-        colspec = nodes.colspec(colwidth=colwidth)
-        tgroup += colspec
-
-    # HEAD
-    thead = nodes.thead()
-    tgroup += thead
-    if headers is not None:
-        for row in [headers]:
-            thead += _build_table_row(row)
-
-    # BODY
-    tbody = nodes.tbody()
-    tgroup += tbody
-    for row in body:
-        tbody += _build_table_row(row)
-
-    return table
-
-
-def simple_bulletlist(items):
-    """Return a bullet list nodes of arguments."""
-    return nodes.bullet_list(
-        "", *[nodes.list_item("", node_or_str(item)) for item in items]
-    )
+        If one of those paths is modified (or created, or deleted), the cached
+        records are discarded (paths can also be environment variables, like
+        ``$PATH``). If this method returns ``None`` (the default), the records
+        are never cached.
 
+        Collection can add other paths to :attr:`self.watched`, which are also
+        taken into account.
+        """
+        return None
 
-def iter_paths():
-    """Iterate over existing paths."""
-    for string in os.getenv("PATH").split(":"):
-        path = os.path.expanduser(os.path.expandvars(string))
-        if os.path.exists(path) and os.path.isdir(path):
-            yield path
-
-
-def python_versions():
-    """Iterate over [binary, version] lists of available python executables."""
-    binaries = set()
-    for path in iter_paths():
-        for binary in glob.glob(os.path.join(path, "python*")):
-            binaries.add(binary)
-    binaries.add(sys.executable)
-
-    pythonre = re.compile(r".*/python[.0123456789]*$")
-    for binary in binaries:
-        if pythonre.match(binary):
-            try:
-                yield [
-                    nodes.literal(text=binary),
-                    subprocess.check_output(
-                        [binary, "--version"],
-                        stdin=subprocess.DEVNULL,
-                        stderr=subprocess.STDOUT,
-                        text=True,
-                    ).strip(),
-                ]
-            except subprocess.CalledProcessError:
-                continue
+    def collect(self):
+        """Collect and return the list of records."""
+        raise NotImplementedError
+
+    def load(self, config):
+        """Return the list of records.
+
+        If :confval:`packages_snapshot` is set, records are read from this
+        snapshot. Otherwise, if :confval:`packages_cache_dir` is set, records
+        are read from the cache (if the fingerprint of their paths is
+        unchanged) or stored into it.
+
+        Collection can add measures to :attr:`self.profile` (see
+        :mod:`sphinxcontrib.packages.instrument`). If it is interrupted (see
+        :class:`CmdDirective`), it sets :attr:`self.incomplete` to a message
+        telling why: such records are not cached.
+        """
+        # pylint: disable=attribute-defined-outside-init
+        self.watched = set()
+        self.profile = {"source": "snapshot"}
+        self.incomplete = None
+        if config.packages_snapshot:
+            return snapshot.get_records(config.packages_snapshot, self)
+
+        self.profile["source"] = "collect"
+        cache = InventoryCache.from_config(config)
+        paths = self.fingerprint_paths()  # pylint: disable=assignment-from-none
+        if cache is None or paths is None:
+            return self.collect()
+
+        key = self.cache_key()
+        # Concurrent builds (or parallel processes) wait for each other
+        with cache.lock(key):
+            entry = cache.get_entry(key, paths)
+            if entry is None:
+                records = self.collect()
+                if self.incomplete is None:
+                    cache.set(key, set(paths) | self.watched, records)
+                return records
+        self.profile["source"] = "cache"
+        stored_paths, records = entry
+        self.watched.update(stored_paths)
+        return records
+
+    def dependencies(self, config):
+        """Return the set of paths the records depend on, or ``None``.
+
+        This must be called after :meth:`load`. It returns ``None`` if records
+        do not depend on known paths (see :meth:`fingerprint_paths`).
+        """
+        if config.packages_snapshot:
+            return {config.packages_snapshot}
+        paths = self.fingerprint_paths()  # pylint: disable=assignment-from-none
+        if paths is None:
+            return None
+        return set(paths) | self.watched
+
+    def records(self):
+        """Return the :class:`~sphinxcontrib.packages.prefetch.Entry` of the records.
+
+        Wait for the records if they are being prefetched. Paths the records
+        depend on are recorded into the environment, so that the document is
+        read again when they change.
+        """
+        env = self.state.document.settings.env
+        if env.config.packages_export:
+            # Records are kept by the prefetcher until they are exported
+            PREFETCHER.submit(self, env.config, env.config.packages_prefetch_workers)
+            export.note(env, env.docname, self)
+        entry = PREFETCHER.entry(self, env.config)
+        if entry.dependencies is not None:
+            dependencies.note(env, env.docname, entry.dependencies)
+        return entry
+
+    def render(self, records):
+        """Return the list of nodes displaying ``records``."""
+        raise NotImplementedError
+
+    def export(self, records):
+        """Iterate over the dictionaries exported for ``records``.
+
+        See :mod:`sphinxcontrib.packages.export`.
+        """
+        for record in records:
+            yield dict(record)
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            entry = self.records()
+        except (
+            FileNotFoundError,
+            snapshot.SnapshotError,
+            ldcache.LdCacheError,
+        ) as exception:
+            error = nodes.error()
+            error.append(nodes.paragraph(text=str(exception)))
+            return [self.reporter.warning(str(exception), line=self.lineno), error]
+        rendered = time.perf_counter()
+        result = self.render(entry.records)
+        if entry.incomplete is not None:
+            message = f"This list is incomplete. {entry.incomplete}"
+            result[:0] = [
+                self.reporter.warning(entry.incomplete, line=self.lineno),
+                nodes.warning("", nodes.paragraph(text=message)),
+            ]
+        instrument.report(
+            self,
+            entry.profile,
+            wait=rendered - start,
+            duration=time.perf_counter() - rendered,
+            nodes=result,
+        )
+        return result
 
 
-class PlatformDirective(Directive):
+class PlatformDirective(InventoryDirective):
     """Print platform information (processors, architecture, etc.). Assume to be GNU/Linux."""
 
-    has_content = False
+    diff_key = ("name",)
+    diff_values = ("value",)
 
     @staticmethod
     def body():
@@ -167,27 +267,85 @@ class PlatformDirective(Directive):
         yield ["Distribution name", distro.name()]
         yield ["Distribution version", distro.version(pretty=True)]
 
-    def run(self):
-        return [simple_table(2, [], self.body())]
+    def collect(self):
+        return list(self.body())
+
+    def render(self, records):
+        return [table.inventory_table.from_rows(2, [], records)]
 
+    def export(self, records):
+        for name, value in records:
+            yield {"name": name, "value": value}
 
-class PythonVersionsDirective(Directive):
+
+class PythonVersionsDirective(InventoryDirective):
     """Print list of available python versions"""
 
-    has_content = False
+    option_spec = {"aliases": flag}
+    render_options = frozenset(option_spec)
+    diff_key = ("binary",)
+    diff_values = ("version",)
 
     @staticmethod
     def body():
         """Iterator to the versions."""
         return sorted(python_versions(), key=operator.itemgetter(1))
 
-    def run(self):
-        return [simple_table(2, ["Binary", "Version"], self.body())]
+    def fingerprint_paths(self):
+        return ["$PATH", *iter_paths()]
 
+    def collect(self):
+        interpreters = python_interpreters()
+        for binaries, __version in interpreters:
+            self.watched.update(os.path.realpath(binary) for binary in binaries)
+        return interpreters
 
-class BinDirective(Directive):
+    def export(self, records):
+        for binaries, version in records:
+            for binary in binaries:
+                yield {"binary": binary, "interpreter": binaries[0], "version": version}
+
+    def render(self, records):
+        if "aliases" in self.options:
+            return [
+                table.inventory_table.from_rows(
+                    3,
+                    ["Binary", "Aliases", "Version"],
+                    [
+                        [
+                            table.literal(binaries[0]),
+                            table.literals(binaries[1:]),
+                            version,
+                        ]
+                        for binaries, version in sorted(
+                            records, key=operator.itemgetter(1, 0)
+                        )
+                    ],
+                )
+            ]
+        return [
+            table.inventory_table.from_rows(
+                2,
+                ["Binary", "Version"],
+                [
+                    [table.literal(binary), version]
+                    for version, binary in sorted(
+                        (version, binary)
+                        for binaries, version in records
+                        for binary in binaries
+                    )
+                ],
+            )
+        ]
+
+
+class BinDirective(InventoryDirective):
     """Display the list of available binaries."""
 
+    option_spec = {"dedup": flag, "shadowed": flag}
+    render_options = frozenset(option_spec)
+    diff_key = ("binary", "directory")
+
     @staticmethod
     def dirs():
         """Iterator over couples `(path, binaries)`.
@@ -195,24 +353,52 @@ class BinDirective(Directive):
         - `path` is a path of the ``PATH`` variable;
         - `binaries` is the list of binaries available in this path.
         """
-        for path in iter_paths():
-            binaries = []
-            for binary in sorted(os.listdir(path)):
-                if os.path.isfile(os.path.join(path, binary)) and os.access(
-                    os.path.join(path, binary), os.X_OK
-                ):
-                    binaries.append(binary)
-            yield (path, binaries)
+        for path, _, binaries in scan_path():
+            yield (path, [name for name, _ in binaries])
 
-    def run(self):
+    def fingerprint_paths(self):
+        return ["$PATH", *iter_paths()]
+
+    def collect(self):
+        return list(scan_path())
+
+    def export(self, records):
+        for path, duplicate, binaries in records:
+            if duplicate is not None:
+                continue
+            for binary, shadowed in binaries:
+                yield {"directory": path, "binary": binary, "shadowed": shadowed or ""}
+
+    def render(self, records):
         items = []
-        for path, binaries in self.dirs():
+        for path, duplicate, binaries in records:
             item = simple_compound(nodes.literal(text=path))
+            if duplicate is not None and "dedup" in self.options:
+                item.append(
+                    nodes.paragraph(
+                        "",
+                        "",
+                        nodes.emphasis(text="same directory as "),
+                        nodes.literal(text=duplicate),
+                    )
+                )
+                items.append(item)
+                continue
             cells = []
-            for binary in binaries:
-                cells.append([nodes.paragraph(text=binary)])
+            for binary, shadowed in binaries:
+                if "shadowed" not in self.options:
+                    cells.append([binary])
+                elif shadowed is None:
+                    cells.append([binary, ""])
+                else:
+                    cells.append(
+                        [
+                            binary,
+                            (table.emphasis("shadowed by "), table.literal(shadowed)),
+                        ]
+                    )
             if cells:
-                item.append(simple_table(1, [], cells))
+                item.append(table.inventory_table.from_rows(len(cells[0]), [], cells))
             else:
                 item.append(nodes.emphasis(text="empty"))
             items.append(item)
@@ -242,11 +428,35 @@ def deepdict_factory(depth):
     return deepdict
 
 
-class CmdDirective(Directive):
-    """Abstract directive that executes a command, and return its output as array(s)."""
+class CmdDirective(InventoryDirective):
+    """Abstract directive that executes a command, and return its output as array(s).
+
+    The command is killed after ``:command-timeout:`` seconds, or after
+    ``:max-output:`` bytes of output (see :confval:`packages_command_timeout`).
+    Records are selected by the ``:include:``, ``:exclude:``, ``:section:`` and
+    ``:limit:`` options (see :mod:`sphinxcontrib.packages.selection`).
+    """
+
+    option_spec = {
+        "shard": shard.shard_mode,
+        "shard-size": directives.positive_int,
+        "shard-page": directives.positive_int,
+        "command-timeout": float,
+        "max-output": directives.positive_int,
+        "include": pattern,
+        "exclude": pattern,
+        "section": directives.unchanged,
+        "limit": directives.positive_int,
+    }
+    render_options = frozenset(
+        ["shard", "shard-size", "shard-page", "command-timeout", "max-output"]
+    )
+    #: Default number of records of pages, when sharding alphabetically.
+    shard_size = 500
 
     command = []
     regexp = "(?P<line>.*)"
+    multiline = False
     headers = {}
     sections = []
     sortkey = None
@@ -267,13 +477,43 @@ class CmdDirective(Directive):
         """
         yield match
 
+    @property
+    def parser(self):
+        """Parser of the output of the command.
+
+        By default, lines are matched against :attr:`regexp` (or, if
+        :attr:`multiline` is true, this regular expression is searched in the
+        whole output at once).
+        """
+        return parsing.RegexParser(self.regexp, multiline=self.multiline)
+
+    @property
+    def selection(self):
+        """Records selected by the options (see :mod:`sphinxcontrib.packages.selection`)."""
+        if "section" in self.options and not self.sections:
+            raise self.error(f"Directive '{self.name}' has no sections.")
+        return Selection.from_options(self.options)
+
+    def select(self, records):
+        """Return the list of selected records, among iterable ``records``."""
+        return self.selection.select(
+            records,
+            self.sortkey,
+            self.sections[0] if self.sections else None,
+            self.sort_value,
+        )
+
     def _iter_match(self, output):
-        """Iterator over matched lines of the output."""
-        compiled_re = re.compile(self.regexp)
-        for line in output:
-            match = compiled_re.match(line.decode("utf8").strip())
-            if match:
-                yield from self.filter(match.groupdict())
+        """Iterator over matched lines of the output (a binary stream).
+
+        The number of matches (before :meth:`filter`) is counted in
+        :attr:`self.profile`.
+        """
+        self.profile.setdefault("matched", 0)
+        for batch in self.parser.iter_batches(output):
+            self.profile["matched"] += len(batch)
+            for match in batch:
+                yield from self.filter(match)
 
     def _render_deepdict(self, deepdict):
         """Render a :class:`deepdict`.
@@ -284,12 +524,14 @@ class CmdDirective(Directive):
         if isinstance(deepdict, list):
             items = {}
             for item in deepdict:
-                items[item[self.sortkey]] = [item[key] for key in self.headers]
+                items[self.sort_value(item)] = [
+                    self.render_cell(key, item) for key in self.headers
+                ]
             if self.show_headers:
-                headers = self.headers.values()
+                headers = list(self.headers.values())
             else:
                 headers = None
-            return simple_table(
+            return table.inventory_table.from_rows(
                 len(self.headers), headers, [items[key] for key in sorted(items.keys())]
             )
         return simple_bulletlist(
@@ -302,90 +544,267 @@ class CmdDirective(Directive):
             ]
         )
 
-    def run(self):
-        try:
-            with subprocess.Popen(
-                self.command,
-                stdin=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                stdout=subprocess.PIPE,
-            ) as process:
-                deepdict = deepdict_factory(len(self.sections))()
-                for match in self._iter_match(process.stdout):
-                    subdict = deepdict
-                    for section in self.sections:
-                        subdict = subdict[match[section]]
-                    subdict.append(match)
-        except FileNotFoundError as exception:
-            error = nodes.error()
-            error.append(nodes.paragraph(text=str(exception)))
-            return [error]
+    def cache_key(self):
+        # Evaluate the command first: it may set default options
+        command = tuple(str(item) for item in self.command)
+        return super().cache_key() + (command,)
+
+    def load(self, config):
+        # pylint: disable=attribute-defined-outside-init
+        self.limits = (
+            self.options.get("command-timeout", config.packages_command_timeout),
+            self.options.get("max-output", config.packages_command_max_output),
+        )
+        return super().load(config)
+
+    def collect(self):
+        """Run the command, and return the list of (filtered) matched lines."""
+        start = time.perf_counter()
+        with Command(self.command, *self.limits) as process:
+            output = instrument.CountingReader(process.stdout)
+            records = self.select(self._iter_match(output))
+        # pylint: disable=attribute-defined-outside-init
+        self.incomplete = process.interrupted
+        self.profile.update(
+            subprocess=time.perf_counter() - start,
+            bytes=output.bytes,
+            lines=output.lines,
+            discarded=max(self.profile["matched"] - len(records), 0),
+        )
+        return records
+
+    def sort_value(self, match):
+        """Return the value used to sort ``match`` (matches with the same value are merged)."""
+        return match[self.sortkey]
+
+    def render_cell(self, key, match):
+        """Return the cell displayed in column ``key`` of ``match``.
+
+        See :mod:`sphinxcontrib.packages.table` for the format of cells.
+        """
+        return match[key]
+
+    def shards(self, records):
+        """Split ``records`` into pages, as requested by the ``:shard:`` option.
+
+        Return a list of ``(title, records)`` tuples.
+        """
+        if self.options["shard"] == "section":
+            if not self.sections:
+                raise self.error(
+                    f"Directive '{self.name}' has no sections: use ':shard: alpha'."
+                )
+            sections = collections.defaultdict(list)
+            for match in records:
+                sections[match[self.sections[0]]].append(match)
+            return [
+                (str(self.section_names(key)), sections[key])
+                for key in sorted(sections)
+            ]
+
+        size = self.options.get("shard-size", self.shard_size)
+        records = sorted(records, key=self.sort_value)
+        pages = []
+        for start in range(0, len(records), size):
+            page = records[start : start + size]
+            first, last = page[0][self.sortkey], page[-1][self.sortkey]
+            pages.append((first if first == last else f"{first} – {last}", page))
+        return pages
+
+    def render_shards(self, records):
+        """Render a table of contents of the pages of ``records``."""
+        env = self.state.document.settings.env
+        docnames = shard.shard_docnames(env.docname, self, len(self.shards(records)))
+        return [shard.toctree(self, docnames)]
+
+    def render(self, records):
+        sections = self.sections
+        if "shard" in self.options:
+            if "shard-page" not in self.options:
+                return self.render_shards(records)
+            pages = self.shards(records)
+            number = self.options["shard-page"]
+            records = pages[number - 1][1] if number <= len(pages) else []
+            if self.options["shard"] == "section":
+                # The section is the title of the page
+                sections = sections[1:]
+
+        deepdict = deepdict_factory(len(sections))()
+        for match in records:
+            subdict = deepdict
+            for section in sections:
+                subdict = subdict[match[section]]
+            subdict.append(match)
 
         return [self._render_deepdict(deepdict)]
 
 
 class DebDirective(CmdDirective):
-    """Display the list of installed debian packages"""
+    """Display the list of installed debian packages
 
-    regexp = "ii *\t" + r"\t".join(
-        [
-            rf"(?P<{key}>[^\t]*)"
-            for key in ["section", "package", "version", "homepage", "summary"]
-        ]
-    )
-    command = [
-        "dpkg-query",
-        "--show",
-        "--showformat=${db:Status-Abbrev}\t${Section}\t${binary:Package}\t${Version}\t${Homepage}\t${binary:Summary}\n",  # pylint: disable=line-too-long
-    ]
-    headers = collections.OrderedDict(
-        [
-            ("package_node", "Package name"),
-            ("version", "Version"),
-            ("summary", "Summary"),
-        ]
-    )
+    The dpkg status database is read directly; ``dpkg-query`` is only used if
+    it cannot be read.
+    """
+
+    fields = ["section", "package", "version", "homepage", "summary"]
     sortkey = "package"
     sections = ["section"]
+    diff_key = ("package",)
+    diff_values = ("version",)
 
-    def filter(self, match):
-        if match["homepage"]:
-            match["package_node"] = simple_link(
-                text=match["package"], target=match["homepage"]
+    option_spec = {
+        **CmdDirective.option_spec,
+        "admindir": directives.path,
+        "fields": directives.unchanged,
+    }
+
+    @property
+    def extra_fields(self):
+        """List of fields (lowercase) added with the ``:fields:`` option."""
+        return [
+            field.lower()
+            for field in self.options.get("fields", "").replace(",", " ").split()
+        ]
+
+    @property
+    def parser(self):
+        """Parser of the output of ``dpkg-query`` (tab-separated fields)."""
+        # Only keep installed packages (status "ii", with no error flag)
+        return parsing.SplitParser(self.fields + self.extra_fields, prefix="ii \t")
+
+    @property
+    def command(self):
+        """Return the ``dpkg-query`` command (used if the database cannot be read)."""
+        showformat = "\t".join(
+            ["${db:Status-Abbrev}", "${Section}", "${binary:Package}", "${Version}"]
+            + ["${Homepage}", "${binary:Summary}"]
+            + [f"${{{field}}}" for field in self.extra_fields]
+        )
+        command = ["dpkg-query", "--show", f"--showformat={showformat}\n"]
+        if "admindir" in self.options:
+            command.insert(1, f"--admindir={self.options['admindir']}")
+        return command
+
+    @property
+    def headers(self):
+        """Displayed columns."""
+        headers = collections.OrderedDict(
+            [
+                ("package", "Package name"),
+                ("version", "Version"),
+                ("summary", "Summary"),
+            ]
+        )
+        for field in self.options.get("fields", "").replace(",", " ").split():
+            headers[field.lower()] = field
+        return headers
+
+    def fingerprint_paths(self):
+        return [dpkg.status_path(self.options.get("admindir"))]
+
+    def collect(self):
+        try:
+            return self.select(
+                dpkg.iter_packages(
+                    self.options.get("admindir"), self.extra_fields, self.selection
+                )
             )
-        else:
-            match["package_node"] = match["package"]
-        yield match
+        except OSError:
+            return super().collect()
+
+    def render_cell(self, key, match):
+        if key == "package" and match["homepage"]:
+            return table.link(match["package"], match["homepage"])
+        return super().render_cell(key, match)
 
 
 class PyDirective(CmdDirective):
     """Abstract class to display available python modules."""
 
-    regexp = r"\t".join(
-        [rf"(?P<{key}>[^\t]*)" for key in ["package", "version", "path"]]
-    )
+    parser = parsing.SplitParser(["package", "version", "path", "error"], required=3)
     headers = collections.OrderedDict(
         [("package", "Package name"), ("version", "Version")]
     )
     sortkey = "package"
     python = "python"
-
-    option_spec = {"bin": directives.unchanged}
+    interpreters = None
+    diff_key = ("package",)
+    diff_values = ("version",)
+
+    option_spec = {
+        **CmdDirective.option_spec,
+        "bin": directives.unchanged,
+        "metadata": flag,
+        "jobs": directives.nonnegative_int,
+        "timeout": float,
+        "max-imports": directives.positive_int,
+        "max-memory": directives.positive_int,
+        "depth": directives.nonnegative_int,
+    }
 
     def filter(self, match):
         if os.path.splitext(match["path"])[0] != os.path.splitext(self.command[1])[0]:
+            if match["path"]:
+                self.watched.add(module_directory(match["path"]))
             yield match
 
     @property
-    def command(self):
-        """Return the command to perform to list modules."""
-        if "bin" not in self.options:
-            self.options["bin"] = self.python
+    def is_matrix(self):
+        """``True`` iff ``:bin:`` is several interpreters (see :mod:`.matrix`)."""
+        return matrix.is_matrix(self.options.setdefault("bin", self.python))
+
+    def fingerprint_paths(self):
+        return matrix.fingerprint_paths(self)
+
+    def collect(self):
+        return matrix.collect(self) if self.is_matrix else super().collect()
+
+    def export(self, records):
+        return matrix.export(records) if self.is_matrix else super().export(records)
+
+    def render(self, records):
+        if self.is_matrix and "shard" not in self.options:
+            return [matrix.render(records)]
+        # pylint: disable=attribute-defined-outside-init
+        self.names = {record["package"] for record in records}
+        return super().render(records)
+
+    def shards(self, records):
+        if self.is_matrix:
+            raise self.error(
+                f"Directive '{self.name}' cannot shard several interpreters."
+            )
+        return super().shards(records)
 
-        return [
-            self.options["bin"],
+    @property
+    def command(self):
+        """Return the command to perform to list modules (of a single interpreter)."""
+        command = [
+            self.options.setdefault("bin", self.python),
             importlib.resources.files(__name__) / "data" / "bin" / "list_modules.py",
         ]
+        if "metadata" in self.options:
+            command.append("--metadata")
+        for option in [
+            "jobs",
+            "timeout",
+            "max-imports",
+            "max-memory",
+            "include",
+            "exclude",
+            "limit",
+            "depth",
+        ]:
+            if option in self.options:
+                command.extend([f"--{option}", str(self.options[option])])
+        return command
+
+    def render_cell(self, key, match):
+        if key == "version" and match.get("error"):
+            return table.emphasis(match["error"])
+        if key == "package" and self.options.get("depth"):
+            return table.tree(match["package"], self.names)
+        return super().render_cell(key, match)
 
 
 class Py3Directive(PyDirective):
@@ -401,13 +820,73 @@ class Py2Directive(PyDirective):
 
 
 class CDirective(CmdDirective):
-    """Display available C libraries."""
+    """Display available C libraries.
+
+    The cache of the dynamic linker is read directly; ``ldconfig`` is only
+    run if it cannot be read.
+    """
 
-    regexp = r"^ *(?P<library>[^ ]*) "
-    headers = collections.OrderedDict([("library", "Library")])
+    regexp = r"^[ \t]*(?P<library>[^ \n]*) \((?P<arch>[^)\n]*)\) => (?P<path>.*)$"
+    multiline = True
     command = ["/sbin/ldconfig", "-p"]
     sortkey = "library"
-    show_headers = False
+    diff_key = ("library", "arch")
+    diff_values = ("path",)
+    columns = collections.OrderedDict(
+        [("library", "Library"), ("arch", "Architecture"), ("path", "Path")]
+    )
+
+    option_spec = {
+        **CmdDirective.option_spec,
+        "ldcache": directives.path,
+        "columns": directives.unchanged,
+        "arch": directives.unchanged,
+    }
+    render_options = CmdDirective.render_options | {"columns"}
+
+    @property
+    def headers(self):
+        """Displayed columns."""
+        keys = self.options.get("columns", "library").replace(",", " ").split()
+        return collections.OrderedDict(
+            (key, self.columns[key]) for key in keys if key in self.columns
+        )
+
+    @property
+    def show_headers(self):
+        """Only display headers if there are several columns."""
+        return len(self.headers) > 1
+
+    def filter(self, match):
+        if "arch" not in self.options or self.options["arch"] in match["arch"].split(
+            ","
+        ):
+            yield match
+
+    def fingerprint_paths(self):
+        return [self.options.get("ldcache", ldcache.LDCACHE)]
+
+    def collect(self):
+        try:
+            libraries = list(
+                ldcache.iter_libraries(
+                    self.options.get("ldcache", ldcache.LDCACHE),
+                    self.selection.accepts_name,
+                )
+            )
+        except (OSError, ldcache.LdCacheError):
+            if "ldcache" in self.options:
+                # Do not display the libraries of the current machine instead
+                raise
+            return super().collect()
+        return self.select(
+            record for library in libraries for record in self.filter(library)
+        )
+
+    def sort_value(self, match):
+        # Libraries sharing a name (for different architectures) are only
+        # merged if no column tells them apart.
+        return tuple(match[key] for key in self.headers)
 
 
 class LatexDirective(CmdDirective):
@@ -417,8 +896,10 @@ class LatexDirective(CmdDirective):
     sortkey = "package"
     headers = {"package": "Package"}
     sections = ["type"]
+    diff_key = ("package", "type")
     section_names = {"class": "Classes", "package": "Packages"}.get
     show_headers = False
+    record = parsing.record_class(["package", "type"])
 
     @staticmethod
     def _sty_or_cls(file):
@@ -433,24 +914,23 @@ class LatexDirective(CmdDirective):
             return "class"
         return False
 
-    def _find(self, path):
-        """Iterator over .sty and .clsfiles in argument.
-
-        Argument is a string representing a (maybe non-existing) path.
-        """
-        for __root, __dirs, files in os.walk(path):
-            for file in files:
-                if self._sty_or_cls(file):
-                    yield file
+    def fingerprint_paths(self):
+        binary = shutil.which(self.command[0])
+        if binary is None:
+            return []
+        return [os.path.realpath(binary)]
 
     def filter(self, match):
-        for item in match["line"].split(":"):
-            if item.startswith("!!"):
-                item = item[2:]
-            yield from [
-                dict([("package", file), ("type", self._sty_or_cls(file))])
-                for file in self._find(item)
-            ]
+        self.watched.update(
+            root
+            for root, __recursive in kpathsea.prune(kpathsea.parse_path(match["line"]))
+        )
+        self.watched.update(kpathsea.databases(match["line"]))
+        selected = self.selection
+        for __directory, file in kpathsea.iter_files(match["line"]):
+            kind = self._sty_or_cls(file)
+            if kind and selected.accepts_section(kind) and selected.accepts_name(file):
+                yield self.record((file, kind))
 
 
 class PackagesDomain(Domain):
@@ -460,7 +940,8 @@ class PackagesDomain(Domain):
 
     name = "packages"
     label = "Sphinxcontrib-packages"
-    directives = {
+    #: Directives displaying inventories (see :class:`InventoryDirective`).
+    inventories = {
         "platform": PlatformDirective,
         "pyversions": PythonVersionsDirective,
         "bin": BinDirective,
@@ -471,8 +952,49 @@ class PackagesDomain(Domain):
         "c": CDirective,
         "latex": LatexDirective,
     }
+    directives = {**inventories, "diff": DiffDirective}
+
+    def merge_domaindata(self, docnames, otherdata):
+        """Merge data of documents read by parallel processes: there is none.
+
+        Data of this extension is stored in the environment (and merged by
+        ``env-merge-info`` handlers).
+        """
 
 
 def setup(app):
     """Register directives."""
     app.add_domain(PackagesDomain)
+    app.add_node(table.inventory_table)
+    app.add_config_value("packages_cache_dir", None, "")
+    app.add_config_value("packages_cache_size", 100 * 2**20, "")
+    app.add_config_value("packages_prefetch", True, "")
+    app.add_config_value("packages_prefetch_workers", None, "")
+    app.add_config_value("packages_snapshot", None, "env")
+    app.add_config_value("packages_export", [], "")
+    app.add_config_value("packages_export_dir", "_packages", "")
+    app.add_config_value("packages_command_timeout", 600, "")
+    app.add_config_value("packages_command_max_output", None, "")
+    app.add_config_value("packages_profile", False, "")
+    app.add_config_value("packages_profile_file", None, "")
+    app.add_config_value("packages_virtual_table_rows", None, "html", (int, type(None)))
+    app.add_event(instrument.EVENT)
+    app.connect("config-inited", handlers.config_inited)
+    app.connect("builder-inited", handlers.builder_inited)
+    app.connect("env-get-outdated", dependencies.env_get_outdated)
+    app.connect("env-get-outdated", shard.env_get_outdated)
+    app.connect("env-purge-doc", dependencies.env_purge_doc)
+    app.connect("env-purge-doc", export.env_purge_doc)
+    app.connect("env-merge-info", dependencies.env_merge_info)
+    app.connect("env-merge-info", export.env_merge_info)
+    app.connect("env-merge-info", instrument.env_merge_info)
+    app.connect("env-before-read-docs", handlers.env_before_read_docs)
+    app.connect("env-updated", handlers.env_updated)
+    app.connect("doctree-resolved", table.doctree_resolved)
+    app.connect("build-finished", handlers.build_finished)
+    return {
+        "version": __version__,
+        "env_version": 1,
+        "parallel_read_safe": True,
+        "parallel_write_safe": True,
+    }
@@ -0,0 +1,181 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Command line interface of sphinxcontrib-packages.
+
+``python -m sphinxcontrib.packages snapshot`` collects the inventories of the
+host into a snapshot file, which can be used to build the documentation on
+another machine (see :confval:`packages_snapshot`).
+"""
+
+import argparse
+import os
+import sys
+import types
+
+from . import PackagesDomain, snapshot
+from .prefetch import Prefetcher, iter_source_directives
+
+#: Configuration used to collect records (no cache, no snapshot, no limits).
+CONFIG = types.SimpleNamespace(
+    packages_cache_dir=None,
+    packages_snapshot=None,
+    packages_command_timeout=None,
+    packages_command_max_output=None,
+)
+
+
+def iter_sources(paths, suffix):
+    """Iterate over files ending with ``suffix`` (in ``paths``, or in their subdirectories)."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(name for name in dirs if not name.startswith((".", "_")))
+            for name in sorted(files):
+                if name.endswith(suffix):
+                    yield os.path.join(root, name)
+
+
+def iter_inventories(sources, suffix):
+    """Iterate over directives whose records are to be collected.
+
+    Those are all the directives (with default options), and the directives
+    found in ``sources``. Directives with the same records are iterated once.
+    """
+    found = [
+        directive.from_options(name, {})
+        for name, directive in PackagesDomain.inventories.items()
+    ]
+    for path in iter_sources(sources, suffix):
+        try:
+            with open(path, encoding="utf8") as file:
+                text = file.read()
+        except (OSError, UnicodeDecodeError) as error:
+            print(f"Ignoring '{path}': {error}", file=sys.stderr)
+            continue
+        found.extend(
+            directive
+            for __option_list, directive in iter_source_directives(
+                text, PackagesDomain.inventories
+            )
+        )
+
+    keys = set()
+    for directive in found:
+        key = snapshot.snapshot_key(directive)
+        if key not in keys:
+            keys.add(key)
+            yield directive
+
+
+def collect(directives, max_workers, config=CONFIG):
+    """Iterate over ``(directive, records)`` (collected concurrently).
+
+    Directives which cannot be collected (e.g. missing commands, or commands
+    killed after a timeout) are ignored.
+    """
+    prefetcher = Prefetcher()
+    for directive in directives:
+        prefetcher.submit(directive, config, max_workers)
+    try:
+        for directive in directives:
+            try:
+                entry = prefetcher.entry(directive, config)
+            except Exception as error:  # pylint: disable=broad-except
+                print(f"{directive.name}: Ignored ({error}).", file=sys.stderr)
+                continue
+            if entry.incomplete is not None:
+                print(
+                    f"{directive.name}: Ignored ({entry.incomplete})", file=sys.stderr
+                )
+                continue
+            print(f"{directive.name}: {len(entry.records)} records.", file=sys.stderr)
+            yield directive, entry.records
+    finally:
+        prefetcher.shutdown()
+
+
+def snapshot_main(arguments):
+    """Write a snapshot of the inventories of this host."""
+    directives = list(iter_inventories(arguments.sources, arguments.suffix))
+    config = types.SimpleNamespace(
+        **{**vars(CONFIG), "packages_command_timeout": arguments.timeout}
+    )
+    snapshot.write(arguments.output, collect(directives, arguments.jobs, config))
+    print(f"Snapshot written to '{arguments.output}'.", file=sys.stderr)
+
+
+def main():
+    """Main function."""
+    parser = argparse.ArgumentParser(
+        prog="python -m sphinxcontrib.packages",
+        description=__doc__.split("\n", maxsplit=1)[0],
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot",
+        help="Collect the inventories of this host into a snapshot file.",
+        description=(
+            "Collect the inventories of this host (every directive with "
+            "default options, and the directives used in SOURCES) into a "
+            "snapshot file."
+        ),
+    )
+    snapshot_parser.add_argument(
+        "sources",
+        metavar="SOURCES",
+        nargs="*",
+        help="Sources (or directories of sources) of the documentation.",
+    )
+    snapshot_parser.add_argument(
+        "-o",
+        "--output",
+        default="packages.json.gz",
+        help="Snapshot file (default: packages.json.gz).",
+    )
+    snapshot_parser.add_argument(
+        "-s",
+        "--suffix",
+        default=".rst",
+        help="Suffix of sources, in directories of SOURCES (default: .rst).",
+    )
+    snapshot_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Maximum number of inventories collected at the same time.",
+    )
+    snapshot_parser.add_argument(
+        "-t",
+        "--timeout",
+        type=float,
+        default=None,
+        help=(
+            "Kill commands running for more than TIMEOUT seconds "
+            "(their inventories are not part of the snapshot)."
+        ),
+    )
+    snapshot_parser.set_defaults(function=snapshot_main)
+
+    arguments = parser.parse_args()
+    arguments.function(arguments)
+
+
+if __name__ == "__main__":
+    main()
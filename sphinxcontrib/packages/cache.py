@@ -0,0 +1,267 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Persistent on-disk cache of collected inventories.
+
+Each entry holds the records collected by a directive, together with a
+*fingerprint* of the files the records depend on (e.g. ``/var/lib/dpkg/status``
+for debian packages). An entry is only used if the fingerprint did not change
+since it was stored, which is much cheaper to check than running the command
+again.
+
+The cache can be shared by concurrent builds, or by the parallel processes of
+a build: :meth:`InventoryCache.lock` makes them wait for each other instead
+of collecting the same records.
+"""
+
+import contextlib
+import hashlib
+import os
+import pickle
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+#: Version of the format of cache entries. Entries of a different version are ignored.
+FORMAT = 1
+
+
+def fingerprint(paths):
+    """Return a cheap fingerprint of ``paths``.
+
+    The fingerprint is a tuple of ``(path, mtime, size)`` tuples, sorted by
+    path. Missing files are part of the fingerprint (with ``None`` as their
+    metadata), so that creating them invalidates it.
+
+    Paths starting with ``$`` are names of environment variables (e.g.
+    ``$PATH``, whose directories may be created later): their fingerprint
+    is their value.
+
+    >>> fingerprint(["/does/not/exist"])
+    (('/does/not/exist', None, None),)
+    >>> os.environ["PACKAGES_TEST"] = "foo"
+    >>> fingerprint(["$PACKAGES_TEST"])
+    (('$PACKAGES_TEST', 'foo', None),)
+    >>> del os.environ["PACKAGES_TEST"]
+    """
+    result = []
+    for path in sorted(set(paths)):
+        if path.startswith("$"):
+            result.append((path, os.environ.get(path[1:]), None))
+            continue
+        try:
+            stat = os.stat(path)
+        except OSError:
+            result.append((path, None, None))
+        else:
+            result.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(result)
+
+
+class InventoryCache:
+    """A directory of cached inventories, with a maximum size.
+
+    :param str directory: Directory where entries are stored (created if necessary).
+    :param int max_size: Maximum size (in bytes) of the cache. When it is
+        exceeded, least recently used entries are removed. If ``None``, the
+        size is not limited.
+
+    >>> directory = tempfile.mkdtemp()
+    >>> status = os.path.join(directory, "status")
+    >>> cache = InventoryCache(os.path.join(directory, "cache"))
+    >>> cache.set("key", [status], ["foo", "bar"])
+    >>> cache.get("key", [])
+    ['foo', 'bar']
+    >>> open(status, "w").close()
+    >>> print(cache.get("key", []))
+    None
+    >>> import shutil; shutil.rmtree(directory)
+    """
+
+    suffix = ".pickle"
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+
+    def _path(self, key):
+        """Return the path of the file storing entry ``key``."""
+        digest = hashlib.sha256(repr(key).encode("utf8")).hexdigest()
+        return os.path.join(self.directory, digest + self.suffix)
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """Context manager holding an exclusive lock on entry ``key``.
+
+        The lock is shared by threads and processes (on platforms without
+        :mod:`fcntl`, it does nothing).
+
+        >>> directory = tempfile.mkdtemp()
+        >>> cache = InventoryCache(directory)
+        >>> with cache.lock("key"):
+        ...     if cache.get("key", []) is None:
+        ...         cache.set("key", [], ["foo"])
+        >>> import shutil; shutil.rmtree(directory)
+        """
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock_file(self._path(key)):
+            yield
+
+    @staticmethod
+    def _lock_file(path, blocking=True):
+        """Open and lock the lock file of the entry stored at ``path``.
+
+        Return the open file, or ``None`` if ``blocking`` is false and the
+        file is already locked.
+        """
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        while True:
+            file = open(path + ".lock", "ab")  # pylint: disable=consider-using-with
+            try:
+                fcntl.flock(file, flags)
+            except BlockingIOError:
+                file.close()
+                return None
+            # The lock file may have been removed (see :meth:`evict`) while
+            # waiting for it: lock the new one instead.
+            with contextlib.suppress(FileNotFoundError):
+                if os.path.samestat(os.fstat(file.fileno()), os.stat(file.name)):
+                    return file
+            file.close()
+
+    def get(self, key, paths):
+        """Return the records stored for ``key``, or ``None``.
+
+        :param key: Key of the entry (any object with a stable :func:`repr`).
+        :param list paths: Paths the entry depends on. Those paths are added
+            to the ones which were recorded when the entry was stored.
+
+        ``None`` is returned if there is no such entry, or if the fingerprint
+        of its paths changed since it was stored.
+        """
+        entry = self.get_entry(key, paths)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def get_entry(self, key, paths):
+        """Return the ``(paths, records)`` entry stored for ``key``, or ``None``.
+
+        Same as :meth:`get`, but the paths which were recorded when the entry
+        was stored are returned as well.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                version, stored_key, stored_paths, stored_fingerprint, records = (
+                    pickle.load(file)
+                )
+        except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return None
+        if version != FORMAT or stored_key != repr(key):
+            return None
+        if fingerprint(set(stored_paths) | set(paths)) != stored_fingerprint:
+            return None
+
+        # Mark the entry as recently used
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return stored_paths, records
+
+    def set(self, key, paths, records):
+        """Store ``records`` as the entry ``key``, depending on ``paths``."""
+        os.makedirs(self.directory, exist_ok=True)
+        paths = sorted(set(paths))
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, suffix=".tmp", delete=False
+        ) as file:
+            pickle.dump(
+                (FORMAT, repr(key), paths, fingerprint(paths), records),
+                file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(file.name, self._path(key))
+        self.evict()
+
+    def remove(self, path):
+        """Remove the entry stored at ``path``, and its lock file.
+
+        Entries which are locked (e.g. being collected by another process)
+        are not removed. Return ``True`` iff the entry has been removed.
+        """
+        if fcntl is None:
+            try:
+                os.remove(path)
+            except OSError:
+                return False
+            return True
+
+        lock = self._lock_file(path, blocking=False)
+        if lock is None:
+            return False
+        with lock:
+            # The lock file is removed while it is locked: processes waiting
+            # for it will lock a new one.
+            with contextlib.suppress(OSError):
+                os.remove(lock.name)
+            try:
+                os.remove(path)
+            except OSError:
+                return False
+            return True
+
+    def evict(self):
+        """Remove least recently used entries, until cache size is below its limit.
+
+        Lock files are removed with their entries.
+
+        >>> directory = tempfile.mkdtemp()
+        >>> cache = InventoryCache(directory, max_size=0)
+        >>> with cache.lock("key"):
+        ...     cache.set("key", [], ["foo"])
+        >>> cache.set("other", [], ["bar"])
+        >>> os.listdir(directory)
+        []
+        >>> import shutil; shutil.rmtree(directory)
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(self.suffix):
+                continue
+            with contextlib.suppress(OSError):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total = sum(size for __mtime, size, __path in entries)
+        for __mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            if self.remove(path):
+                total -= size
+
+    @classmethod
+    def from_config(cls, config):
+        """Return the cache configured in sphinx ``config``, or ``None`` if disabled."""
+        if not config.packages_cache_dir:
+            return None
+        return cls(config.packages_cache_dir, config.packages_cache_size)
@@ -0,0 +1,148 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Run commands with a time limit, and a limit on the size of their output.
+
+A command which does not end in time (e.g. ``dpkg-query`` waiting for a lock,
+or a Python module blocking while it is imported), or whose output is too
+large, is killed (with its children), and what it wrote so far is kept.
+
+>>> with Command(["printf", "foo\\\\nbar\\\\nbaz\\\\n"], max_output=9) as command:
+...     command.stdout.read()
+b'foo\\nbar\\n'
+>>> command.interrupted
+'Output of command printf was truncated to 9 bytes.'
+>>> with Command(["sh", "-c", "echo foo; sleep 60"], timeout=0.5) as command:
+...     command.stdout.read()
+b'foo\\n'
+>>> command.interrupted
+'Command sh was killed after 0.5 seconds.'
+"""
+
+import os
+import signal
+import subprocess
+import threading
+
+
+class LimitedReader:  # pylint: disable=too-few-public-methods
+    """Wrap binary ``stream``, reading complete lines, up to ``max_size`` bytes.
+
+    When the limit is reached, ``on_truncate`` is called, and the stream is
+    considered to be over.
+    """
+
+    def __init__(self, stream, max_size=None, on_truncate=None):
+        self.stream = stream
+        self.remaining = max_size
+        self.on_truncate = on_truncate
+
+    def read(self, size=-1):
+        """Read (at most) ``size`` bytes."""
+        if self.remaining is None:
+            return self.stream.read(size)
+        if self.remaining < 0:
+            return b""
+        # Read one more byte, to know whether the output is truncated
+        if size < 0 or size > self.remaining:
+            size = self.remaining + 1
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            # Drop the last (incomplete) line
+            data = data[: data.rfind(b"\n", 0, len(data) + self.remaining) + 1]
+            if self.on_truncate is not None:
+                self.on_truncate()
+        return data
+
+
+def kill(process):
+    """Kill ``process``, and the processes of its group (e.g. its children)."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # The group is already gone (or only contains zombies)
+        pass
+
+
+class Command:
+    """Context manager running ``args``, whose output is read from :attr:`stdout`.
+
+    :param list args: Command to run.
+    :param float timeout: Number of seconds after which the command is
+        killed (``None`` means no limit).
+    :param int max_output: Number of bytes of the output after which the
+        command is killed (``None`` means no limit).
+
+    If the command is killed, :attr:`interrupted` is a message telling why.
+    The command is run in its own process group, so that its children are
+    killed as well.
+    """
+
+    def __init__(self, args, timeout=None, max_output=None):
+        self.args = args
+        self.timeout = timeout
+        self.max_output = max_output
+        self.interrupted = None
+        self.process = None
+        self.stdout = None
+        self._timer = None
+
+    def interrupt(self, message):
+        """Kill the command (keeping the first message, if killed twice)."""
+        if self.interrupted is None:
+            self.interrupted = message
+        kill(self.process)
+
+    def _on_timeout(self):
+        self.interrupt(
+            f"Command {os.path.basename(str(self.args[0]))} "
+            f"was killed after {self.timeout} seconds."
+        )
+
+    def _on_truncate(self):
+        self.interrupt(
+            f"Output of command {os.path.basename(str(self.args[0]))} "
+            f"was truncated to {self.max_output} bytes."
+        )
+
+    def __enter__(self):
+        self.process = subprocess.Popen(  # pylint: disable=consider-using-with
+            self.args,
+            stdin=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            start_new_session=True,
+        )
+        if self.timeout is not None:
+            self._timer = threading.Timer(self.timeout, self._on_timeout)
+            self._timer.daemon = True
+            self._timer.start()
+        self.stdout = LimitedReader(
+            self.process.stdout, self.max_output, self._on_truncate
+        )
+        return self
+
+    def __exit__(self, exc_type, __exc_value, __traceback):
+        if exc_type is not None:
+            kill(self.process)
+        # The timer is still running: waiting is bounded by the timeout as well
+        self.process.stdout.close()
+        self.process.wait()
+        if self._timer is not None:
+            self._timer.cancel()
+        if self.interrupted is not None:
+            # Children may have survived their parent
+            kill(self.process)
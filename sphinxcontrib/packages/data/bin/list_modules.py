@@ -19,10 +19,20 @@
 
 # pylint: disable=consider-using-f-string
 
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import importlib.machinery
 import logging
 import os
 import pkgutil
+import re
+import resource
+import selectors
+import subprocess
 import sys
+import time
 import types
 
 LOGGER = logging.getLogger()
@@ -59,24 +69,642 @@ def get_version(module):
     return ""
 
 
-def module_list():
-    """Yield the list of modules (with version and path)."""
+def top_level_names(distribution):
+    """Return the set of names of top-level modules provided by ``distribution``.
+
+    This is similar to :func:`importlib.metadata.packages_distributions`,
+    which is not available before python3.10.
+    """
+    text = distribution.read_text("top_level.txt")
+    if text:
+        return {name.strip() for name in text.split() if name.strip()}
+
+    names = set()
+    for file in distribution.files or []:
+        parts = file.parts
+        if len(parts) > 1:
+            if parts[0].endswith((".dist-info", ".egg-info")) or parts[0] in (
+                "..",
+                "__pycache__",
+            ):
+                continue
+            names.add(parts[0])
+        elif file.suffix in (".py", ".so", ".pyd"):
+            names.add(file.name.split(".")[0])
+    return names
+
+
+def submodule_names(distribution, depth):
+    """Return the set of names of submodules provided by ``distribution``.
+
+    Only submodules at most ``depth`` levels below top-level modules are
+    returned (e.g. ``foo.bar`` is one level below ``foo``).
+    """
+    names = set()
+    for file in distribution.files or []:
+        parts = file.parts
+        if (
+            parts[0].endswith((".dist-info", ".egg-info"))
+            or parts[0] == ".."
+            or "__pycache__" in parts
+            or file.suffix not in (".py", ".so", ".pyd")
+        ):
+            continue
+        modules = list(parts[:-1]) + [file.name.split(".")[0]]
+        if modules[-1] == "__init__":
+            modules.pop()
+        for length in range(2, min(len(modules), depth + 1) + 1):
+            names.add(".".join(modules[:length]))
+    return names
+
+
+def metadata_versions(depth=0):
+    """Return a dictionary of versions of modules, read from metadata.
+
+    Metadata (``.dist-info`` and ``.egg-info`` directories) is read without
+    importing any module. If ``depth`` is positive, versions of submodules (at
+    most ``depth`` levels below top-level modules) are returned as well.
+
+    The version of a module provided by several distributions (e.g. a
+    namespace package) is an empty string. A distribution installed several
+    times (in different directories of :data:`sys.path`) is only counted
+    once: the first one (which shadows the others) wins.
+    """
+    try:
+        from importlib import metadata  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return {}
+
+    # Dictionary of modules: values are dictionaries of {distribution: version}
+    providers = collections.defaultdict(dict)
+    for distribution in metadata.distributions():
+        try:
+            project = re.sub(r"[-_.]+", "-", distribution.metadata["Name"] or "")
+            version = distribution.version
+            names = top_level_names(distribution)
+            if depth:
+                names |= submodule_names(distribution, depth)
+        except Exception as error:  # pylint: disable=broad-except
+            LOGGER.warning("Error while reading metadata: %s.", error)
+            continue
+        for name in names:
+            providers[name].setdefault(project.lower(), version)
+    return {
+        name: next(iter(versions.values())) if len(versions) == 1 else ""
+        for name, versions in providers.items()
+    }
+
+
+def find_spec(finder, name):
+    """Return the spec of module ``name`` (found by ``finder``), without importing it.
+
+    Return ``None`` if the module cannot be found.
+    """
+    try:
+        return finder.find_spec(name)
+    except Exception:  # pylint: disable=broad-except
+        return None
+
+
+def spec_path(spec):
+    """Return the path of the module of ``spec``."""
+    if spec is None:
+        return ""
+    if spec.origin and spec.origin != "namespace":
+        return spec.origin
+    if spec.submodule_search_locations:
+        # Namespace package
+        return list(spec.submodule_search_locations)[0]
+    return ""
+
+
+def import_module(name):
+    """Import module ``name``, and return its version and path."""
+    module = __import__(name)
+    # Namespace packages have no file
+    path = module.__file__ or next(iter(getattr(module, "__path__", [])), "")
+    return get_version(module), path
+
+
+def probe(name):
+    """Import module ``name``, and return a ``(name, version, path, error)`` tuple.
+
+    If import failed, ``version`` and ``path`` are empty, and ``error``
+    describes the error. Otherwise, ``error`` is empty.
+    """
+    try:
+        return (name, *import_module(name), "")
+    except BaseException as error:  # pylint: disable=broad-except
+        LOGGER.warning("Error while importing %s: %s.", name, error)
+        return (name, "", "", f"{error.__class__.__name__}: {error}")
+
+
+def sanitize(text):
+    """Replace tabulations and newlines (which are field and row separators)."""
+    return " ".join(str(text).split("\n")).replace("\t", " ")
+
+
+#: Extra field of a result, telling that the worker exits after sending it.
+RECYCLE = "recycle"
+
+
+class Worker:
+    """A subprocess importing modules, one at a time.
+
+    Names of modules are written on its standard input, and results are read
+    (in the same format as the output of this program) on its standard output.
+    A result with an extra :data:`RECYCLE` field is the last one sent by the
+    worker (which exits because it uses too much memory).
+    """
+
+    def __init__(self, max_memory=None):
+        command = [sys.executable, __file__, "--worker"]
+        if max_memory:
+            command.extend(["--max-memory", str(max_memory)])
+        # pylint: disable=consider-using-with
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+        )
+        self.name = None
+        self.deadline = None
+        self.count = 0
+        self.recycling = False
+
+    def submit(self, name, timeout=None):
+        """Ask this worker to import module ``name``.
+
+        Return ``False`` if the worker cannot be reached (it has exited).
+        """
+        self.name = name
+        self.count += 1
+        if timeout:
+            self.deadline = time.monotonic() + timeout
+        try:
+            self.process.stdin.write(name + "\n")
+            self.process.stdin.flush()
+        except OSError:
+            return False
+        return True
+
+    def read(self):
+        """Read the result of the current import.
+
+        Return a ``(name, version, path, error)`` tuple, or ``None`` if the
+        worker exited without answering (its exit code is then available as
+        ``self.process.returncode``).
+        """
+        self.name, self.deadline = None, None
+        line = self.process.stdout.readline()
+        if not line:
+            self.process.wait()
+            return None
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) > 4 and fields[4] == RECYCLE:
+            self.recycling = True
+        return tuple(fields[:4])
+
+    def stop(self):
+        """Stop the worker (waiting for it if it is idle, killing it otherwise)."""
+        if self.name is None:
+            with contextlib.suppress(OSError):
+                self.process.stdin.close()
+            try:
+                self.process.wait(timeout=1)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+        # Workers stay in the process group of this program: killing this group
+        # (e.g. on timeout) also kills them
+        self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+        with contextlib.suppress(OSError):
+            self.process.stdin.close()
+
+    def alive(self):
+        """Return ``True`` iff the worker process is still running."""
+        return self.process.poll() is None
+
+    def reusable(self, max_imports=None):
+        """Return ``True`` iff the worker can import another module."""
+        return (
+            not self.recycling
+            and self.alive()
+            and not (max_imports and self.count >= max_imports)
+        )
+
+
+def start_worker(workers, name, timeout=None, max_memory=None):
+    """Submit module ``name`` to an idle worker of ``workers``, or to a new one.
+
+    Idle workers which cannot be reached (they have exited) are replaced.
+    Return the worker.
+    """
+    worker = workers.pop() if workers else None
+    if worker is None or not worker.submit(name, timeout):
+        if worker is not None:
+            worker.stop()
+        worker = Worker(max_memory)
+        # If the new worker cannot be reached, Worker.read() tells it
+        worker.submit(name, timeout)
+    return worker
+
+
+def read_result(worker, todo, resubmitted):
+    """Read the result of ``worker``.
+
+    If the worker exited cleanly without answering (it was recycling when the
+    module was submitted), the module is put back at the beginning of
+    ``todo``, and ``None`` is returned. This only happens once per module
+    (whose names are stored in set ``resubmitted``): the second time, the
+    worker is reported as dead.
+    """
+    name = worker.name
+    result = worker.read()
+    if result is not None:
+        return result
+    if worker.process.returncode == 0 and name not in resubmitted:
+        resubmitted.add(name)
+        todo.appendleft(name)
+        return None
+    return (name, "", "", f"Worker died (exit code {worker.process.returncode}).")
+
+
+def next_timeout(selector):
+    """Return the time until the first deadline of the busy workers (or ``None``)."""
+    deadlines = [
+        key.data.deadline
+        for key in selector.get_map().values()
+        if key.data.deadline is not None
+    ]
+    if deadlines:
+        return max(0, min(deadlines) - time.monotonic())
+    return None
+
+
+def pool_probe(names, jobs, timeout=None, max_imports=None, max_memory=None):
+    """Import modules ``names`` in a pool of ``jobs`` worker processes.
+
+    Iterate over ``(name, version, path, error)`` tuples, as soon as they are available.
+
+    :param int jobs: Number of worker processes.
+    :param float timeout: Maximum time (in seconds) to import a single module.
+    :param int max_imports: Workers are replaced after this number of imports.
+    :param int max_memory: Workers are replaced when their memory usage
+        exceeds this value (in MiB).
+    """
+    todo = collections.deque(names)
+    workers = []
+    resubmitted = set()
+    with selectors.DefaultSelector() as selector:
+        try:
+            while todo or selector.get_map():
+                # Start workers, and give them some work
+                while todo and len(selector.get_map()) < jobs:
+                    worker = start_worker(workers, todo.popleft(), timeout, max_memory)
+                    selector.register(
+                        worker.process.stdout, selectors.EVENT_READ, worker
+                    )
+
+                for key, __events in selector.select(next_timeout(selector)):
+                    worker = key.data
+                    selector.unregister(worker.process.stdout)
+                    result = read_result(worker, todo, resubmitted)
+                    if result is not None:
+                        yield result
+                    if result is not None and worker.reusable(max_imports):
+                        workers.append(worker)
+                    else:
+                        worker.stop()
+
+                # Kill workers which timed out
+                now = time.monotonic()
+                for key in list(selector.get_map().values()):
+                    worker = key.data
+                    if worker.deadline is not None and worker.deadline <= now:
+                        selector.unregister(worker.process.stdout)
+                        name = worker.name
+                        worker.stop()
+                        yield (name, "", "", f"Timeout ({timeout}s).")
+        finally:
+            for key in list(selector.get_map().values()):
+                key.data.stop()
+            for worker in workers:
+                worker.stop()
+
+
+def worker_main(max_memory=None):
+    """Import modules whose names are read on standard input."""
+    # Modules may read from standard input or write to standard output:
+    # keep private copies of those for the communication with the parent process.
+    commands = os.fdopen(os.dup(0), "r")
+    results = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+
+    for line in commands:
+        fields = [sanitize(field) for field in probe(line.strip())]
+        # On Linux, ru_maxrss is in KiB
+        recycle = (
+            max_memory
+            and resource.getrusage(resource.RUSAGE_SELF).ru_maxrss > max_memory * 1024
+        )
+        if recycle:
+            # Tell the parent process not to submit anything else
+            fields.append(RECYCLE)
+        results.write("\t".join(fields))
+        results.write("\n")
+        results.flush()
+        if recycle:
+            break
+
+
+def namespace_packages(locations, prefix=""):
+    """Iterate over ``(name, locations)`` of namespace packages found in ``locations``.
+
+    Namespace packages are directories without ``__init__`` files: they are
+    ignored by :func:`pkgutil.iter_modules`. The returned ``locations`` are
+    the directories of the package (which may be split across ``locations``).
+    """
+    seen = set()
+    for location in locations:
+        try:
+            entries = sorted(os.listdir(location))
+        except OSError:
+            continue
+        for entry in entries:
+            if (
+                entry in seen
+                or entry.startswith("_")
+                or not entry.isidentifier()
+                or not os.path.isdir(os.path.join(location, entry))
+            ):
+                continue
+            seen.add(entry)
+            try:
+                spec = importlib.machinery.PathFinder.find_spec(
+                    prefix + entry, locations
+                )
+            except Exception:  # pylint: disable=broad-except
+                continue
+            if (
+                spec is not None
+                and spec.origin in (None, "namespace")
+                and spec.submodule_search_locations
+            ):
+                yield prefix + entry, list(spec.submodule_search_locations)
+
+
+def walk(package):
+    """Return the list of ``(name, path)`` of the submodules of a package.
+
+    :param tuple package: ``(name, locations, depth)``, where ``locations`` are
+        the directories of the package, and ``depth`` the number of levels of
+        submodules to walk.
+
+    Packages are not imported: submodules are found by listing directories
+    (see :func:`pkgutil.iter_modules` and :func:`namespace_packages`).
+    """
+    name, locations, depth = package
+    found = []
+    subpackages = []
+    for finder, subname, ispkg in pkgutil.iter_modules(locations, f"{name}."):
+        if subname.rpartition(".")[2].startswith("_"):
+            continue
+        spec = find_spec(finder, subname)
+        if spec is None:
+            continue
+        found.append((subname, spec_path(spec)))
+        if ispkg and spec.submodule_search_locations:
+            subpackages.append((subname, list(spec.submodule_search_locations)))
+    namespaces = list(namespace_packages(locations, f"{name}."))
+    if depth > 1:
+        for subname, sublocations in subpackages:
+            found.extend(walk((subname, sublocations, depth - 1)))
+    for subname, sublocations in namespaces:
+        # Namespace packages are only listed if they contain modules
+        submodules = walk((subname, sublocations, depth - 1)) if depth > 1 else []
+        if submodules:
+            found.append((subname, sublocations[0]))
+            found.extend(submodules)
+    return found
+
+
+def walk_packages(packages, namespaces, jobs=0):
+    """Return the list of ``(name, path)`` of the submodules of packages.
+
+    :param list packages: Packages, as ``(name, locations, depth)`` tuples
+        (see :func:`walk`).
+    :param list namespaces: Namespace packages (same format): they are
+        listed as well, if they contain modules.
+    :param int jobs: If positive, packages are walked in this number of
+        worker processes.
+    """
+    tasks = packages + namespaces
+    if jobs > 0:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            submodules = list(
+                executor.map(walk, tasks, chunksize=max(1, len(tasks) // (4 * jobs)))
+            )
+    else:
+        submodules = list(map(walk, tasks))
+    found = [module for modules in submodules[: len(packages)] for module in modules]
+    for (name, locations, __depth), modules in zip(
+        namespaces, submodules[len(packages) :]
+    ):
+        if modules:
+            found.append((name, locations[0]))
+            found.extend(modules)
+    return found
+
+
+def iter_names(include=None, exclude=None, limit=None, depth=0, jobs=0):
+    """Return the list of ``(name, path)`` of modules.
+
+    :param str include: Only names matching this regular expression are kept.
+    :param str exclude: Names matching this regular expression are discarded.
+    :param int limit: Only the first ``limit`` names (in alphabetical order)
+        are kept.
+    :param int depth: Submodules, at most ``depth`` levels below top-level
+        modules, are listed as well (see :func:`walk`), as well as namespace
+        packages (which contain at least one of those submodules).
+    :param int jobs: If positive, packages are walked in this number of
+        worker processes.
+
+    Private modules (starting with ``_``) and this program are ignored.
+    Since packages are walked without being imported, ``include`` and
+    ``exclude`` are applied to the names of submodules as well.
+    """
+    include = re.compile(include) if include else None
+    exclude = re.compile(exclude) if exclude else None
+    directory = os.path.dirname(os.path.abspath(__file__))
+    found = []
+    packages = []
+    for finder, name, ispkg in pkgutil.iter_modules():
+        if name.startswith("_") or getattr(finder, "path", None) == directory:
+            continue
+        spec = find_spec(finder, name)
+        found.append((name, spec_path(spec)))
+        if depth and ispkg and spec is not None and spec.submodule_search_locations:
+            packages.append((name, list(spec.submodule_search_locations), depth))
+
+    if depth:
+        known = {name for name, __path in found}
+        namespaces = [
+            (name, locations, depth)
+            for name, locations in namespace_packages(
+                [path for path in sys.path if path and path != directory]
+            )
+            if name not in known
+        ]
+        found.extend(walk_packages(packages, namespaces, jobs))
+
+    found = [
+        (name, path)
+        for name, path in found
+        if (include is None or include.search(name) is not None)
+        and (exclude is None or exclude.search(name) is None)
+    ]
+    if limit is not None or depth:
+        found = sorted(found, key=lambda item: item[0])[:limit]
+    return found
+
+
+def module_list(  # pylint: disable=too-many-arguments
+    metadata=False,
+    jobs=0,
+    timeout=None,
+    max_imports=None,
+    max_memory=None,
+    *,
+    selection=None,
+):
+    """Yield the list of modules, as ``(name, version, path, error)`` tuples.
+
+    If ``metadata`` is true, versions and paths of modules are read from
+    distribution metadata, without importing modules. Modules are only
+    imported if they do not belong to any distribution.
+
+    If ``jobs`` is positive, modules are imported in a pool of ``jobs`` worker
+    processes (see :func:`pool_probe` for the other arguments), so that a
+    module which hangs, crashes or exits during its import does not affect
+    the others. Otherwise, they are imported in the current process.
+
+    Only modules selected by ``selection`` (a dictionary of arguments of
+    :func:`iter_names`) are listed: other ones are never imported. If it
+    contains a positive ``depth``, submodules are listed as well (packages
+    are walked in ``jobs`` worker processes). Submodules are never imported
+    (this would run scripts and test suites found in packages): their
+    version is only read from metadata.
+    """
     while True:
         try:
             sys.path.remove(os.getcwd())
         except ValueError:
             break
 
-    for __importer, name, __ignored in pkgutil.iter_modules():
-        if name.startswith("_"):
-            continue
-        try:
-            module = __import__(name)
-            yield name, get_version(module), module.__file__
-        except BaseException as error:  # pylint: disable=broad-except
-            LOGGER.warning("Error while importing %s: %s.", name, error)
+    selection = selection or {}
+    versions = metadata_versions(selection.get("depth", 0)) if metadata else {}
+
+    names = []
+    for name, path in iter_names(**selection, jobs=jobs):
+        if name in versions or "." in name:
+            yield name, versions.get(name, ""), path, ""
+        else:
+            names.append(name)
+
+    if jobs > 0:
+        yield from pool_probe(names, jobs, timeout, max_imports, max_memory)
+    else:
+        for name in names:
+            yield probe(name)
+
+
+def main():
+    """Main function: print the list of modules."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--metadata",
+        action="store_true",
+        help="Read versions from distribution metadata instead of importing modules.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="Import modules in this number of worker processes.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Maximum time (in seconds) to import a module (with --jobs only).",
+    )
+    parser.add_argument(
+        "--max-imports",
+        type=int,
+        default=None,
+        help="Replace worker processes after this number of imports.",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=None,
+        help="Replace worker processes which use more than this memory (in MiB).",
+    )
+    parser.add_argument(
+        "--include",
+        default=None,
+        help="Only list modules whose names match this regular expression.",
+    )
+    parser.add_argument(
+        "--exclude",
+        default=None,
+        help="Do not list modules whose names match this regular expression.",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="Only list the first modules (in alphabetical order).",
+    )
+    parser.add_argument(
+        "--depth",
+        type=int,
+        default=0,
+        help=(
+            "Also list submodules (and namespace packages), "
+            "at most this number of levels below top-level modules."
+        ),
+    )
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.worker:
+        worker_main(arguments.max_memory)
+        return
+
+    for row in module_list(
+        metadata=arguments.metadata,
+        jobs=arguments.jobs,
+        timeout=arguments.timeout,
+        max_imports=arguments.max_imports,
+        max_memory=arguments.max_memory,
+        selection={
+            "include": arguments.include,
+            "exclude": arguments.exclude,
+            "limit": arguments.limit,
+            "depth": arguments.depth,
+        },
+    ):
+        print("\t".join(sanitize(field) for field in row), flush=True)
 
 
 if __name__ == "__main__":
-    for package, version, path in module_list():
-        print(f"{package}\t{version}\t{path}")
+    main()
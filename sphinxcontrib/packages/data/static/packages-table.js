@@ -0,0 +1,257 @@
+/*
+ * Virtual tables of sphinxcontrib-packages (see sphinxcontrib/packages/table.py).
+ *
+ * Cells of large tables are stored in a compressed JSON file: only the rows
+ * which are visible are turned into DOM nodes. Rows can be sorted (by clicking
+ * on headers) and filtered.
+ */
+(function () {
+  "use strict";
+
+  // Number of rows rendered above and below the visible ones
+  var OVERSCAN = 20;
+
+  function decompress(buffer) {
+    var bytes = new Uint8Array(buffer);
+    if (bytes[0] !== 0x1f || bytes[1] !== 0x8b) {
+      // Already decompressed by the browser (served with Content-Encoding)
+      return Promise.resolve(buffer);
+    }
+    var stream = new Blob([bytes])
+      .stream()
+      .pipeThrough(new DecompressionStream("gzip"));
+    return new Response(stream).arrayBuffer();
+  }
+
+  function load(url) {
+    return fetch(url)
+      .then(function (response) {
+        if (!response.ok) {
+          throw new Error(response.status + " " + response.statusText);
+        }
+        return response.arrayBuffer();
+      })
+      .then(decompress)
+      .then(function (buffer) {
+        return JSON.parse(new TextDecoder().decode(buffer));
+      });
+  }
+
+  function cellText(cell) {
+    if (typeof cell === "string") {
+      return cell;
+    }
+    return cell
+      .map(function (item) {
+        return typeof item === "string" ? item : item[1];
+      })
+      .join("");
+  }
+
+  function inlineNode(item) {
+    if (typeof item === "string") {
+      return document.createTextNode(item);
+    }
+    var node;
+    if (item[0] === "literal") {
+      node = document.createElement("code");
+      node.className = "docutils literal notranslate";
+    } else if (item[0] === "emphasis") {
+      node = document.createElement("em");
+    } else if (item[0] === "strong") {
+      node = document.createElement("strong");
+    } else if (item[0] === "link") {
+      node = document.createElement("a");
+      node.className = "reference external";
+      node.href = item[2];
+    } else {
+      node = document.createElement("span");
+    }
+    node.textContent = item[1];
+    return node;
+  }
+
+  function cellNode(tag, cell) {
+    var node = document.createElement(tag);
+    if (typeof cell === "string") {
+      node.textContent = cell;
+    } else {
+      cell.forEach(function (item) {
+        node.appendChild(inlineNode(item));
+      });
+    }
+    return node;
+  }
+
+  function VirtualTable(container, data) {
+    var self = this;
+    var columns = data.columns;
+    this.rows = [];
+    for (var index = 0; index < columns[0].length; index++) {
+      var cells = columns.map(function (column) {
+        return column[index];
+      });
+      this.rows.push({
+        cells: cells,
+        text: cells.map(cellText).join("\t").toLowerCase(),
+      });
+    }
+    this.view = this.rows;
+    this.sorted = null;
+    this.rowHeight = 0;
+
+    this.search = document.createElement("input");
+    this.search.type = "search";
+    this.search.placeholder = "Filter";
+    this.count = document.createElement("span");
+    this.count.className = "packages-virtual-count";
+    var toolbar = document.createElement("div");
+    toolbar.className = "packages-virtual-toolbar";
+    toolbar.appendChild(this.search);
+    toolbar.appendChild(this.count);
+
+    this.viewport = document.createElement("div");
+    this.viewport.className = "packages-virtual-viewport";
+    var table = document.createElement("table");
+    table.className = "docutils align-default";
+    if (data.headers.length) {
+      var thead = document.createElement("thead");
+      var header = document.createElement("tr");
+      data.headers.forEach(function (cell, column) {
+        var th = cellNode("th", cell);
+        th.className = "head";
+        th.title = "Sort";
+        th.addEventListener("click", function () {
+          self.sort(column, th);
+        });
+        header.appendChild(th);
+      });
+      thead.appendChild(header);
+      table.appendChild(thead);
+    }
+    this.body = document.createElement("tbody");
+    table.appendChild(this.body);
+    this.viewport.appendChild(table);
+
+    container.textContent = "";
+    container.appendChild(toolbar);
+    container.appendChild(this.viewport);
+
+    var timeout = null;
+    this.search.addEventListener("input", function () {
+      clearTimeout(timeout);
+      timeout = setTimeout(function () {
+        self.filter();
+      }, 150);
+    });
+    var scheduled = false;
+    this.viewport.addEventListener("scroll", function () {
+      if (!scheduled) {
+        scheduled = true;
+        requestAnimationFrame(function () {
+          scheduled = false;
+          self.render();
+        });
+      }
+    });
+    this.filter();
+  }
+
+  VirtualTable.prototype.filter = function () {
+    var query = this.search.value.trim().toLowerCase();
+    var rows = this.sorted || this.rows;
+    this.view = query
+      ? rows.filter(function (row) {
+          return row.text.indexOf(query) !== -1;
+        })
+      : rows;
+    this.count.textContent =
+      this.view.length + " / " + this.rows.length + " rows";
+    this.viewport.scrollTop = 0;
+    this.render();
+  };
+
+  VirtualTable.prototype.sort = function (column, th) {
+    var descending = th.getAttribute("aria-sort") === "ascending";
+    this.viewport.querySelectorAll("th").forEach(function (other) {
+      other.removeAttribute("aria-sort");
+    });
+    th.setAttribute("aria-sort", descending ? "descending" : "ascending");
+    var collator = new Intl.Collator(undefined, { numeric: true });
+    var keys = new Map();
+    this.rows.forEach(function (row) {
+      keys.set(row, cellText(row.cells[column]));
+    });
+    this.sorted = this.rows.slice().sort(function (first, second) {
+      var order = collator.compare(keys.get(first), keys.get(second));
+      return descending ? -order : order;
+    });
+    this.filter();
+  };
+
+  VirtualTable.prototype.spacer = function (height) {
+    var row = document.createElement("tr");
+    row.className = "packages-virtual-spacer";
+    row.style.height = height + "px";
+    return row;
+  };
+
+  VirtualTable.prototype.render = function () {
+    var self = this;
+    if (!this.rowHeight && this.view.length) {
+      // Rows have a fixed height (cells do not wrap): measure one
+      this.body.textContent = "";
+      this.body.appendChild(this.row(this.view[0]));
+      this.rowHeight = this.body.firstChild.getBoundingClientRect().height || 24;
+    }
+    var height = this.rowHeight || 24;
+    var start = Math.max(
+      Math.floor(this.viewport.scrollTop / height) - OVERSCAN,
+      0
+    );
+    var end = Math.min(
+      Math.ceil((this.viewport.scrollTop + this.viewport.clientHeight) / height) +
+        OVERSCAN,
+      this.view.length
+    );
+    var fragment = document.createDocumentFragment();
+    fragment.appendChild(this.spacer(start * height));
+    this.view.slice(start, end).forEach(function (row) {
+      fragment.appendChild(self.row(row));
+    });
+    fragment.appendChild(this.spacer((this.view.length - end) * height));
+    this.body.textContent = "";
+    this.body.appendChild(fragment);
+  };
+
+  VirtualTable.prototype.row = function (row) {
+    var node = document.createElement("tr");
+    row.cells.forEach(function (cell) {
+      node.appendChild(cellNode("td", cell));
+    });
+    return node;
+  };
+
+  function init() {
+    document
+      .querySelectorAll("div.packages-virtual-table[data-src]")
+      .forEach(function (container) {
+        container.textContent =
+          "Loading " + container.getAttribute("data-rows") + " rows…";
+        load(container.getAttribute("data-src"))
+          .then(function (data) {
+            new VirtualTable(container, data);
+          })
+          .catch(function (error) {
+            container.textContent =
+              "Cannot load this table (" + error.message + ").";
+          });
+      });
+  }
+
+  if (document.readyState === "loading") {
+    document.addEventListener("DOMContentLoaded", init);
+  } else {
+    init();
+  }
+})();
@@ -0,0 +1,85 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Read documents again when the information they display changes.
+
+Sphinx only reads a document again if its source changed. When a directive is
+run, the fingerprint of the paths its records depend on (e.g.
+``/var/lib/dpkg/status``, directories of ``PATH`` and the variable itself,
+site directories of a python interpreter) is stored into the environment. On the next build, only
+documents for which one of those fingerprints changed are marked as outdated.
+
+>>> import types
+>>> env = types.SimpleNamespace()
+>>> init(env)
+>>> note(env, "index", ["/does/not/exist"])
+>>> env_get_outdated(None, env, set(), set(), set())
+[]
+>>> env.packages_dependencies["index"]["/does/not/exist"] = (0, 0)
+>>> env_get_outdated(None, env, set(), set(), set())
+['index']
+>>> note(env, "path", ["$PATH"])
+>>> env.packages_dependencies["path"]["$PATH"] = ("/previous/value", None)
+>>> env_get_outdated(None, env, set(), set(), set())
+['index', 'path']
+"""
+
+from .cache import fingerprint
+
+
+def init(env):
+    """Initialize the environment (unless it has been loaded from a previous build).
+
+    Attribute ``packages_dependencies`` of the environment maps names of
+    documents to dictionaries of ``{path: (mtime, size)}`` (see
+    :func:`~sphinxcontrib.packages.cache.fingerprint`).
+    """
+    if not hasattr(env, "packages_dependencies"):
+        env.packages_dependencies = {}
+
+
+def note(env, docname, paths):
+    """Record that document ``docname`` depends on ``paths`` (in their current state)."""
+    env.packages_dependencies.setdefault(docname, {}).update(
+        (path, (mtime, size)) for path, mtime, size in fingerprint(paths)
+    )
+
+
+def env_get_outdated(__app, env, __added, changed, removed):
+    """Return the documents for which the fingerprint of a dependency changed."""
+    current = {}
+    outdated = []
+    for docname, stored in env.packages_dependencies.items():
+        if docname in changed or docname in removed:
+            continue
+        for path, stat in stored.items():
+            if path not in current:
+                current[path] = fingerprint([path])[0][1:]
+            if current[path] != stat:
+                outdated.append(docname)
+                break
+    return outdated
+
+
+def env_purge_doc(__app, env, docname):
+    """Forget about dependencies of ``docname`` (which is about to be read again)."""
+    env.packages_dependencies.pop(docname, None)
+
+
+def env_merge_info(__app, env, docnames, other):
+    """Merge dependencies of ``docnames`` read by a parallel process."""
+    for docname in docnames:
+        if docname in other.packages_dependencies:
+            env.packages_dependencies[docname] = other.packages_dependencies[docname]
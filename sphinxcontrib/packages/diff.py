@@ -0,0 +1,242 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Compare two inventories (``packages:diff`` directive).
+
+Rows of both inventories (see :meth:`InventoryDirective.export`) are sorted by
+key, and then compared using a merge-join: both sorted lists are traversed
+once, at the same time, and only changes are kept. Snapshots store rows which
+are already sorted by key (see :func:`sphinxcontrib.packages.snapshot.write`):
+they are not sorted again.
+"""
+
+import itertools
+import operator
+
+from docutils import nodes
+from docutils.parsers.rst import Directive, directives
+
+from . import dependencies, ldcache, snapshot, table
+from .prefetch import PREFETCHER
+
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+
+def ascending(pairs):
+    """Return the list of ``(key, values)`` tuples ``pairs``, sorted by key.
+
+    Pairs are only sorted if they are not already sorted (keys are checked
+    while pairs are read).
+
+    >>> ascending([(1, "a"), (1, "b"), (2, "c")])
+    [(1, 'a'), (1, 'b'), (2, 'c')]
+    >>> ascending([(2, "c"), (1, "b"), (1, "a")])
+    [(1, 'b'), (1, 'a'), (2, 'c')]
+    """
+    pairs = iter(pairs)
+    result = []
+    for pair in pairs:
+        if result and pair[0] < result[-1][0]:
+            # Not sorted (e.g. current inventory, or old snapshot)
+            result.append(pair)
+            result.extend(pairs)
+            result.sort(key=operator.itemgetter(0))
+            break
+        result.append(pair)
+    return result
+
+
+def keyed(rows, key, values):
+    """Return the sorted list of ``(key, values)`` of ``rows``.
+
+    :param rows: Iterable of dictionaries.
+    :param list key: Names of the fields identifying a row.
+    :param list values: Names of the fields compared between inventories.
+
+    Values of rows sharing the same key are merged (into a sorted tuple of
+    tuples of values). Rows which are already sorted by key are not sorted
+    again.
+
+    >>> keyed(
+    ...     [{"name": "foo", "version": "2"}, {"name": "bar", "version": "1"}],
+    ...     ["name"],
+    ...     ["version"],
+    ... )
+    [(('bar',), (('1',),)), (('foo',), (('2',),))]
+    """
+    pairs = ascending(
+        (
+            tuple(row[field] for field in key),
+            tuple(row[field] for field in values),
+        )
+        for row in rows
+    )
+    return [
+        (group_key, tuple(sorted(value for __key, value in group)))
+        for group_key, group in itertools.groupby(pairs, key=operator.itemgetter(0))
+    ]
+
+
+def merge_join(old, new):
+    """Iterate over differences between ``old`` and ``new``.
+
+    Arguments are sorted lists of ``(key, values)`` (see :func:`keyed`).
+    Iterate over ``(change, key, old_values, new_values)`` tuples, where
+    ``change`` is one of :data:`ADDED`, :data:`REMOVED` and :data:`CHANGED`.
+    Unchanged rows are skipped.
+
+    >>> for change in merge_join(
+    ...     [("a", 1), ("b", 2), ("c", 3)],
+    ...     [("b", 2), ("c", 4), ("d", 5)],
+    ... ):
+    ...     print(change)
+    ('removed', 'a', 1, None)
+    ('changed', 'c', 3, 4)
+    ('added', 'd', None, 5)
+    """
+    old, new = iter(old), iter(new)
+    old_item, new_item = next(old, None), next(new, None)
+    while old_item is not None and new_item is not None:
+        if old_item[0] < new_item[0]:
+            yield (REMOVED, old_item[0], old_item[1], None)
+            old_item = next(old, None)
+        elif new_item[0] < old_item[0]:
+            yield (ADDED, new_item[0], None, new_item[1])
+            new_item = next(new, None)
+        else:
+            if old_item[1] != new_item[1]:
+                yield (CHANGED, old_item[0], old_item[1], new_item[1])
+            old_item, new_item = next(old, None), next(new, None)
+    while old_item is not None:
+        yield (REMOVED, old_item[0], old_item[1], None)
+        old_item = next(old, None)
+    while new_item is not None:
+        yield (ADDED, new_item[0], None, new_item[1])
+        new_item = next(new, None)
+
+
+class DiffDirective(Directive):
+    """Display the differences between two inventories.
+
+    Arguments are the paths of two snapshots (relative to the document). If
+    the second one is missing, the first snapshot is compared to the
+    inventory displayed by directives.
+    """
+
+    required_arguments = 1
+    optional_arguments = 1
+    option_spec = {"inventory": directives.unchanged}
+
+    #: Titles of the lists of changes.
+    titles = {ADDED: "Added", REMOVED: "Removed", CHANGED: "Changed"}
+
+    def inventory(self):
+        """Return the directive (with default options) of the compared inventories."""
+        inventories = self.state.document.settings.env.get_domain(
+            "packages"
+        ).inventories
+        name = self.options.get("inventory", "deb")
+        if name not in inventories or not inventories[name].diff_key:
+            choices = ", ".join(
+                sorted(key for key, value in inventories.items() if value.diff_key)
+            )
+            raise self.error(
+                f"Inventory '{name}' cannot be compared (choose from {choices})."
+            )
+        return inventories[name].from_options(name, {})
+
+    def rows(self, directive, argument):
+        """Return the rows of the inventory of ``directive`` (see :func:`keyed`).
+
+        Rows are read from the snapshot ``argument``, or, if ``argument`` is
+        ``None``, from the current inventory.
+        """
+        env = self.state.document.settings.env
+        if argument is None:
+            entry = PREFETCHER.entry(directive, env.config)
+            if entry.dependencies is not None:
+                dependencies.note(env, env.docname, entry.dependencies)
+            if entry.incomplete is not None:
+                raise self.warning(
+                    f"Cannot compare an incomplete inventory. {entry.incomplete}"
+                )
+            records = entry.records
+        else:
+            __relpath, path = env.relfn2path(argument, env.docname)
+            env.note_dependency(path)
+            records = snapshot.get_records(path, directive)
+        return keyed(
+            directive.export(records), directive.diff_key, directive.diff_values
+        )
+
+    @staticmethod
+    def changes(directive, old, new):
+        """Return the rows of the tables of changes, indexed by type of change."""
+        changes = {change: [] for change in DiffDirective.titles}
+        fields = range(len(directive.diff_values))
+        for change, key, old_values, new_values in merge_join(old, new):
+            row = [table.literal(item) for item in key]
+            for values in (old_values, new_values):
+                if values is not None:
+                    row.extend(
+                        ", ".join(value[field] for value in values) for field in fields
+                    )
+            changes[change].append(row)
+        return changes
+
+    @staticmethod
+    def headers(directive, change):
+        """Return the headers of the table of changes ``change``."""
+        headers = [field.capitalize() for field in directive.diff_key]
+        if change == CHANGED:
+            headers.extend(f"Old {field}" for field in directive.diff_values)
+            headers.extend(f"New {field}" for field in directive.diff_values)
+        else:
+            headers.extend(field.capitalize() for field in directive.diff_values)
+        return headers
+
+    def run(self):
+        directive = self.inventory()
+        try:
+            old = self.rows(directive, self.arguments[0])
+            new = self.rows(
+                directive, self.arguments[1] if len(self.arguments) > 1 else None
+            )
+        except (
+            FileNotFoundError,
+            snapshot.SnapshotError,
+            ldcache.LdCacheError,
+        ) as exception:
+            error = nodes.error()
+            error.append(nodes.paragraph(text=str(exception)))
+            return [self.reporter.warning(str(exception), line=self.lineno), error]
+
+        changes = self.changes(directive, old, new)
+        if not any(changes.values()):
+            return [nodes.paragraph(text="No changes.")]
+        items = nodes.bullet_list()
+        for change, title in self.titles.items():
+            if changes[change]:
+                headers = self.headers(directive, change)
+                items += nodes.list_item(
+                    "",
+                    nodes.paragraph(text=f"{title} ({len(changes[change])})"),
+                    table.inventory_table.from_rows(
+                        len(headers), headers, changes[change]
+                    ),
+                )
+        return [items]
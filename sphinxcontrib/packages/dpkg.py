@@ -0,0 +1,207 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Read the dpkg status database (``/var/lib/dpkg/status``) without running ``dpkg-query``.
+
+The database is a sequence of RFC822-like stanzas (one per package), separated
+by blank lines. It is memory-mapped, and parsed as a stream.
+
+>>> import os, tempfile
+>>> admindir = tempfile.mkdtemp()
+>>> with open(os.path.join(admindir, "status"), "w", encoding="utf8") as file:
+...     __ = file.write('''Package: dpkg
+... Status: install ok installed
+... Architecture: amd64
+...
+... Package: broken
+... Status: install reinstreq installed
+... Architecture: amd64
+...
+... Package: libfoo
+... Status: install ok installed
+... Architecture: i386
+... ''')
+>>> [record["package"] for record in iter_packages(admindir)]
+['dpkg', 'libfoo:i386']
+>>> import shutil; shutil.rmtree(admindir)
+"""
+
+import mmap
+import os
+import re
+
+from .parsing import record_class
+
+ADMINDIR = "/var/lib/dpkg"
+
+#: Fields needed to build records, besides the ones requested by the user.
+FIELDS = [
+    "package",
+    "status",
+    "section",
+    "version",
+    "homepage",
+    "description",
+    "architecture",
+    "multi-arch",
+]
+
+
+def status_path(admindir=None):
+    """Return the path of the status database of ``admindir``."""
+    return os.path.join(admindir or ADMINDIR, "status")
+
+
+def iter_stanzas(data, fields):
+    """Iterate over stanzas of ``data`` (a bytes-like object).
+
+    Each stanza is a dictionary of its ``fields`` (other fields are ignored;
+    field names are lowercase). Continuation lines are ignored: only the
+    first line of each field is kept.
+
+    >>> list(iter_stanzas(b'''Package: foo
+    ... Status: install ok installed
+    ... Description: Foo
+    ...  This is foo.
+    ...
+    ... Package: bar
+    ... Version: 1.0
+    ... ''', ["package", "version"]))
+    [{'package': 'foo'}, {'package': 'bar', 'version': '1.0'}]
+    """
+    fields = {field.encode("ascii") for field in fields}
+    stanza = {}
+    start = 0
+    end = len(data)
+    while start < end:
+        stop = data.find(b"\n", start)
+        if stop == -1:
+            stop = end
+        line = data[start:stop]
+        start = stop + 1
+
+        if not line.strip():
+            if stanza:
+                yield stanza
+                stanza = {}
+            continue
+        if line[:1] in (b" ", b"\t"):
+            # Continuation line
+            continue
+        name, separator, value = line.partition(b":")
+        if separator and name.lower() in fields:
+            stanza[name.lower().decode("ascii")] = value.strip().decode(
+                "utf8", errors="replace"
+            )
+    if stanza:
+        yield stanza
+
+
+def native_architecture(data):
+    """Return the native architecture of status database ``data``.
+
+    This is the architecture of package ``dpkg`` itself (``None`` if it is
+    not found).
+
+    >>> native_architecture(b'''Package: libfoo
+    ... Architecture: i386
+    ...
+    ... Package: dpkg
+    ... Status: install ok installed
+    ... Architecture: amd64
+    ... ''')
+    'amd64'
+    """
+    match = re.search(
+        rb"^Package: dpkg\n(?:[^\n]+\n)*?Architecture: *(\S+)", data, re.MULTILINE
+    )
+    if match is None:
+        return None
+    return match.group(1).decode("ascii", errors="replace")
+
+
+def qualified_name(stanza, native):
+    """Return the name of the package of ``stanza``, as ``${binary:Package}``.
+
+    The name is qualified with its architecture if the package is
+    ``Multi-Arch: same``, or if its architecture is foreign (neither
+    ``native``, nor ``all``).
+
+    >>> qualified_name({"package": "foo", "architecture": "amd64"}, "amd64")
+    'foo'
+    >>> qualified_name({"package": "foo", "architecture": "i386"}, "amd64")
+    'foo:i386'
+    >>> qualified_name({"package": "foo", "architecture": "all"}, "amd64")
+    'foo'
+    """
+    package = stanza.get("package", "")
+    architecture = stanza.get("architecture")
+    if architecture is None:
+        return package
+    if stanza.get("multi-arch") == "same" or (
+        native is not None and architecture not in (native, "all")
+    ):
+        return f"{package}:{architecture}"
+    return package
+
+
+def iter_packages(admindir=None, extra=(), selection=None):
+    """Iterate over installed packages.
+
+    :param str admindir: dpkg administrative directory (default ``/var/lib/dpkg``).
+    :param list extra: Other fields to read (lowercase).
+    :param selection: If not ``None``, only iterate over packages whose name
+        and section are accepted by this
+        :class:`~sphinxcontrib.packages.selection.Selection`.
+
+    Each package is a :class:`~sphinxcontrib.packages.parsing.Record` with
+    keys ``section``, ``package`` (with its architecture if it is
+    ``Multi-Arch: same`` or foreign, like ``${binary:Package}``), ``version``,
+    ``homepage``, ``summary`` (first line of the description), and the
+    ``extra`` fields.
+
+    Like ``dpkg-query`` (whose status must be ``ii``), only packages which
+    are installed, without any error flag (e.g. ``reinstreq``), are iterated.
+
+    Raise :class:`OSError` if the database cannot be read.
+    """
+    extra = list(extra)
+    record = record_class(
+        ["section", "package", "version", "homepage", "summary"] + extra
+    )
+    with open(status_path(admindir), "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            native = native_architecture(data)
+            for stanza in iter_stanzas(data, FIELDS + extra):
+                if stanza.get("status", "").split() != ["install", "ok", "installed"]:
+                    continue
+                package = qualified_name(stanza, native)
+                if selection is not None and not (
+                    selection.accepts_name(package)
+                    and selection.accepts_section(stanza.get("section", ""))
+                ):
+                    continue
+                yield record(
+                    (
+                        stanza.get("section", ""),
+                        package,
+                        stanza.get("version", ""),
+                        stanza.get("homepage", ""),
+                        stanza.get("description", ""),
+                        *(stanza.get(field, "") for field in extra),
+                    )
+                )
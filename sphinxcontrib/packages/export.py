@@ -0,0 +1,221 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Export records displayed by directives as JSON Lines or CSV files.
+
+When a directive is run, its name and options are stored into the
+environment. Once the documentation has been built, the records of each
+inventory (used in any document) are written, row by row, into a file of
+:confval:`packages_export_dir`, together with an ``index.json`` file
+describing those files.
+
+Records are retrieved from :data:`PREFETCHER`, which keeps them until the end
+of the build when exporting is enabled: they are not collected again. Records
+collected by parallel processes (reading documents) are sent to the main
+process with the environment.
+
+Inventories whose collection failed (or was interrupted) have an ``error``
+field in ``index.json``.
+"""
+
+import csv
+import hashlib
+import json
+import os
+
+from .prefetch import PREFETCHER
+
+#: Supported formats, and the functions writing them.
+FORMATS = {}
+
+#: Name of the file describing exported files.
+INDEX = "index.json"
+
+
+def writer(extension):
+    """Decorator registering a function writing rows into files of ``extension``."""
+
+    def decorator(function):
+        FORMATS[extension] = function
+        return function
+
+    return decorator
+
+
+@writer("jsonl")
+def write_jsonl(file, rows):
+    """Write ``rows`` (an iterable of dictionaries) as JSON Lines into ``file``.
+
+    >>> import io
+    >>> file = io.StringIO()
+    >>> write_jsonl(file, iter([{"package": "foo", "version": "1.0"}]))
+    >>> print(file.getvalue(), end="")
+    {"package": "foo", "version": "1.0"}
+    """
+    for row in rows:
+        file.write(json.dumps(row, ensure_ascii=False))
+        file.write("\n")
+
+
+@writer("csv")
+def write_csv(file, rows):
+    """Write ``rows`` (an iterable of dictionaries) as CSV into ``file``.
+
+    Columns are the keys of the first row.
+
+    >>> import io
+    >>> file = io.StringIO()
+    >>> write_csv(file, iter([{"package": "foo", "version": "1.0"}]))
+    >>> print(file.getvalue(), end="")
+    package,version
+    foo,1.0
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    output = csv.DictWriter(
+        file, fieldnames=list(first), extrasaction="ignore", lineterminator="\n"
+    )
+    output.writeheader()
+    output.writerow(first)
+    output.writerows(rows)
+
+
+def init(env):
+    """Initialize the environment (unless it has been loaded from a previous build).
+
+    Attribute ``packages_inventories`` of the environment maps names of
+    documents to dictionaries of ``{repr(cache_key): (name, options)}``.
+    Attribute ``packages_entries`` maps cache keys to the
+    :class:`~sphinxcontrib.packages.prefetch.Entry` collected by a parallel
+    process, or to the exception raised while collecting it (it is emptied
+    at each build).
+    """
+    if not hasattr(env, "packages_inventories"):
+        env.packages_inventories = {}
+    env.packages_entries = {}
+
+
+def note(env, docname, directive):
+    """Record that ``directive`` is used in document ``docname``."""
+    key = directive.cache_key()
+    env.packages_inventories.setdefault(docname, {})[repr(key)] = (
+        directive.name.rpartition(":")[2],
+        dict(directive.options),
+    )
+    if not PREFETCHER.inherited(key):
+        # Collected by a parallel process: send it to the main process
+        try:
+            env.packages_entries[key] = PREFETCHER.entry(directive, env.config)
+        except Exception as error:  # pylint: disable=broad-except
+            env.packages_entries[key] = error
+
+
+def env_purge_doc(__app, env, docname):
+    """Forget about inventories of ``docname`` (which is about to be read again)."""
+    env.packages_inventories.pop(docname, None)
+
+
+def env_merge_info(__app, env, docnames, other):
+    """Merge inventories of ``docnames`` read by a parallel process."""
+    for docname in docnames:
+        if docname in other.packages_inventories:
+            env.packages_inventories[docname] = other.packages_inventories[docname]
+    for key, entry in getattr(other, "packages_entries", {}).items():
+        PREFETCHER.add(key, entry)
+
+
+def iter_inventories(env, directives):
+    """Iterate over ``(filename, directive, docnames)`` of inventories used in documents.
+
+    Inventories used several times (with the same cache key) are iterated once.
+    """
+    inventories = {}
+    for docname in sorted(env.packages_inventories):
+        for key, (name, options) in env.packages_inventories[docname].items():
+            if name not in directives:
+                continue
+            if key not in inventories:
+                digest = hashlib.sha1(key.encode("utf8")).hexdigest()[:8]
+                inventories[key] = (
+                    f"{name}-{digest}",
+                    directives[name].from_options(name, options),
+                    [],
+                )
+            inventories[key][2].append(docname)
+    return inventories.values()
+
+
+def remove_stale_files(directory, filenames):
+    """Remove files listed in the previous index of ``directory``, but not in ``filenames``."""
+    try:
+        with open(os.path.join(directory, INDEX), encoding="utf8") as file:
+            previous = json.load(file)
+    except (OSError, ValueError):
+        return
+    for entry in previous:
+        for filename in entry.get("files", {}).values():
+            if filename not in filenames:
+                try:
+                    os.remove(os.path.join(directory, os.path.basename(filename)))
+                except OSError:
+                    pass
+
+
+def export(app, directives):
+    """Write records of inventories used in documents into :confval:`packages_export_dir`."""
+    env = app.builder.env
+    directory = os.path.join(app.outdir, app.config.packages_export_dir)
+    os.makedirs(directory, exist_ok=True)
+
+    index = []
+    for basename, directive, docnames in iter_inventories(env, directives):
+        files = {}
+        item = {
+            "directive": directive.name,
+            "options": {
+                key: value
+                for key, value in sorted(directive.options.items())
+                if key not in directive.render_options
+            },
+            "documents": docnames,
+            "files": files,
+        }
+        index.append(item)
+        try:
+            entry = PREFETCHER.entry(directive, app.config)
+        except Exception as error:  # pylint: disable=broad-except
+            # Errors have been reported when the directive was run
+            item["error"] = str(error)
+            continue
+        if entry.incomplete is not None:
+            item["error"] = entry.incomplete
+        for extension in app.config.packages_export:
+            files[extension] = f"{basename}.{extension}"
+            with open(
+                os.path.join(directory, files[extension]),
+                "w",
+                encoding="utf8",
+                newline="",
+            ) as file:
+                FORMATS[extension](file, directive.export(entry.records))
+
+    remove_stale_files(
+        directory, {filename for entry in index for filename in entry["files"].values()}
+    )
+    with open(os.path.join(directory, INDEX), "w", encoding="utf8") as file:
+        json.dump(index, file, indent=2, default=str)
+        file.write("\n")
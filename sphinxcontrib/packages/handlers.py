@@ -0,0 +1,96 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Handlers of the Sphinx events this extension is connected to (see :func:`setup`)."""
+
+import os
+
+from sphinx.errors import ConfigError
+
+from . import dependencies, export, instrument, shard, table
+from .prefetch import PREFETCHER
+
+
+def config_inited(app, config):
+    """Check values and make paths relative to the configuration directory."""
+    if config.packages_cache_dir:
+        config.packages_cache_dir = os.path.join(
+            app.confdir, os.path.expanduser(config.packages_cache_dir)
+        )
+    if config.packages_snapshot:
+        config.packages_snapshot = os.path.join(
+            app.confdir, os.path.expanduser(config.packages_snapshot)
+        )
+    for extension in config.packages_export:
+        if extension not in export.FORMATS:
+            raise ConfigError(
+                f"packages_export: Unknown format '{extension}' "
+                f"(choose from {', '.join(sorted(export.FORMATS))})."
+            )
+    # Values set on the command line (``-D``) are strings
+    if config.packages_virtual_table_rows is not None:
+        try:
+            config.packages_virtual_table_rows = int(config.packages_virtual_table_rows)
+        except ValueError as error:
+            raise ConfigError(
+                "packages_virtual_table_rows: Invalid number of rows "
+                f"'{config.packages_virtual_table_rows}'."
+            ) from error
+
+
+def env_before_read_docs(app, env, docnames):
+    """Start collecting records of directives used in documents about to be read.
+
+    If documents are read by parallel processes, wait for the records, so
+    that those processes share them instead of collecting them again.
+    """
+    if app.config.packages_prefetch:
+        PREFETCHER.start(
+            env,
+            docnames,
+            env.get_domain("packages").inventories,
+            app.config.packages_prefetch_workers,
+        )
+        if app.parallel > 1:
+            PREFETCHER.wait()
+
+
+def builder_inited(app):
+    """Generate the pages of directives having a ``:shard:`` option."""
+    PREFETCHER.shutdown()
+    dependencies.init(app.builder.env)
+    export.init(app.builder.env)
+    instrument.init(app.builder.env)
+    table.builder_inited(app)
+    shard.generate(app, app.env.get_domain("packages").inventories)
+
+
+def env_updated(app, __env):
+    """Forget prefetched records: documents have been read.
+
+    If records are to be exported, they are kept until the end of the build.
+    """
+    if not app.config.packages_export:
+        PREFETCHER.shutdown()
+
+
+def build_finished(app, exception):
+    """Export records (if enabled), report measures, and forget prefetched records."""
+    try:
+        if exception is None and app.config.packages_export:
+            export.export(app, app.env.get_domain("packages").inventories)
+        instrument.build_finished(app, exception)
+    finally:
+        PREFETCHER.shutdown()
@@ -0,0 +1,271 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Measure the time and resources spent by directives.
+
+Each time a directive is run, two events are emitted (as the Sphinx event
+:data:`EVENT`, whose handlers are called with the application and the event
+as arguments):
+
+- a ``collect`` event, describing how records have been collected (only for
+  the first directive using those records: other directives share them);
+- a ``render`` event, describing how records have been rendered.
+
+Events are dictionaries, with keys ``event`` (``"collect"`` or ``"render"``),
+``directive``, ``docname`` and ``line``, and:
+
+- for ``collect`` events: ``source`` (``"collect"``, ``"cache"`` or
+  ``"snapshot"``), ``time`` (duration of collection), ``records`` (number of
+  records), ``collection`` (identifier of the collection), and, for directives
+  running a command, ``subprocess`` (wall time of the command), ``bytes`` and
+  ``lines`` (read from its standard output), ``matched`` (number of lines
+  matched by the parser, before :meth:`CmdDirective.filter`) and
+  ``discarded`` (number of matches discarded by this method);
+- for ``render`` events: ``wait`` (time spent waiting for records, e.g. if
+  they were being prefetched), ``time`` (duration of rendering), ``nodes``
+  (number of docutils nodes created) and ``cells`` (number of cells of
+  compact tables, which are expanded into nodes at write time).
+
+If :confval:`packages_profile` is set, a summary is logged at the end of the
+build; if :confval:`packages_profile_file` is set, events are written into
+this file (as JSON). Events are recorded in the environment, so that events
+of documents read by parallel processes are merged into the main one (event
+handlers are called in the process reading the document).
+"""
+
+import json
+import os
+
+from sphinx.util import logging
+
+from . import table
+
+LOGGER = logging.getLogger(__name__)
+
+#: Name of the Sphinx event emitted for each measure.
+EVENT = "packages-profile"
+
+
+class CountingReader:  # pylint: disable=too-few-public-methods
+    """Wrap binary ``stream``, counting bytes and lines read from it.
+
+    >>> import io
+    >>> reader = CountingReader(io.BytesIO(b"foo\\nbar\\n"))
+    >>> reader.read(5)
+    b'foo\\nb'
+    >>> reader.read(5)
+    b'ar\\n'
+    >>> reader.bytes, reader.lines
+    (8, 2)
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
+        self.lines = 0
+
+    def read(self, size=-1):
+        """Read (at most) ``size`` bytes."""
+        data = self.stream.read(size)
+        self.bytes += len(data)
+        self.lines += data.count(b"\n")
+        return data
+
+
+def count_nodes(nodes):
+    """Return the number of nodes, and of cells of compact tables, of ``nodes``."""
+    count = cells = 0
+    for node in nodes:
+        for child in node.findall():
+            count += 1
+            if isinstance(child, table.inventory_table):
+                cells += sum(len(column) for column in child["columns"])
+    return count, cells
+
+
+def is_enabled(config):
+    """Return ``True`` iff events are to be recorded."""
+    return bool(config.packages_profile or config.packages_profile_file)
+
+
+def init(env):
+    """Initialize the environment, forgetting events of a previous build.
+
+    Attribute ``packages_profile`` of the environment maps names of documents
+    to the lists of events of the current build (only recorded if profiling is
+    enabled).
+    """
+    env.packages_profile = {}
+
+
+def env_merge_info(__app, env, docnames, other):
+    """Merge events of ``docnames`` read by a parallel process."""
+    for docname in docnames:
+        if docname in other.packages_profile:
+            env.packages_profile[docname] = other.packages_profile[docname]
+
+
+def emit(env, event):
+    """Emit ``event`` (and record it, if profiling is enabled)."""
+    if is_enabled(env.config):
+        env.packages_profile.setdefault(event["docname"], []).append(event)
+    env.events.emit(EVENT, event)
+
+
+def report(directive, profile, wait, duration, nodes):
+    """Emit the events of a run of ``directive``.
+
+    :param dict profile: Measures of the collection of the records (this
+        dictionary is shared by the directives using the same records: it is
+        only reported once).
+    :param float wait: Time spent waiting for the records.
+    :param float duration: Time spent rendering the records.
+    :param list nodes: Nodes returned by the directive.
+    """
+    env = directive.state.document.settings.env
+    location = {
+        "directive": directive.name,
+        "docname": env.docname,
+        "line": directive.lineno,
+    }
+    if not profile.get("reported", False):
+        profile["reported"] = True
+        emit(
+            env,
+            {
+                "event": "collect",
+                **location,
+                **{key: value for key, value in profile.items() if key != "reported"},
+            },
+        )
+    count, cells = count_nodes(nodes)
+    emit(
+        env,
+        {
+            "event": "render",
+            **location,
+            "wait": wait,
+            "time": duration,
+            "nodes": count,
+            "cells": cells,
+        },
+    )
+
+
+def summary(events):
+    """Return the lines of the summary of ``events`` (one row per directive).
+
+    >>> for line in summary([
+    ...     {"event": "collect", "directive": "packages:deb", "docname": "deb",
+    ...      "line": 3, "source": "collect", "time": 0.5, "records": 700},
+    ...     {"event": "render", "directive": "packages:deb", "docname": "deb",
+    ...      "line": 3, "wait": 0.2, "time": 0.1, "nodes": 12, "cells": 2100},
+    ... ]):  # doctest: +NORMALIZE_WHITESPACE
+    ...     print(line)
+    Location  Directive     Source   Records  Collect  Subprocess  Bytes  Matched
+        Wait  Render  Nodes  Cells
+    deb:3     packages:deb  collect      700    0.500           -      -        -
+       0.200   0.100     12   2100
+    """
+    rows = {}
+    for event in events:
+        key = (event["docname"], event["line"], event["directive"])
+        rows.setdefault(key, {}).update(
+            {f"{event['event']}_{name}": value for name, value in event.items()}
+        )
+
+    def cell(row, name, template="{}"):
+        value = row.get(name)
+        return "-" if value is None else template.format(value)
+
+    table_rows = [
+        [
+            "Location",
+            "Directive",
+            "Source",
+            "Records",
+            "Collect",
+            "Subprocess",
+            "Bytes",
+            "Matched",
+            "Wait",
+            "Render",
+            "Nodes",
+            "Cells",
+        ]
+    ]
+    for (docname, line, directive), row in sorted(
+        rows.items(),
+        key=lambda item: -(
+            item[1].get("collect_time", 0) + item[1].get("render_time", 0)
+        ),
+    ):
+        table_rows.append(
+            [
+                f"{docname}:{line}",
+                directive,
+                cell(row, "collect_source"),
+                cell(row, "collect_records"),
+                cell(row, "collect_time", "{:.3f}"),
+                cell(row, "collect_subprocess", "{:.3f}"),
+                cell(row, "collect_bytes"),
+                cell(row, "collect_matched"),
+                cell(row, "render_wait", "{:.3f}"),
+                cell(row, "render_time", "{:.3f}"),
+                cell(row, "render_nodes"),
+                cell(row, "render_cells"),
+            ]
+        )
+    widths = [max(len(row[index]) for row in table_rows) for index in range(12)]
+    return [
+        "  ".join(
+            text.ljust(width) if index < 3 else text.rjust(width)
+            for index, (text, width) in enumerate(zip(row, widths))
+        ).rstrip()
+        for row in table_rows
+    ]
+
+
+def iter_events(env):
+    """Iterate over events of the current build.
+
+    Records collected before parallel processes were forked are shared by
+    those processes: their ``collect`` events are only iterated once.
+    """
+    collections = set()
+    for docname in sorted(env.packages_profile):
+        for event in env.packages_profile[docname]:
+            if event["event"] == "collect":
+                if event["collection"] in collections:
+                    continue
+                collections.add(event["collection"])
+            yield event
+
+
+def build_finished(app, exception):
+    """Log the summary of events, and write them into the profile file."""
+    events = list(iter_events(app.env))
+    if exception is not None or not events:
+        return
+    if app.config.packages_profile:
+        LOGGER.info("")
+        LOGGER.info("sphinxcontrib-packages profile (durations in seconds):")
+        for line in summary(events):
+            LOGGER.info(line)
+    if app.config.packages_profile_file:
+        path = os.path.join(app.outdir, app.config.packages_profile_file)
+        with open(path, "w", encoding="utf8") as file:
+            json.dump({"events": events}, file, indent=2)
+            file.write("\n")
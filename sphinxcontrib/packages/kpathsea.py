@@ -0,0 +1,197 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""List files of a kpathsea search path (as returned by ``kpsepath``).
+
+Files are read from ``ls-R`` databases, which are maintained by ``mktexlsr``
+for each ``texmf`` tree. Only directories which are not covered by such a
+database are actually walked.
+"""
+
+import concurrent.futures
+import os
+
+DATABASE = "ls-R"
+
+
+def parse_path(text):
+    """Parse a kpathsea search path.
+
+    Return a list of ``(directory, recursive)`` tuples, where ``recursive``
+    is ``True`` if subdirectories are to be searched (path ending with ``//``).
+    Leading ``!!`` (meaning: search the database only) are ignored.
+
+    >>> parse_path("!!/usr/share/texmf/tex//:/home/user/texmf/tex/latex:")
+    [('/usr/share/texmf/tex', True), ('/home/user/texmf/tex/latex', False)]
+    """
+    roots = []
+    for item in text.strip().split(":"):
+        if item.startswith("!!"):
+            item = item[2:]
+        if not item:
+            continue
+        recursive = item.endswith("//")
+        roots.append((item.rstrip("/") or "/", recursive))
+    return roots
+
+
+def covers(root, recursive, directory):
+    """Return ``True`` iff ``directory`` is searched in root ``root``.
+
+    >>> covers("/usr/share/texmf", True, "/usr/share/texmf/tex/latex")
+    True
+    >>> covers("/usr/share/texmf", False, "/usr/share/texmf/tex/latex")
+    False
+    >>> covers("/usr/share/texmf", True, "/usr/share/texmf-dist")
+    False
+    """
+    if directory == root:
+        return True
+    return recursive and directory.startswith(root.rstrip("/") + "/")
+
+
+def prune(roots):
+    """Remove roots which are covered by other roots, and normalize their paths.
+
+    >>> prune([("/a/b", True), ("/a", True), ("/a/c", False), ("/d", False), ("/d", True)])
+    [('/a', True), ('/d', True)]
+    """
+    normalized = {}
+    for root, recursive in roots:
+        root = os.path.realpath(root)
+        normalized[root] = normalized.get(root, False) or recursive
+    return [
+        (root, recursive)
+        for root, recursive in sorted(normalized.items())
+        if not any(
+            covers(other, other_recursive, root)
+            for other, other_recursive in normalized.items()
+            if other != root
+        )
+    ]
+
+
+def find_database(directory, _cache=None):
+    """Return the path of the ``ls-R`` database covering ``directory``, or ``None``.
+
+    The database is searched in ``directory`` and its parents.
+    """
+    if _cache is None:
+        _cache = {}
+    visited = []
+    while True:
+        if directory in _cache:
+            database = _cache[directory]
+            break
+        visited.append(directory)
+        if os.path.isfile(os.path.join(directory, DATABASE)):
+            database = os.path.join(directory, DATABASE)
+            break
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            database = None
+            break
+        directory = parent
+    for path in visited:
+        _cache[path] = database
+    return database
+
+
+def iter_database(database, roots):
+    """Iterate over ``(directory, filename)`` of database ``database``, covered by ``roots``.
+
+    The database is parsed as a stream: it is never loaded into memory.
+    """
+    base = os.path.dirname(database)
+    covered = False
+    directory = None
+    with open(database, encoding="utf8", errors="surrogateescape") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if not line or line.startswith("%"):
+                continue
+            if line.endswith(":") and (line.startswith("/") or line.startswith(".")):
+                directory = os.path.normpath(os.path.join(base, line[:-1]))
+                covered = any(
+                    covers(root, recursive, directory) for root, recursive in roots
+                )
+            elif covered:
+                yield directory, line
+
+
+def walk(root, recursive):
+    """Return the list of ``(directory, filename)`` of files in ``root``."""
+    files = []
+    if recursive:
+        for directory, __dirs, filenames in os.walk(root):
+            files.extend((directory, filename) for filename in filenames)
+    else:
+        try:
+            with os.scandir(root) as entries:
+                files.extend(
+                    (root, entry.name) for entry in entries if not entry.is_dir()
+                )
+        except OSError:
+            pass
+    return files
+
+
+def iter_files(text, max_workers=None):
+    """Iterate over ``(directory, filename)`` of files of kpathsea search path ``text``.
+
+    Each file is listed once. Trees covered by an ``ls-R`` database are read
+    from this database; other trees are walked (concurrently).
+
+    >>> import tempfile
+    >>> texmf = tempfile.mkdtemp()
+    >>> os.makedirs(os.path.join(texmf, "tex", "latex", "foo"))
+    >>> with open(os.path.join(texmf, "ls-R"), "w") as database:
+    ...     _ = database.write("% ls-R\\n\\n./:\\ntex\\n\\n./tex/latex/foo:\\nfoo.sty\\n")
+    >>> home = tempfile.mkdtemp()
+    >>> open(os.path.join(home, "bar.cls"), "w").close()
+    >>> sorted(filename for __directory, filename in iter_files(
+    ...     f"!!{texmf}/tex//:{texmf}/tex/latex//:{home}"
+    ... ))
+    ['bar.cls', 'foo.sty']
+    >>> import shutil; shutil.rmtree(texmf); shutil.rmtree(home)
+    """
+    indexed = {}
+    cache = {}
+    walked = []
+    for root, recursive in prune(parse_path(text)):
+        database = find_database(root, cache)
+        if database is None:
+            walked.append((root, recursive))
+        else:
+            indexed.setdefault(database, []).append((root, recursive))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(walk, root, recursive) for root, recursive in walked]
+        for database, roots in indexed.items():
+            yield from iter_database(database, roots)
+        for future in futures:
+            yield from future.result()
+
+
+def databases(text):
+    """Return the list of ``ls-R`` databases used to list files of search path ``text``."""
+    cache = {}
+    return sorted(
+        {
+            database
+            for root, __recursive in prune(parse_path(text))
+            if (database := find_database(root, cache)) is not None
+        }
+    )
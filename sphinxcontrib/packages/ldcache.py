@@ -0,0 +1,215 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Read the cache of the dynamic linker (``/etc/ld.so.cache``) without running ``ldconfig``.
+
+Both the old (``ld.so-1.7.0``) and the new (``glibc-ld.so.cache1.1``) formats
+are supported (as well as the compatibility format, which is an old cache
+followed by a new one). The file is memory-mapped, and only the strings which
+are actually used are read from its string table. Since the file is never
+executed, it can be read from the root file system of another machine.
+
+The format is described in ``sysdeps/generic/dl-cache.h`` of the GNU C Library.
+"""
+
+import mmap
+import struct
+
+from .parsing import record_class
+
+LDCACHE = "/etc/ld.so.cache"
+
+OLD_MAGIC = b"ld.so-1.7.0"
+NEW_MAGIC = b"glibc-ld.so.cache1.1"
+
+# Old format: magic (padded to 12 bytes), nlibs; entries are (flags, key, value)
+OLD_HEADER = struct.Struct("=12sI")
+OLD_ENTRY = struct.Struct("=iII")
+# New format: magic, nlibs, len_strings, flags, padding, extension_offset, unused;
+# entries are (flags, key, value, osversion, hwcap)
+NEW_HEADER = "20sIIB3xI12x"
+NEW_ENTRY = "iIIIQ"
+
+#: Type of libraries (lower byte of flags).
+TYPES = {0: "libc4", 1: "ELF", 2: "libc5", 3: "libc6"}
+
+#: Required architecture (second byte of flags).
+ARCHITECTURES = {
+    0x0100: "64bit",
+    0x0200: "IA-64",
+    0x0300: "x86-64",
+    0x0400: "64bit",
+    0x0500: "64bit",
+    0x0600: "N32",
+    0x0700: "64bit",
+    0x0800: "x32",
+    0x0900: "hard-float",
+    0x0A00: "AArch64",
+    0x0B00: "soft-float",
+    0x0C00: "nan2008",
+    0x0D00: "N32,nan2008",
+    0x0E00: "64bit,nan2008",
+    0x0F00: "soft-float",
+    0x1000: "double-float",
+    0x1100: "soft-float",
+    0x1200: "double-float",
+}
+
+
+class LdCacheError(Exception):
+    """The file is not a valid cache."""
+
+
+def describe_flags(flags):
+    """Return the description of ``flags``, as displayed by ``ldconfig -p``.
+
+    >>> describe_flags(0x0303)
+    'libc6,x86-64'
+    >>> describe_flags(0x0003)
+    'libc6'
+    """
+    description = TYPES.get(flags & 0xFF, "unknown")
+    if flags & 0xFF00:
+        description += "," + ARCHITECTURES.get(flags & 0xFF00, "unknown")
+    return description
+
+
+def _unpack(structure, data, offset):
+    """Unpack ``structure`` at ``offset`` in ``data``.
+
+    Raise :class:`LdCacheError` (instead of :class:`struct.error`) if
+    ``data`` is too short.
+
+    >>> _unpack(OLD_ENTRY, b"", 0)
+    Traceback (most recent call last):
+        ...
+    sphinxcontrib.packages.ldcache.LdCacheError: Truncated file.
+    """
+    if offset + structure.size > len(data):
+        raise LdCacheError("Truncated file.")
+    return structure.unpack_from(data, offset)
+
+
+def _string(data, offset):
+    """Return the NUL-terminated string starting at ``offset`` in ``data``."""
+    if offset >= len(data):
+        raise LdCacheError("Invalid string offset.")
+    end = data.find(b"\0", offset)
+    if end == -1:
+        raise LdCacheError("Unterminated string.")
+    return data[offset:end].decode("utf8", errors="surrogateescape")
+
+
+def _iter_new(data, start):
+    """Iterate over ``(name, flags, path)`` of the new-format cache starting at ``start``."""
+    # The byte order is stored in bits 0-1 of the flags of the header
+    # (2: little endian, 3: big endian, 0: unknown, i.e. native).
+    if start + struct.calcsize("=" + NEW_HEADER) > len(data):
+        raise LdCacheError("Truncated file.")
+    endian_flag = data[start + 28] & 0b11
+    endian = {2: "<", 3: ">"}.get(endian_flag, "=")
+    header = struct.Struct(endian + NEW_HEADER)
+    entry = struct.Struct(endian + NEW_ENTRY)
+
+    nlibs = _unpack(header, data, start)[1]
+    offset = start + header.size
+    if offset + nlibs * entry.size > len(data):
+        raise LdCacheError("Truncated file.")
+    for __index in range(nlibs):
+        flags, key, value = _unpack(entry, data, offset)[:3]
+        offset += entry.size
+        # Strings offsets are relative to the beginning of the new header
+        yield _string(data, start + key), flags, _string(data, start + value)
+
+
+def _iter_old(data):
+    """Iterate over ``(name, flags, path)`` of an old-format cache."""
+    __magic, nlibs = _unpack(OLD_HEADER, data, 0)
+    strings = OLD_HEADER.size + nlibs * OLD_ENTRY.size
+    if strings > len(data):
+        raise LdCacheError("Truncated file.")
+    for index in range(nlibs):
+        flags, key, value = _unpack(
+            OLD_ENTRY, data, OLD_HEADER.size + index * OLD_ENTRY.size
+        )
+        # Strings offsets are relative to the end of the entries
+        yield _string(data, strings + key), flags, _string(data, strings + value)
+
+
+def iter_entries(data):
+    """Iterate over ``(name, flags, path)`` of cache ``data`` (a bytes-like object).
+
+    Raise :class:`LdCacheError` if ``data`` is not a valid cache.
+
+    >>> strings = b"libfoo.so.1\\0/lib/libfoo.so.1\\0"
+    >>> header = struct.pack("=20sIIB3xI12x", NEW_MAGIC, 1, len(strings), 2, 0)
+    >>> entry = struct.pack("=iIIIQ", 0x0303, 72, 84, 0, 0)
+    >>> list(iter_entries(header + entry + strings))
+    [('libfoo.so.1', 771, '/lib/libfoo.so.1')]
+    >>> list(iter_entries(header + entry + strings[:5]))
+    Traceback (most recent call last):
+        ...
+    sphinxcontrib.packages.ldcache.LdCacheError: Unterminated string.
+    >>> list(iter_entries(header + entry[:10]))
+    Traceback (most recent call last):
+        ...
+    sphinxcontrib.packages.ldcache.LdCacheError: Truncated file.
+    >>> list(iter_entries(header[:30]))
+    Traceback (most recent call last):
+        ...
+    sphinxcontrib.packages.ldcache.LdCacheError: Truncated file.
+    """
+    if data[: len(NEW_MAGIC)] == NEW_MAGIC:
+        yield from _iter_new(data, 0)
+    elif data[: len(OLD_MAGIC)] == OLD_MAGIC:
+        # A new-format cache may follow the old one (aligned on 8 bytes)
+        __magic, nlibs = _unpack(OLD_HEADER, data, 0)
+        start = OLD_HEADER.size + nlibs * OLD_ENTRY.size
+        start = (start + 7) & ~7
+        if data[start : start + len(NEW_MAGIC)] == NEW_MAGIC:
+            yield from _iter_new(data, start)
+        else:
+            yield from _iter_old(data)
+    else:
+        raise LdCacheError("Unknown format.")
+
+
+def iter_libraries(path=LDCACHE, accepts_name=None):
+    """Iterate over libraries of cache ``path``.
+
+    If ``accepts_name`` is not ``None``, only libraries whose name is accepted
+    by this function are iterated.
+
+    Each library is a :class:`~sphinxcontrib.packages.parsing.Record` with
+    keys ``library`` (name of the library), ``arch`` (flags, as displayed by
+    ``ldconfig -p``), and ``path``.
+
+    Raise :class:`OSError` if the file cannot be read, and
+    :class:`LdCacheError` if it is not a valid cache.
+    """
+    with open(path, "rb") as file:
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as error:
+            # Empty file
+            raise LdCacheError(f"Invalid cache '{path}': {error}") from error
+        record = record_class(["library", "arch", "path"])
+        with data:
+            try:
+                for name, flags, library in iter_entries(data):
+                    if accepts_name is None or accepts_name(name):
+                        yield record((name, describe_flags(flags), library))
+            except LdCacheError as error:
+                raise LdCacheError(f"Invalid cache '{path}': {error}") from error
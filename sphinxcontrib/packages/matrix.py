@@ -0,0 +1,233 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Compare the modules of several python interpreters.
+
+The ``:bin:`` option of ``packages:python`` directives can be a list of
+interpreters (separated by spaces or commas), or ``all`` (every interpreter
+found by :func:`~sphinxcontrib.packages.system.python_interpreters`). The
+modules of those interpreters are then listed concurrently (one
+``list_modules.py`` process per interpreter), and the sorted lists are merged
+(see :func:`merge`) into a single table, with a column per interpreter. Rows
+which differ across interpreters are highlighted.
+
+Records are :class:`~sphinxcontrib.packages.parsing.Record` objects, whose
+fields are ``package`` and the interpreters. The value of an interpreter is
+either ``None`` (the module is not available), or the ``(version, error)``
+tuple of the module.
+"""
+
+import concurrent.futures
+import heapq
+import itertools
+import operator
+import os
+import re
+import shutil
+import time
+
+from . import parsing, table
+from .system import iter_paths, python_interpreters, site_directories
+
+#: Value of ``:bin:`` meaning every available interpreter.
+ALL = "all"
+
+
+def split(argument):
+    """Return the list of interpreters of option ``:bin:`` (without looking for them).
+
+    >>> split("python3.11, python3.12")
+    ['python3.11', 'python3.12']
+    """
+    return argument.replace(",", " ").split()
+
+
+def is_matrix(argument):
+    """Return ``True`` iff option ``:bin:`` is a list of interpreters, or ``all``."""
+    names = split(argument)
+    return len(names) > 1 or names == [ALL]
+
+
+def version_key(version):
+    """Return the key used to sort interpreters by version.
+
+    >>> sorted(["Python 3.10.1", "Python 3.9.2"], key=version_key)
+    ['Python 3.9.2', 'Python 3.10.1']
+    """
+    return [
+        (0, int(part), "") if part.isdigit() else (1, 0, part)
+        for part in re.split(r"(\d+)", version)
+    ]
+
+
+def binaries(argument):
+    """Return the list of interpreters of option ``:bin:``.
+
+    Interpreters found with ``all`` are sorted by version (only one of the
+    binaries of each interpreter is kept).
+    """
+    names = split(argument)
+    if names != [ALL]:
+        return names
+    return [
+        aliases[0]
+        for aliases, __version in sorted(
+            python_interpreters(), key=lambda interpreter: version_key(interpreter[1])
+        )
+    ]
+
+
+def interpreters(directive):
+    """Return the list of interpreters of ``directive`` (see :func:`binaries`).
+
+    It is only looked for once per directive (looking for ``all`` interpreters
+    probes every one of them).
+    """
+    if directive.interpreters is None:
+        directive.interpreters = binaries(
+            directive.options.setdefault("bin", directive.python)
+        )
+    return directive.interpreters
+
+
+def fingerprint_paths(directive):
+    """Return the paths the modules of the interpreters of ``directive`` depend on."""
+    paths = ["$PATH", *iter_paths()] if split(directive.options["bin"]) == [ALL] else []
+    for name in interpreters(directive):
+        binary = shutil.which(name)
+        if binary is not None:
+            binary = os.path.realpath(binary)
+            paths.extend([binary] + site_directories(binary))
+    return paths
+
+
+def merge(streams, key):
+    """Merge sorted iterables ``streams``.
+
+    Iterate over ``(name, items)`` tuples, sorted by ``name``, where
+    ``items[index]`` is the item of ``streams[index]`` whose key is ``name``
+    (or ``None``). Streams are only traversed once, at the same time.
+
+    >>> for row in merge([["a", "c"], ["a", "b"]], key=str.upper):
+    ...     print(row)
+    ('A', ['a', 'a'])
+    ('B', [None, 'b'])
+    ('C', ['c', None])
+    """
+
+    def tagged(index, stream):
+        """Iterate over ``(key, index, item)`` tuples of ``stream``."""
+        for item in stream:
+            yield (key(item), index, item)
+
+    for name, group in itertools.groupby(
+        heapq.merge(
+            *(tagged(index, stream) for index, stream in enumerate(streams)),
+            key=operator.itemgetter(0, 1),
+        ),
+        key=operator.itemgetter(0),
+    ):
+        items = [None] * len(streams)
+        for __name, index, item in group:
+            if items[index] is None:
+                items[index] = item
+        yield name, items
+
+
+def collect(directive):
+    """Collect the modules of the interpreters of ``directive`` (concurrently).
+
+    Each interpreter is listed by a copy of ``directive`` (whose ``:bin:``
+    option is this interpreter). Measures, watched paths and interruptions of
+    those copies are merged into ``directive``. The records of every
+    interpreter are collected (and sorted) before being merged.
+    """
+    names = list(dict.fromkeys(interpreters(directive)))
+
+    def list_modules(name):
+        """Return the copy of ``directive`` listing ``name``, and its records."""
+        single = directive.from_options(
+            directive.name, {**directive.options, "bin": name}
+        )
+        single.limits = directive.limits
+        single.watched, single.profile, single.incomplete = set(), {}, None
+        return single, sorted(single.collect(), key=operator.itemgetter("package"))
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max(len(names), 1)) as executor:
+        results = list(executor.map(list_modules, names))
+    directive.profile["subprocess"] = time.perf_counter() - start
+    for single, __records in results:
+        directive.watched.update(single.watched)
+        for measure in ("bytes", "lines", "matched", "discarded"):
+            directive.profile[measure] = directive.profile.get(measure, 0)
+            directive.profile[measure] += single.profile.get(measure, 0)
+    directive.incomplete = (
+        " ".join(single.incomplete for single, __ in results if single.incomplete)
+        or None
+    )
+
+    record = parsing.record_class(["package", *names])
+    rows = merge(
+        [records for __, records in results], key=operator.itemgetter("package")
+    )
+    return [
+        record(
+            [name]
+            + [
+                None if item is None else (item["version"], item["error"])
+                for item in items
+            ]
+        )
+        for name, items in itertools.islice(rows, directive.options.get("limit"))
+    ]
+
+
+def differs(record):
+    """Return ``True`` iff the modules of ``record`` differ across interpreters."""
+    return len({None if cell is None else tuple(cell) for cell in record[1:]}) > 1
+
+
+def render(records):
+    """Return the table of ``records`` (one column per interpreter)."""
+    names = list(records[0].keys())[1:] if records else []
+    rows = []
+    for record in records:
+        highlight = table.strong if differs(record) else str
+        row = [highlight(record["package"])]
+        for cell in record[1:]:
+            if cell is None:
+                row.append("")
+            elif cell[1]:
+                row.append(table.emphasis(cell[1]))
+            else:
+                row.append(highlight(cell[0]))
+        rows.append(row)
+    return table.inventory_table.from_rows(
+        len(names) + 1, ["Package name"] + [table.literal(name) for name in names], rows
+    )
+
+
+def export(records):
+    """Iterate over the exported rows of ``records`` (one per module and interpreter)."""
+    for record in records:
+        for name, cell in itertools.islice(record.items(), 1, None):
+            if cell is not None:
+                yield {
+                    "package": record["package"],
+                    "interpreter": name,
+                    "version": cell[0],
+                    "error": cell[1] or "",
+                }
@@ -0,0 +1,301 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Parse the output of commands into compact records.
+
+The output is read in large chunks, which are decoded at once. Each chunk is
+then parsed by:
+
+- :class:`SplitParser`, for outputs made of separated fields (fastest);
+- :class:`RegexParser`, which matches a regular expression against each line,
+  or against the whole chunk.
+
+Records are :class:`Record` objects: tuples whose items can also be accessed
+by field name.
+"""
+
+import codecs
+import contextlib
+import functools
+import gc
+import re
+import threading
+
+#: Size of chunks read from outputs.
+CHUNK_SIZE = 2**18
+
+
+class Record(tuple):
+    """A tuple whose items can also be accessed by field name.
+
+    Records are instances of subclasses of this class (one per list of fields)
+    returned by :func:`record_class`. Iterating over a record iterates over its
+    values, but records also implement the read-only methods of dictionaries.
+
+    >>> Package = record_class(["package", "version"])
+    >>> record = Package(["foo", "1.0"])
+    >>> record["version"], record[0]
+    ('1.0', 'foo')
+    >>> dict(record)
+    {'package': 'foo', 'version': '1.0'}
+    """
+
+    __slots__ = ()
+
+    #: Names of the items (``None`` for anonymous items).
+    _fields = ()
+    #: Dictionary of positions of named items.
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._index[key]
+        return tuple.__getitem__(self, key)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self)!r})"
+
+    def __reduce__(self):
+        return (_make_record, (self._fields, tuple(self)))
+
+    def keys(self):
+        """Return the names of fields."""
+        return self._index.keys()
+
+    def values(self):
+        """Return the values of named fields."""
+        return [tuple.__getitem__(self, position) for position in self._index.values()]
+
+    def items(self):
+        """Return the ``(name, value)`` pairs of named fields."""
+        return list(zip(self._index, self.values()))
+
+    def get(self, key, default=None):
+        """Return the value of field ``key`` (or ``default`` if there is no such field)."""
+        if key in self._index:
+            return tuple.__getitem__(self, self._index[key])
+        return default
+
+
+@functools.lru_cache(maxsize=None)
+def _record_class(fields):
+    """Return the subclass of :class:`Record` with fields ``fields`` (a tuple)."""
+    return type(
+        "Record",
+        (Record,),
+        {
+            "__slots__": (),
+            "_fields": fields,
+            "_index": {
+                field: position
+                for position, field in enumerate(fields)
+                if field is not None
+            },
+        },
+    )
+
+
+def record_class(fields):
+    """Return the class of records with fields ``fields``.
+
+    Fields which are ``None`` are anonymous: they are not accessible by name.
+    Several calls with the same fields return the same class.
+    """
+    return _record_class(tuple(fields))
+
+
+def _make_record(fields, values):
+    """Return a record with fields ``fields`` and values ``values`` (used by pickle)."""
+    return _record_class(fields)(values)
+
+
+def iter_chunks(stream, size=CHUNK_SIZE):
+    """Iterate over decoded chunks of binary ``stream``, made of complete lines.
+
+    >>> import io
+    >>> list(iter_chunks(io.BytesIO(b"foo\\nbar\\nbaz"), size=5))
+    ['foo\\n', 'bar\\n', 'baz']
+    """
+    decoder = codecs.getincrementaldecoder("utf8")(errors="replace")
+    pending = ""
+    while True:
+        data = stream.read(size)
+        if not data:
+            break
+        text = pending + decoder.decode(data)
+        end = text.rfind("\n") + 1
+        pending = text[end:]
+        if end:
+            yield text[:end]
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+_GC_LOCK = threading.Lock()
+_GC_STATE = {"pauses": 0, "enabled": True}
+
+
+@contextlib.contextmanager
+def gc_paused():
+    """Context manager disabling the cyclic garbage collector.
+
+    Records are tracked by the garbage collector, which would otherwise be run
+    over and over while allocating them (although they never are part of
+    reference cycles).
+
+    Since the garbage collector is shared by all threads, pauses may overlap:
+    it is only restored to its previous state when the last one ends.
+
+    >>> import gc
+    >>> with gc_paused():
+    ...     with gc_paused():
+    ...         pass
+    ...     gc.isenabled()
+    False
+    >>> gc.isenabled()
+    True
+    """
+    with _GC_LOCK:
+        if not _GC_STATE["pauses"]:
+            _GC_STATE["enabled"] = gc.isenabled()
+            gc.disable()
+        _GC_STATE["pauses"] += 1
+    try:
+        yield
+    finally:
+        with _GC_LOCK:
+            _GC_STATE["pauses"] -= 1
+            if not _GC_STATE["pauses"] and _GC_STATE["enabled"]:
+                gc.enable()
+
+
+class Parser:
+    """Abstract parser."""
+
+    def parse(self, chunk):
+        """Return the list of records of ``chunk`` (a string made of complete lines)."""
+        raise NotImplementedError()
+
+    def iter_batches(self, stream):
+        """Iterate over lists of records of binary ``stream`` (one list per chunk)."""
+        for chunk in iter_chunks(stream):
+            with gc_paused():
+                records = self.parse(chunk)
+            yield records
+
+    def iter_records(self, stream):
+        """Iterate over records of binary ``stream``."""
+        for records in self.iter_batches(stream):
+            yield from records
+
+
+class SplitParser(Parser):
+    """Parse lines made of fields separated by ``separator``.
+
+    :param list fields: Names of the fields.
+    :param str separator: Field separator.
+    :param int required: Minimum number of fields of a line (shorter lines are
+        ignored; missing fields of other lines are empty).
+    :param str prefix: If set, only lines starting with this prefix are
+        parsed (the prefix is not part of records).
+
+    Surrounding spaces of lines (without their prefix) are removed, and blank
+    lines are ignored.
+
+    >>> parser = SplitParser(["package", "version", "path"], required=2)
+    >>> parser.parse("foo\\t1.0\\t/foo.py\\nbar\\t\\nbaz\\n")
+    [Record({'package': 'foo', 'version': '1.0', 'path': '/foo.py'}), \
+Record({'package': 'bar', 'version': '', 'path': ''})]
+    """
+
+    def __init__(self, fields, separator="\t", required=None, prefix=""):
+        self.record = record_class(fields)
+        self.separator = separator
+        self.size = len(fields)
+        self.required = self.size if required is None else required
+        self.prefix = prefix
+
+    def parse(self, chunk):
+        separator, size, required = self.separator, self.size, self.required
+        lines = chunk.split("\n")
+        if self.prefix:
+            start = len(self.prefix)
+            lines = [line[start:] for line in lines if line.startswith(self.prefix)]
+        rows = [line.strip(" \r").split(separator, size - 1) for line in lines if line]
+        records = list(map(self.record, (row for row in rows if len(row) == size)))
+        if required == size or len(records) == len(rows):
+            return records
+
+        # Some lines have missing fields
+        records = []
+        padding = [""] * size
+        for row in rows:
+            if len(row) < size:
+                if len(row) < required or not row[0]:
+                    continue
+                row.extend(padding[len(row) :])
+            records.append(self.record(row))
+        return records
+
+
+@functools.lru_cache(maxsize=None)
+def compile_regexp(regexp, flags=0):
+    """Compile (once) and return ``regexp``."""
+    return re.compile(regexp, flags)
+
+
+class RegexParser(Parser):
+    """Parse lines matching ``regexp``; named groups are the fields of records.
+
+    :param str regexp: Regular expression.
+    :param bool multiline: If ``True``, the regular expression is searched in
+        the whole chunk (with :data:`re.MULTILINE`), which is faster. It must
+        then be anchored (``^``) and it must not match newlines. Otherwise, it
+        is matched against each (stripped) line.
+
+    Groups which did not participate in the match are empty strings.
+
+    >>> parser = RegexParser(r"^(?P<name>[^ \\n]*) \\((?P<arch>[^)\\n]*)\\)", multiline=True)
+    >>> output = "libfoo.so (libc6)\\nignored\\nlibbar.so (libc6)\\n"
+    >>> [record["name"] for record in parser.parse(output)]
+    ['libfoo.so', 'libbar.so']
+    """
+
+    def __init__(self, regexp, multiline=False):
+        self.multiline = multiline
+        self.pattern = compile_regexp(regexp, re.MULTILINE if multiline else 0)
+        # Unnamed groups are anonymous fields
+        names = {number: name for name, number in self.pattern.groupindex.items()}
+        self.record = record_class(
+            names.get(number) for number in range(1, self.pattern.groups + 1)
+        )
+
+    def parse(self, chunk):
+        if self.multiline:
+            if self.pattern.groups == 1:
+                # findall() returns strings (instead of tuples) for a single group
+                return [self.record((value,)) for value in self.pattern.findall(chunk)]
+            return list(map(self.record, self.pattern.findall(chunk)))
+
+        lines = chunk.split("\n")
+        if not lines[-1]:
+            # Chunks end with a newline (but the last one may not)
+            lines.pop()
+        return [
+            self.record(match.groups(""))
+            for match in map(self.pattern.match, map(str.strip, lines))
+            if match
+        ]
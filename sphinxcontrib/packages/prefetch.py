@@ -0,0 +1,284 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Collect records of directives before documents are parsed.
+
+Before documents are read, their sources are scanned for ``packages:``
+directives, and records of all those directives are collected concurrently.
+When a directive is eventually run, it only waits for its records.
+
+Records are kept until the end of the build (see :meth:`Prefetcher.shutdown`):
+directives with the same cache key (e.g. the same ``packages:deb`` directive
+used in several documents) share them, whether they were prefetched or not.
+
+If documents are read by parallel processes, records are collected before
+those processes are forked (see :meth:`Prefetcher.wait`): they share them.
+Records collected by those processes can be added to the prefetcher of the
+main process (see :meth:`Prefetcher.add`).
+"""
+
+import collections
+import concurrent.futures
+import os
+import re
+import threading
+import time
+
+from docutils.utils import DuplicateOptionError, assemble_option_dict
+
+DIRECTIVE_RE = re.compile(
+    r"^(?P<indent>[ \t]*)\.\.[ \t]+packages:(?P<name>[\w-]+)::[ \t]*$"
+)
+LITERAL_RE = re.compile(
+    r"^(?P<indent>[ \t]*)(\.\.[ \t]+(code|code-block|sourcecode)::.*|([^.\s].*)?::)$"
+)
+OPTION_RE = re.compile(
+    r"^(?P<indent>[ \t]+):(?P<name>[\w-]+):(?:[ \t]+(?P<value>.*))?$"
+)
+
+
+def scan_source(text):
+    """Iterate over ``(name, options)`` of ``packages:`` directives found in ``text``.
+
+    ``options`` is a list of ``(name, value)`` tuples. Directives appearing in
+    literal blocks are ignored.
+
+    >>> list(scan_source('''
+    ... .. packages:deb::
+    ...
+    ... This directive is ignored::
+    ...
+    ...   .. packages:c::
+    ...
+    ... ::
+    ...
+    ...   .. packages:latex::
+    ...
+    ... .. packages:python::
+    ...    :bin: python3
+    ...    :foo:
+    ... '''))
+    [('deb', []), ('python', [('bin', 'python3'), ('foo', None)])]
+    """
+    lines = text.splitlines()
+    literal = None
+    for index, line in enumerate(lines):
+        if literal is not None:
+            if not line.strip() or line[: len(literal) + 1].isspace():
+                continue
+            literal = None
+        match = DIRECTIVE_RE.match(line)
+        if match is None:
+            match = LITERAL_RE.match(line)
+            if match is not None:
+                literal = match.group("indent")
+            continue
+        options = []
+        for option_line in lines[index + 1 :]:
+            option = OPTION_RE.match(option_line)
+            if option is None or len(option.group("indent")) <= len(
+                match.group("indent")
+            ):
+                break
+            value = option.group("value")
+            options.append((option.group("name"), value.strip() if value else None))
+        yield match.group("name"), options
+
+
+def iter_directives(env, docnames, directives):
+    """Iterate over directives found in ``docnames``.
+
+    Iterate over ``(docname, option_list, directive)`` tuples, where
+    ``option_list`` is the list of raw options (see :func:`scan_source`), and
+    ``directive`` is an instance of the directive (see
+    :meth:`InventoryDirective.from_options`).
+    """
+    for docname in docnames:
+        try:
+            with open(
+                env.doc2path(docname), encoding=env.config.source_encoding
+            ) as file:
+                text = file.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        for option_list, directive in iter_source_directives(text, directives):
+            yield docname, option_list, directive
+
+
+def iter_source_directives(text, directives):
+    """Iterate over ``(option_list, directive)`` of directives found in ``text``.
+
+    See :func:`iter_directives`. Directives with invalid options are ignored.
+    """
+    for name, option_list in scan_source(text):
+        if name not in directives:
+            continue
+        directive = directives[name]
+        try:
+            options = assemble_option_dict(option_list, directive.option_spec or {})
+        except (KeyError, ValueError, TypeError, DuplicateOptionError):
+            # Invalid options: the error will be reported when parsing the document
+            continue
+        yield option_list, directive.from_options(name, options)
+
+
+#: Records of a directive, paths they depend on, measures of their collection,
+#: and, if collection was interrupted, a message telling why.
+Entry = collections.namedtuple(
+    "Entry", ["records", "dependencies", "profile", "incomplete"]
+)
+
+
+def load_entry(directive, config):
+    """Return the :class:`Entry` of ``directive``.
+
+    See :meth:`InventoryDirective.load`, :meth:`InventoryDirective.dependencies`,
+    and :mod:`sphinxcontrib.packages.instrument` for the measures.
+    """
+    start = time.perf_counter()
+    records = directive.load(config)
+    profile = directive.profile
+    profile["time"] = time.perf_counter() - start
+    profile["records"] = len(records)
+    # Identifies the collection, even when shared by parallel processes
+    profile["collection"] = f"{os.getpid()}-{id(profile)}"
+    return Entry(records, directive.dependencies(config), profile, directive.incomplete)
+
+
+class Prefetcher:
+    """Collect records of directives in a pool of threads.
+
+    Records are collected using :meth:`InventoryDirective.load`, which does
+    most of its work in subprocesses, or in system calls (which both release
+    the GIL): threads are enough to run collectors concurrently.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = {}
+        # Keys of records known by the parent process (if this one is forked)
+        self._inherited = None
+
+    def submit(self, directive, config, max_workers=None):
+        """Start collecting records of ``directive`` (unless they already are being collected).
+
+        :param int max_workers: Maximum number of collectors to run at the same
+            time (only used when the first directive is submitted).
+        """
+        key = directive.cache_key()
+        with self._lock:
+            if key in self._futures:
+                return
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix="packages"
+                )
+            self._futures[key] = self._executor.submit(load_entry, directive, config)
+
+    def start(self, env, docnames, directives, max_workers=None):
+        """Start collecting records of ``directives`` found in documents ``docnames``.
+
+        :param env: Sphinx environment.
+        :param list docnames: Names of the documents to scan.
+        :param dict directives: Dictionary of directive classes, indexed by name.
+        :param int max_workers: Maximum number of collectors to run at the same time.
+        """
+        for __docname, __options, directive in iter_directives(
+            env, docnames, directives
+        ):
+            self.submit(directive, env.config, max_workers)
+
+    def entry(self, directive, config):
+        """Return the :class:`Entry` of ``directive``.
+
+        If it is being prefetched, wait for it. Otherwise, collect it now (in
+        the current thread), and keep it for other directives with the same
+        cache key.
+        """
+        key = directive.cache_key()
+        with self._lock:
+            future = self._futures.get(key)
+            collect = future is None
+            if collect:
+                future = self._futures[key] = concurrent.futures.Future()
+                future.set_running_or_notify_cancel()
+        if collect:
+            try:
+                future.set_result(load_entry(directive, config))
+            except Exception as error:  # pylint: disable=broad-except
+                # Directives with the same key get the same error
+                future.set_exception(error)
+        return future.result()
+
+    def wait(self):
+        """Wait for all records being collected."""
+        with self._lock:
+            futures = list(self._futures.values())
+        concurrent.futures.wait(futures)
+
+    def after_fork(self):
+        """Forget about threads of the parent process (in a forked process).
+
+        Threads are not copied into forked processes: records which were
+        being collected are forgotten (they are collected again if needed).
+        """
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = {
+            key: future for key, future in self._futures.items() if future.done()
+        }
+        self._inherited = set(self._futures)
+
+    def inherited(self, key):
+        """Return ``True`` iff records of ``key`` are known by the parent process.
+
+        This is always true in a process which has not been forked.
+        """
+        return self._inherited is None or key in self._inherited
+
+    def add(self, key, entry):
+        """Add the :class:`Entry` of ``key``, collected by another process.
+
+        ``entry`` can also be the exception raised while collecting it.
+        """
+        with self._lock:
+            if key not in self._futures:
+                future = self._futures[key] = concurrent.futures.Future()
+                if isinstance(entry, Exception):
+                    future.set_exception(entry)
+                else:
+                    future.set_result(entry)
+
+    def result(self, directive, config):
+        """Return the records of ``directive`` (see :meth:`entry`)."""
+        return self.entry(directive, config).records
+
+    def shutdown(self):
+        """Cancel pending collections, and forget about prefetched records."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            futures, self._futures = self._futures, {}
+        for future in futures.values():
+            future.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+#: Prefetcher used by the directives of this extension.
+PREFETCHER = Prefetcher()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=PREFETCHER.after_fork)
@@ -0,0 +1,108 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Select the records displayed by directives.
+
+Options ``:include:`` and ``:exclude:`` (regular expressions searched in
+names), ``:section:`` (names of sections) and ``:limit:`` (maximum number of
+records) are applied while records are collected: when possible, they are
+passed to the source of records (e.g. ``list_modules.py`` does not import
+excluded modules), and otherwise, records are discarded as soon as they are
+parsed.
+
+>>> selection = Selection.from_options({"include": "^lib", "exclude": "-dev$"})
+>>> [name for name in ["libssl", "libssl-dev", "python3"] if selection.accepts_name(name)]
+['libssl']
+"""
+
+import heapq
+import re
+
+
+def pattern(argument):
+    """Conversion function for options which are regular expressions."""
+    try:
+        re.compile(argument)
+    except re.error as error:
+        raise ValueError(f"Invalid regular expression: {error}.") from error
+    return argument
+
+
+class Selection:
+    """Records selected by the options of a directive.
+
+    :param str include: Only names matching this regular expression are kept.
+    :param str exclude: Names matching this regular expression are discarded.
+    :param set sections: Only records of those sections are kept.
+    :param int limit: Only the first ``limit`` records are kept.
+    """
+
+    def __init__(self, include=None, exclude=None, sections=None, limit=None):
+        self.include = None if include is None else re.compile(include)
+        self.exclude = None if exclude is None else re.compile(exclude)
+        self.sections = sections
+        self.limit = limit
+
+    @classmethod
+    def from_options(cls, options):
+        """Return the selection requested by the options of a directive."""
+        sections = None
+        if "section" in options:
+            sections = set(options["section"].replace(",", " ").split())
+        return cls(
+            include=options.get("include"),
+            exclude=options.get("exclude"),
+            sections=sections,
+            limit=options.get("limit"),
+        )
+
+    def accepts_name(self, name):
+        """Return ``True`` iff records named ``name`` are selected."""
+        if self.include is not None and self.include.search(name) is None:
+            return False
+        return self.exclude is None or self.exclude.search(name) is None
+
+    def accepts_section(self, section):
+        """Return ``True`` iff records of section ``section`` are selected."""
+        return self.sections is None or section in self.sections
+
+    def select(self, records, name, section=None, sort_value=None):
+        """Return the list of selected records (among iterable ``records``).
+
+        :param str name: Key of the name of records.
+        :param str section: Key of the section of records (``None`` if
+            records have no sections).
+        :param function sort_value: Records are sorted by this function to
+            keep the first ones (if there is a limit).
+
+        Records are discarded one at a time: at most ``limit`` records are
+        kept in memory.
+
+        >>> Selection(include="o", limit=2).select(
+        ...     [{"name": "foo"}, {"name": "bar"}, {"name": "baz"}, {"name": "bob"}],
+        ...     "name",
+        ...     sort_value=lambda record: record["name"],
+        ... )
+        [{'name': 'bob'}, {'name': 'foo'}]
+        """
+        if self.include is not None or self.exclude is not None:
+            records = (record for record in records if self.accepts_name(record[name]))
+        if section is not None and self.sections is not None:
+            records = (
+                record for record in records if self.accepts_section(record[section])
+            )
+        if self.limit is not None:
+            return heapq.nsmallest(self.limit, records, key=sort_value)
+        return list(records)
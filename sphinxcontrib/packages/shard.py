@@ -0,0 +1,263 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Split large inventories into several documents (shards).
+
+When a directive has a ``:shard:`` option, its records are split into pages
+(one per section, or one per alphabetical bucket). Before documents are read,
+a document is generated for each page (in a directory next to the document
+containing the directive), containing the same directive, with a
+``:shard-page:`` option telling which page to display. The original directive
+is rendered as a table of contents of those pages.
+"""
+
+import collections
+import contextlib
+import hashlib
+import os
+import posixpath
+import re
+
+from docutils import nodes
+from docutils.parsers.rst.directives import choice
+from sphinx import addnodes
+
+from .prefetch import PREFETCHER, iter_directives
+
+#: First line of generated documents.
+MARKER = ".. Generated by sphinxcontrib-packages: do not edit."
+
+#: Documents containing directives whose pages have changed (since their
+#: tables of contents have to be updated).
+OUTDATED = set()
+
+
+def shard_mode(argument):
+    """Conversion function for the ``:shard:`` option."""
+    return choice(argument, ("section", "alpha"))
+
+
+def shard_prefix(docname, directive):
+    """Return the prefix of the names of the documents of the pages of ``directive``.
+
+    :param str docname: Name of the document containing the directive.
+    :param directive: Directive.
+
+    Pages are stored in a directory next to the document containing the
+    directive, named after this document, the directive and its options.
+    """
+    name = directive.name.rpartition(":")[2]
+    digest = hashlib.sha1(
+        repr(
+            (
+                directive.cache_key(),
+                directive.options.get("shard"),
+                directive.options.get("shard-size"),
+            )
+        ).encode("utf8")
+    ).hexdigest()[:8]
+    return f"{docname}-{name}-{digest}/"
+
+
+def shard_directory(env, docname, directive):
+    """Return the path of the directory of the pages of ``directive``."""
+    return os.path.dirname(
+        os.path.normpath(env.doc2path(shard_prefix(docname, directive) + "1"))
+    )
+
+
+def shard_docnames(docname, directive, count):
+    """Return the names of the ``count`` documents of the pages of ``directive``."""
+    prefix = shard_prefix(docname, directive)
+    return [posixpath.normpath(f"{prefix}{number}") for number in range(1, count + 1)]
+
+
+def toctree(directive, docnames):
+    """Return the table of contents of ``docnames``, replacing ``directive``."""
+    node = addnodes.toctree()
+    node["parent"] = directive.state.document.settings.env.docname
+    node["entries"] = [(None, docname) for docname in docnames]
+    node["includefiles"] = docnames
+    node["maxdepth"] = 1
+    node["caption"] = None
+    node["glob"] = False
+    node["hidden"] = False
+    node["includehidden"] = False
+    node["numbered"] = 0
+    node["titlesonly"] = False
+    node.source, node.line = directive.state_machine.get_source_and_line(
+        directive.lineno
+    )
+    return nodes.compound("", node, classes=["toctree-wrapper"])
+
+
+def escape(text):
+    r"""Escape reStructuredText markup of ``text``.
+
+    >>> print(escape("libfoo_*"))
+    libfoo\_\*
+    """
+    return re.sub(r"([\\`*_|<>\[\]])", r"\\\1", text)
+
+
+def page_source(title, name, option_list, number):
+    """Return the source of the document displaying page ``number`` of directive ``name``."""
+    title = escape(title) or "?"
+    lines = [MARKER, "", title, "=" * len(title), "", f".. packages:{name}::"]
+    for option, value in option_list:
+        lines.append(
+            f"   :{option}: {value}" if value is not None else f"   :{option}:"
+        )
+    lines.append(f"   :shard-page: {number}")
+    return "\n".join(lines) + "\n"
+
+
+def is_generated(path):
+    """Return ``True`` iff file ``path`` has been generated by this module."""
+    try:
+        with open(path, encoding="utf8") as file:
+            return file.readline().rstrip("\n") == MARKER
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+def write_if_changed(path, text):
+    """Write ``text`` into file ``path`` (unless it already contains this text).
+
+    Unchanged documents are not written, so that Sphinx does not read them
+    again. Return ``True`` iff the file has been written.
+    """
+    try:
+        with open(path, encoding="utf8") as file:
+            if file.read() == text:
+                return False
+    except (OSError, UnicodeDecodeError):
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf8") as file:
+        file.write(text)
+    return True
+
+
+def generate(app, directives):
+    """Generate the pages of directives having a ``:shard:`` option.
+
+    Records of those directives are collected using :data:`PREFETCHER`, so
+    that they are not collected again when documents are read.
+    """
+    env = app.builder.env
+    todo = [
+        (docname, option_list, directive)
+        for docname, option_list, directive in iter_directives(
+            env, sorted(env.found_docs), directives
+        )
+        if "shard" in directive.options and "shard-page" not in directive.options
+    ]
+    for __docname, __option_list, directive in todo:
+        PREFETCHER.submit(directive, app.config, app.config.packages_prefetch_workers)
+
+    remove_stale_directories(
+        env,
+        {
+            shard_directory(env, docname, directive)
+            for docname, __option_list, directive in todo
+        },
+    )
+    for docname, option_list, directive in todo:
+        try:
+            pages = directive.shards(PREFETCHER.result(directive, app.config))
+        except Exception:  # pylint: disable=broad-except
+            # Errors are reported when the directive is run
+            continue
+        if write_pages(env, docname, option_list, directive, pages):
+            OUTDATED.add(docname)
+
+
+def write_pages(env, docname, option_list, directive, pages):
+    """Write the documents of ``pages`` of ``directive`` (and remove stale ones).
+
+    Return ``True`` iff some documents have been written or removed.
+    """
+    paths = [
+        os.path.normpath(env.doc2path(page))
+        for page in shard_docnames(docname, directive, len(pages))
+    ]
+    changed = False
+    for number, ((title, __records), path) in enumerate(zip(pages, paths), 1):
+        changed |= write_if_changed(
+            path, page_source(title, directive.name, option_list, number)
+        )
+    changed |= remove_stale_pages(shard_directory(env, docname, directive), paths)
+    return changed
+
+
+def remove_stale_directories(env, directories):
+    """Remove directories of generated pages which are not in ``directories``.
+
+    Directories of pages are named after the document containing the
+    directive, and its options (see :func:`shard_prefix`). Directories of
+    directives which have been removed, or whose options have changed, are
+    removed (only generated documents are removed, and then the directory,
+    if it is empty).
+    """
+    prefixes = collections.defaultdict(set)
+    for docname in env.found_docs:
+        path = os.path.normpath(env.doc2path(docname))
+        prefixes[os.path.dirname(path)].add(
+            os.path.splitext(os.path.basename(path))[0] + "-"
+        )
+    for parent, names in prefixes.items():
+        try:
+            with os.scandir(parent) as entries:
+                stale = [
+                    entry.path
+                    for entry in entries
+                    if entry.name.startswith(tuple(names))
+                    and entry.is_dir()
+                    and os.path.normpath(entry.path) not in directories
+                ]
+        except OSError:
+            continue
+        for directory in stale:
+            remove_stale_pages(directory, [])
+            with contextlib.suppress(OSError):
+                os.rmdir(directory)
+
+
+def remove_stale_pages(directory, paths):
+    """Remove documents of ``directory`` which were generated, but are not in ``paths``.
+
+    Return ``True`` iff some documents have been removed.
+    """
+    if not os.path.isdir(directory):
+        return False
+    removed = False
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if (
+                entry.is_file()
+                and os.path.normpath(entry.path) not in paths
+                and is_generated(entry.path)
+            ):
+                os.remove(entry.path)
+                removed = True
+    return removed
+
+
+def env_get_outdated(__app, __env, __added, __changed, __removed):
+    """Return the documents whose tables of contents of pages have to be updated."""
+    outdated = sorted(OUTDATED)
+    OUTDATED.clear()
+    return outdated
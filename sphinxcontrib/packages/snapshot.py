@@ -0,0 +1,209 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Snapshots of inventories of a host, to build documentation elsewhere.
+
+A snapshot is a gzip-compressed JSON file, written by ``python -m
+sphinxcontrib.packages snapshot``, containing the records of several
+directives. If :confval:`packages_snapshot` is set, directives display the
+records of this file instead of collecting them on the build machine.
+
+Records which are :class:`~sphinxcontrib.packages.parsing.Record` objects are
+stored as lists of values (their fields are stored once per inventory).
+
+>>> import os, tempfile
+>>> from sphinxcontrib.packages import DebDirective
+>>> from sphinxcontrib.packages.parsing import record_class
+>>> directive = DebDirective.from_options("deb", {})
+>>> record = record_class(["package", "version"])(["foo", "1.0"])
+>>> path = os.path.join(tempfile.mkdtemp(), "snapshot.json.gz")
+>>> write(path, [(directive, [record])])
+>>> get_records(path, directive)
+[Record({'package': 'foo', 'version': '1.0'})]
+>>> get_records(path, DebDirective.from_options("deb", {"fields": "Origin"}))
+... # doctest: +ELLIPSIS
+Traceback (most recent call last):
+...
+sphinxcontrib.packages.snapshot.SnapshotError: No such inventory in snapshot ...
+>>> import shutil; shutil.rmtree(os.path.dirname(path))
+"""
+
+import functools
+import gzip
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+
+from .parsing import Record, record_class
+
+#: Version of the format of snapshots. Snapshots of a different version cannot be read.
+FORMAT = 1
+
+
+class SnapshotError(Exception):
+    """A snapshot cannot be read, or does not contain the requested inventory."""
+
+
+def snapshot_key(directive):
+    """Return a key identifying the records of ``directive``, on any host.
+
+    This is the cache key, without items which depend on the host (e.g. path
+    of the commands).
+    """
+    return repr(directive.cache_key()[:3])
+
+
+def diff_order(directive, record):
+    """Return the key sorting ``record`` of ``directive`` in snapshots.
+
+    This is the list of the keys (see :attr:`InventoryDirective.diff_key`) of
+    the rows exported for ``record``, so that snapshots are sorted as
+    :func:`sphinxcontrib.packages.diff.keyed` expects.
+    """
+    return [
+        tuple(row[field] for field in directive.diff_key)
+        for row in directive.export([record])
+    ]
+
+
+def encode(records):
+    """Return the ``(fields, rows)`` tuple storing ``records`` as JSON.
+
+    >>> encode([["Machine", "x86_64"]])
+    (None, [['Machine', 'x86_64']])
+    >>> encode([record_class(["package", None])(["foo", "bar"])])
+    (['package', None], [['foo', 'bar']])
+    """
+    if records and all(isinstance(record, Record) for record in records):
+        fields = type(records[0])._fields  # pylint: disable=protected-access
+        if all(
+            type(record)._fields == fields  # pylint: disable=protected-access
+            for record in records
+        ):
+            return list(fields), [list(record) for record in records]
+    return None, list(records)
+
+
+def decode(fields, rows):
+    """Return records stored as ``(fields, rows)`` (see :func:`encode`)."""
+    if fields is None:
+        return rows
+    return list(map(record_class(fields), rows))
+
+
+def write(path, inventories):
+    """Write snapshot ``path``.
+
+    :param str path: Path of the snapshot.
+    :param inventories: Iterable of ``(directive, records)`` tuples.
+
+    Records of directives which sort them when they are rendered (tables) are
+    stored sorted by :attr:`InventoryDirective.diff_key`, so that snapshots
+    are compared without being sorted again (see :mod:`.diff`).
+    """
+    entries = []
+    for directive, records in inventories:
+        if directive.diff_key and getattr(directive, "sortkey", None):
+            # Those records are sorted when rendered: their order does not matter
+            records = sorted(records, key=functools.partial(diff_order, directive))
+        fields, rows = encode(records)
+        entries.append(
+            {
+                "directive": directive.name.rpartition(":")[2],
+                "options": {
+                    key: value
+                    for key, value in sorted(directive.options.items())
+                    if key not in directive.render_options
+                },
+                "key": snapshot_key(directive),
+                "fields": fields,
+                "records": rows,
+            }
+        )
+
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(
+        dir=directory, suffix=".tmp", delete=False
+    ) as file:
+        with gzip.open(file, "wt", encoding="utf8") as stream:
+            json.dump(
+                {
+                    "format": FORMAT,
+                    "host": platform.node(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "inventories": entries,
+                },
+                stream,
+                separators=(",", ":"),
+                default=str,
+            )
+    # Temporary files are only readable by their owner
+    os.chmod(file.name, 0o644)
+    os.replace(file.name, path)
+
+
+_LOCK = threading.Lock()
+_LOADED = {}
+
+
+def load(path):
+    """Return the inventories stored in snapshot ``path``.
+
+    Return a dictionary of ``(fields, rows)`` (see :func:`encode`), indexed
+    by :func:`snapshot_key`. The file is only read again if it changed since
+    it was last read.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError as error:
+        raise SnapshotError(f"Cannot read snapshot '{path}': {error}.") from error
+    with _LOCK:
+        version = (stat.st_mtime_ns, stat.st_size)
+        if path in _LOADED and _LOADED[path][0] == version:
+            return _LOADED[path][1]
+        try:
+            with gzip.open(path, "rt", encoding="utf8") as file:
+                data = json.load(file)
+        except (OSError, EOFError, ValueError) as error:
+            raise SnapshotError(f"Cannot read snapshot '{path}': {error}.") from error
+        if not isinstance(data, dict) or data.get("format") != FORMAT:
+            raise SnapshotError(
+                f"Snapshot '{path}' has an unsupported format (expected {FORMAT})."
+            )
+        inventories = {
+            entry["key"]: (entry["fields"], entry["records"])
+            for entry in data["inventories"]
+        }
+        _LOADED[path] = (version, inventories)
+        return inventories
+
+
+def get_records(path, directive):
+    """Return the records of ``directive`` stored in snapshot ``path``.
+
+    Raise :class:`SnapshotError` if the snapshot does not contain them.
+    """
+    try:
+        fields, rows = load(path)[snapshot_key(directive)]
+    except KeyError:
+        raise SnapshotError(
+            f"No such inventory in snapshot '{path}' (run "
+            "'python -m sphinxcontrib.packages snapshot' with the sources "
+            "of the documentation as arguments to include it)."
+        ) from None
+    return decode(fields, rows)
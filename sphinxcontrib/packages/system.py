@@ -0,0 +1,266 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Probe the host system: binaries of ``PATH``, python interpreters, etc."""
+
+import collections
+import concurrent.futures
+import glob
+import os
+import platform
+import re
+import subprocess
+import sys
+
+
+def iter_paths():
+    """Iterate over existing paths."""
+    for string in os.getenv("PATH").split(":"):
+        path = os.path.expanduser(os.path.expandvars(string))
+        if os.path.exists(path) and os.path.isdir(path):
+            yield path
+
+
+def is_executable(stat, uid, gids):
+    """Return ``True`` iff user ``uid`` (member of groups ``gids``) can execute a file.
+
+    This is equivalent to ``os.access(path, os.X_OK)``, using an existing
+    :class:`os.stat_result` of the file instead of another system call.
+
+    >>> stat = os.stat_result((0o100750, 0, 0, 1, 1000, 100, 0, 0, 0, 0))
+    >>> is_executable(stat, 0, set())
+    True
+    >>> is_executable(stat, 1001, {100})
+    True
+    >>> is_executable(stat, 1001, {1001})
+    False
+    """
+    if uid == 0:
+        return bool(stat.st_mode & 0o111)
+    if stat.st_uid == uid:
+        return bool(stat.st_mode & 0o100)
+    if stat.st_gid in gids:
+        return bool(stat.st_mode & 0o010)
+    return bool(stat.st_mode & 0o001)
+
+
+def scan_path(paths=None):
+    """Iterate over binaries available in the ``PATH`` directories, in a single pass.
+
+    :param list paths: List of directories (default: the directories of ``PATH``).
+
+    Iterate over ``(path, duplicate, binaries)`` tuples, where:
+
+    - ``path`` is a directory of ``paths``;
+    - ``duplicate`` is ``None``, or an earlier directory of ``paths`` which is
+      the same directory as ``path`` (same path, or symbolic link to it): in
+      this case, ``path`` is not scanned again;
+    - ``binaries`` is the sorted list of ``(name, shadowed)`` tuples, where
+      ``name`` is the name of an executable file of ``path``, and ``shadowed``
+      is ``None``, or the earlier directory of ``paths`` containing a binary
+      with the same name (which shadows this one).
+    """
+    if paths is None:
+        paths = iter_paths()
+    uid, gids = os.geteuid(), {os.getegid(), *os.getgroups()}
+    scanned = {}
+    providers = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        key = (stat.st_dev, stat.st_ino)
+        if key in scanned:
+            yield (path, scanned[key][0], scanned[key][1])
+            continue
+
+        names = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file() and is_executable(entry.stat(), uid, gids):
+                            names.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+        binaries = []
+        for name in sorted(names):
+            binaries.append((name, providers.get(name)))
+            providers.setdefault(name, path)
+        scanned[key] = (path, binaries)
+        yield (path, None, binaries)
+
+
+def module_directory(path):
+    """Return the directory (of ``sys.path``) containing the module at ``path``.
+
+    >>> module_directory("/usr/lib/python3/dist-packages/foo/__init__.py")
+    '/usr/lib/python3/dist-packages'
+    >>> module_directory("/usr/lib/python3/dist-packages/bar.py")
+    '/usr/lib/python3/dist-packages'
+    """
+    directory, basename = os.path.split(path)
+    if os.path.splitext(basename)[0] == "__init__":
+        return os.path.dirname(directory)
+    return directory
+
+
+def site_directories(binary):
+    """Return the list of potential site directories of python ``binary``.
+
+    This is a cheap guess (the interpreter is not run): it is used to detect
+    that modules have been installed or removed.
+    """
+    prefix = os.path.dirname(os.path.dirname(binary))
+    patterns = [
+        os.path.join(prefix, "lib", "python*", "site-packages"),
+        os.path.join(prefix, "lib", "python*", "dist-packages"),
+        os.path.join(prefix, "local", "lib", "python*", "dist-packages"),
+        os.path.join(prefix, "lib", "python3", "dist-packages"),
+        os.path.expanduser(
+            os.path.join("~", ".local", "lib", "python*", "site-packages")
+        ),
+    ]
+    directories = [
+        directory for pattern in patterns for directory in glob.glob(pattern)
+    ]
+    directories.extend(path for path in os.getenv("PYTHONPATH", "").split(":") if path)
+    return directories
+
+
+PYTHON_RE = re.compile(r"^python[.0123456789]*$")
+
+#: Versions of python interpreters, indexed by ``(device, inode, mtime, size)``.
+_PYTHON_VERSIONS = {}
+
+
+def pyvenv_version(binary):
+    """Return the version of python ``binary``, read from ``pyvenv.cfg``.
+
+    Return ``None`` if ``binary`` is not part of a virtual environment.
+    """
+    path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(binary))), "pyvenv.cfg"
+    )
+    try:
+        with open(path, encoding="utf8") as file:
+            for line in file:
+                key, __separator, value = line.partition("=")
+                key, value = key.strip(), value.strip()
+                if key == "version":
+                    return f"Python {value}"
+                if key == "version_info":
+                    # Written by virtualenv, e.g. "3.11.2.final.0"
+                    return "Python " + ".".join(value.split(".")[:3])
+    except (OSError, UnicodeDecodeError):
+        pass
+    return None
+
+
+def python_version(binary, timeout=None):
+    """Return the version of python ``binary`` (e.g. ``"Python 3.11.2"``).
+
+    The binary is only run if its version cannot be guessed otherwise (if it
+    is the current interpreter, or part of a virtual environment).
+    Return ``None`` if the binary cannot be run, or did not answer before ``timeout``.
+    """
+    try:
+        if os.path.samefile(binary, sys.executable):
+            return f"Python {platform.python_version()}"
+    except OSError:
+        return None
+
+    version = pyvenv_version(binary)
+    if version is not None:
+        return version
+
+    try:
+        return subprocess.run(
+            [binary, "--version"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            check=True,
+            timeout=timeout,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def python_interpreters(timeout=10):
+    """Return the list of ``[binaries, version]`` of available python interpreters.
+
+    - ``binaries`` is the sorted list of executables which are the same file
+      (symbolic or hard links, directories merged by usrmerge, etc.);
+    - ``version`` is the version of this interpreter, as a string.
+
+    Each interpreter is only probed until its version is known, and interpreters
+    are probed concurrently.
+    """
+    candidates = []
+    for path in iter_paths():
+        try:
+            names = sorted(os.listdir(path))
+        except OSError:
+            # Unreadable directory
+            continue
+        candidates.extend(
+            os.path.join(path, name) for name in names if PYTHON_RE.match(name)
+        )
+    if PYTHON_RE.match(os.path.basename(sys.executable)):
+        candidates.append(sys.executable)
+
+    interpreters = collections.defaultdict(list)
+    for binary in dict.fromkeys(candidates):
+        try:
+            stat = os.stat(binary)
+        except OSError:
+            continue
+        if not os.path.isfile(binary):
+            continue
+        interpreters[(stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)].append(
+            binary
+        )
+
+    def probe(key):
+        """Return the version of the interpreter identified by ``key``."""
+        if key not in _PYTHON_VERSIONS:
+            version = python_version(interpreters[key][0], timeout)
+            if version is None:
+                return None
+            _PYTHON_VERSIONS[key] = version
+        return _PYTHON_VERSIONS[key]
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        versions = executor.map(probe, list(interpreters))
+        return [
+            [sorted(binaries), version]
+            for binaries, version in zip(interpreters.values(), versions)
+            if version is not None
+        ]
+
+
+def python_versions():
+    """Iterate over [binary, version] lists of available python executables.
+
+    Both items are strings.
+    """
+    for binaries, version in python_interpreters():
+        for binary in binaries:
+            yield [binary, version]
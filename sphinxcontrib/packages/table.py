@@ -0,0 +1,340 @@
+# Copyright Louis Paternault 2015-2024
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>. 1
+
+"""Compact tables, expanded into docutils tables at write time.
+
+A docutils table is made of a row node per row, and an entry node and a
+paragraph node per cell (and more nodes if cells contain markup). Those nodes
+are pickled into the environment, which is slow (and large) for tables of
+thousands of rows.
+
+An :class:`inventory_table` node only stores its cells, column by column. Each
+cell is either:
+
+- a string;
+- an :class:`Inline` object (see :func:`literal`, :func:`emphasis`,
+  :func:`strong` and :func:`link`);
+- a tuple of strings and :class:`Inline` objects, which are concatenated.
+
+It is replaced by an actual table by :func:`doctree_resolved`, once the
+document has been read from the environment, just before it is written.
+
+With HTML builders, if :confval:`packages_virtual_table_rows` is set, tables
+of at least this number of rows are rendered by the browser instead: their
+cells are written into a compressed JSON file (in directory
+:data:`VIRTUAL_DIR` of the output directory), and the page only contains an
+empty table, filled by a script which only displays visible rows (rows can
+be sorted and filtered as well). This keeps large pages light.
+"""
+
+import collections
+import gzip
+import hashlib
+import html
+import importlib.resources
+import json
+import os
+
+from docutils import nodes
+from sphinx.util.osutil import relative_uri
+
+#: Directory (in the output directory) of the cells of virtual tables.
+VIRTUAL_DIR = "_packages_tables"
+
+#: Inline markup of a cell.
+Inline = collections.namedtuple("Inline", ["kind", "text", "target"], defaults=[None])
+
+
+def literal(text):
+    """Return a literal ``text``."""
+    return Inline("literal", text)
+
+
+def emphasis(text):
+    """Return an emphasized ``text``."""
+    return Inline("emphasis", text)
+
+
+def strong(text):
+    """Return a strongly emphasized ``text``."""
+    return Inline("strong", text)
+
+
+def link(text, target):
+    """Return a link to ``target``, displaying ``text``."""
+    return Inline("link", text, target)
+
+
+def literals(texts):
+    """Return a cell made of comma-separated literals.
+
+    >>> literals(["python3", "python"])
+    (Inline(kind='literal', text='python3', target=None), ', ', \
+Inline(kind='literal', text='python', target=None))
+    """
+    cell = []
+    for index, text in enumerate(texts):
+        if index:
+            cell.append(", ")
+        cell.append(literal(text))
+    return tuple(cell)
+
+
+def tree(name, names):
+    """Return the cell displaying dotted module ``name`` in a tree.
+
+    The name is indented once per ancestor found in ``names``, and only the
+    part following its closest ancestor is displayed.
+
+    >>> tree("foo.bar.baz", {"foo", "foo.bar.baz"})
+    '\u2003bar.baz'
+    >>> tree("foo.bar", {"foo.bar"})
+    'foo.bar'
+    """
+    parts = name.split(".")
+    ancestors = [
+        length for length in range(1, len(parts)) if ".".join(parts[:length]) in names
+    ]
+    if not ancestors:
+        return name
+    return "\u2003" * len(ancestors) + ".".join(parts[ancestors[-1] :])
+
+
+def inline_node(item):
+    """Return the node of an item of a cell (a string or an :class:`Inline` object)."""
+    if isinstance(item, str):
+        return nodes.Text(item)
+    if item.kind == "literal":
+        return nodes.literal(text=item.text)
+    if item.kind == "emphasis":
+        return nodes.emphasis(text=item.text)
+    if item.kind == "strong":
+        return nodes.strong(text=item.text)
+    if item.kind == "link":
+        return nodes.reference(item.text, item.text, internal=False, refuri=item.target)
+    raise ValueError(f"Unknown inline markup '{item.kind}'.")
+
+
+def cell_node(cell):
+    """Return the node displaying ``cell``.
+
+    >>> print(cell_node((emphasis("shadowed by "), literal("/usr/bin"))))
+    <paragraph><emphasis>shadowed by </emphasis><literal>/usr/bin</literal></paragraph>
+    """
+    if isinstance(cell, nodes.Node):
+        return cell
+    if isinstance(cell, str):
+        return nodes.paragraph(text=cell)
+    if isinstance(cell, Inline):
+        cell = (cell,)
+    return nodes.paragraph("", "", *(inline_node(item) for item in cell))
+
+
+def node_or_str(text):
+    """Return argument, converted to a node if necessary."""
+    if isinstance(text, str):
+        return nodes.paragraph(text=text)
+    return text
+
+
+def simple_compound(*items):
+    """Return a compound node."""
+    compound = nodes.compound()
+    for item in items:
+        compound.append(item)
+    return compound
+
+
+def simple_bulletlist(items):
+    """Return a bullet list nodes of arguments."""
+    return nodes.bullet_list(
+        "", *[nodes.list_item("", node_or_str(item)) for item in items]
+    )
+
+
+def simple_table(ncolumns, headers, body):
+    """Return a table node.
+
+    :param int ncolumns: Number of columns.
+    :param list headers: Headers, as a list of cells, or ``None`` (or an
+        empty list) if there is no headers.
+    :param list body: Body, as a list of lists of cells (or nodes).
+    """
+
+    def _build_table_row(data):
+        """Return the node corresponding to a row of the table."""
+        row = nodes.row()
+        for cell in data:
+            entry = nodes.entry()
+            row += entry
+            entry.append(cell_node(cell))
+        return row
+
+    table = nodes.table()
+    tgroup = nodes.tgroup(cols=ncolumns)
+    table += tgroup
+    for colwidth in [10] * ncolumns:
+        colspec = nodes.colspec(colwidth=colwidth)
+        tgroup += colspec
+
+    # HEAD
+    if headers:
+        thead = nodes.thead()
+        tgroup += thead
+        thead += _build_table_row(headers)
+
+    # BODY
+    tbody = nodes.tbody()
+    tgroup += tbody
+    for row in body:
+        tbody += _build_table_row(row)
+
+    return table
+
+
+class inventory_table(nodes.General, nodes.Element):  # pylint: disable=invalid-name
+    """A table whose cells are stored as columns.
+
+    Attributes are ``headers`` (list of cells, or ``None``) and ``columns``
+    (list of columns, which are lists of cells).
+    """
+
+    @classmethod
+    def from_rows(cls, ncolumns, headers, body):
+        """Return a table node (same arguments as :func:`simple_table`, without nodes).
+
+        >>> node = inventory_table.from_rows(2, ["Name", "Version"], [["foo", "1.0"]])
+        >>> node["columns"]
+        [['foo'], ['1.0']]
+        >>> print(node.expand())
+        <table><tgroup cols="2"><colspec colwidth="10"/><colspec colwidth="10"/>\
+<thead><row><entry><paragraph>Name</paragraph></entry><entry><paragraph>Version</paragraph>\
+</entry></row></thead><tbody><row><entry><paragraph>foo</paragraph></entry><entry>\
+<paragraph>1.0</paragraph></entry></row></tbody></tgroup></table>
+        """
+        columns = [[] for _ in range(ncolumns)]
+        for row in body:
+            for column, cell in zip(columns, row):
+                column.append(cell)
+        return cls("", headers=headers, columns=columns)
+
+    def expand(self):
+        """Return the docutils table displaying this node."""
+        return simple_table(
+            len(self["columns"]), self["headers"], zip(*self["columns"])
+        )
+
+
+def encode_cell(cell):
+    """Return ``cell`` as a JSON value (used by virtual tables).
+
+    Strings are kept, and other cells are lists of items, where inline markup
+    is a ``[kind, text]`` (or ``[kind, text, target]``) list.
+
+    >>> encode_cell("foo")
+    'foo'
+    >>> encode_cell((literal("foo"), ", ", link("bar", "https://bar.org")))
+    [['literal', 'foo'], ', ', ['link', 'bar', 'https://bar.org']]
+    """
+    if isinstance(cell, str):
+        return cell
+    if isinstance(cell, Inline):
+        cell = (cell,)
+    return [
+        (
+            item
+            if isinstance(item, str)
+            else [field for field in item if field is not None]
+        )
+        for item in cell
+    ]
+
+
+def is_virtual(app, node):
+    """Return ``True`` iff ``node`` is to be rendered by the browser."""
+    rows = app.config.packages_virtual_table_rows
+    return (
+        rows is not None
+        and app.builder.format == "html"
+        and not app.builder.name.startswith("epub")
+        and bool(node["columns"])
+        and len(node["columns"][0]) >= rows
+    )
+
+
+def write_virtual(app, node):
+    """Write the cells of ``node`` into a compressed JSON file.
+
+    Return the path of this file, relative to the output directory. Files are
+    named after their content: identical tables share the same file.
+    """
+    data = json.dumps(
+        {
+            "headers": [encode_cell(cell) for cell in node["headers"] or []],
+            "columns": [
+                [encode_cell(cell) for cell in column] for column in node["columns"]
+            ],
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf8")
+    filename = f"{VIRTUAL_DIR}/{hashlib.sha1(data).hexdigest()}.json.gz"
+    path = os.path.join(app.outdir, filename)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Parallel processes may write the same file
+        with open(f"{path}.{os.getpid()}", "wb") as file:
+            file.write(gzip.compress(data, mtime=0))
+        os.replace(f"{path}.{os.getpid()}", path)
+    return filename
+
+
+def virtual_node(app, docname, node):
+    """Return the (raw HTML) node replacing ``node`` with a virtual table."""
+    # Single page builders add a fragment to the URI of documents
+    base = app.builder.get_target_uri(docname).partition("#")[0]
+    uri = html.escape(relative_uri(base, write_virtual(app, node)))
+    rows = len(node["columns"][0])
+    return nodes.raw(
+        "",
+        f'<div class="packages-virtual-table" data-src="{uri}" data-rows="{rows}">'
+        f"<noscript><p>This table ({rows} rows) is displayed using JavaScript: "
+        f'its <a href="{uri}">cells</a> are stored as compressed JSON.</p>'
+        "</noscript></div>",
+        format="html",
+    )
+
+
+def builder_inited(app):
+    """Copy and register the script and style sheet of virtual tables (if enabled)."""
+    if app.config.packages_virtual_table_rows is None or app.builder.format != "html":
+        return
+    static = os.path.join(app.outdir, "_static")
+    os.makedirs(static, exist_ok=True)
+    for name in ("packages-table.js", "packages-table.css"):
+        source = importlib.resources.files(__package__) / "data" / "static" / name
+        with open(os.path.join(static, name), "wb") as file:
+            file.write(source.read_bytes())
+    app.add_js_file("packages-table.js")
+    app.add_css_file("packages-table.css")
+
+
+def doctree_resolved(app, doctree, docname):
+    """Replace :class:`inventory_table` nodes with docutils (or virtual) tables."""
+    for node in list(doctree.findall(inventory_table)):
+        if is_virtual(app, node):
+            node.replace_self(virtual_node(app, docname, node))
+        else:
+            node.replace_self(node.expand())
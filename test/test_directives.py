@@ -0,0 +1,178 @@
+#!/usr/bin python
+
+# Copyright 2015-2024 Louis Paternault
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of directives (in sphinx builds)"""
+
+import io
+import os
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from sphinx.application import Sphinx
+from sphinx.errors import ConfigError
+from sphinx.util.docutils import docutils_namespace
+
+
+def build_in(directory, source, files=None, overrides=None):
+    """Build the project of ``directory``, whose ``index.rst`` is ``source``.
+
+    In ``source``, ``{srcdir}`` is replaced with the directory of the project.
+
+    :param dict files: Other files of the project (``{name: bytes}``).
+    :param dict overrides: Configuration values (as set by ``-D``).
+    :return: A ``(html, warnings, documents)`` tuple: the content of
+        ``index.html``, the warnings of the build, and the list of documents
+        of the project (including generated ones).
+    """
+    with open(os.path.join(directory, "conf.py"), "w", encoding="utf8") as file:
+        file.write('extensions = ["sphinxcontrib.packages"]\n')
+    with open(os.path.join(directory, "index.rst"), "w", encoding="utf8") as file:
+        file.write(textwrap.dedent(source).format(srcdir=directory))
+    for name, content in (files or {}).items():
+        with open(os.path.join(directory, name), "wb") as file:
+            file.write(content)
+    warnings = io.StringIO()
+    with docutils_namespace():
+        app = Sphinx(
+            directory,
+            directory,
+            os.path.join(directory, "_build", "html"),
+            os.path.join(directory, "_build", "doctrees"),
+            "html",
+            confoverrides=overrides,
+            status=None,
+            warning=warnings,
+        )
+        app.build()
+    with open(
+        os.path.join(directory, "_build", "html", "index.html"), encoding="utf8"
+    ) as file:
+        return file.read(), warnings.getvalue(), sorted(app.env.found_docs)
+
+
+def build(source, files=None, overrides=None):
+    """Build a temporary project whose ``index.rst`` is ``source`` (see :func:`build_in`)."""
+    with tempfile.TemporaryDirectory() as directory:
+        return build_in(directory, source, files, overrides)
+
+
+class TestC(unittest.TestCase):
+    """Directive ``packages:c``"""
+
+    def test_truncated_ldcache(self):
+        """An invalid ``:ldcache:`` file is reported, without aborting the build."""
+        html, warnings, _ = build(
+            """
+            Libraries
+            =========
+
+            .. packages:c::
+               :ldcache: {srcdir}/ld.so.cache
+            """,
+            # A valid header (of the new format), announcing one missing entry
+            files={"ld.so.cache": b"glibc-ld.so.cache1.1" + bytes([1] + 27 * [0])},
+        )
+        self.assertIn("Invalid cache", warnings)
+        self.assertIn("Truncated file.", html)
+
+
+class TestPython(unittest.TestCase):
+    """Directive ``packages:python``"""
+
+    def test_matrix_shard(self):
+        """Modules of several interpreters cannot be sharded."""
+        _, warnings, documents = build(f"""
+            Modules
+            =======
+
+            .. packages:python::
+               :bin: {sys.executable} {sys.executable}
+               :include: ^json$
+               :shard: alpha
+            """)
+        self.assertIn("cannot shard several interpreters", warnings)
+        self.assertEqual(documents, ["index"])
+
+    def test_shard_size(self):
+        """Pages of previous options are removed."""
+        source = """
+            Modules
+            =======
+
+            .. packages:python::
+               :include: ^(csv|json|string)$
+               :shard: alpha
+               :shard-size: {size}
+            """
+        with tempfile.TemporaryDirectory() as directory:
+            _, _, before = build_in(directory, source.replace("{size}", "2"))
+            _, warnings, after = build_in(directory, source.replace("{size}", "1"))
+            sources = sorted(
+                os.path.relpath(os.path.join(root, name), directory)
+                for root, _, names in os.walk(directory)
+                if "_build" not in os.path.relpath(root, directory).split(os.sep)
+                for name in names
+                if name.endswith(".rst")
+            )
+        self.assertEqual(len(before), 3)
+        self.assertEqual(len(after), 4)
+        self.assertEqual(sources, sorted(f"{document}.rst" for document in after))
+        self.assertNotIn("toctree", warnings)
+
+
+class TestDiff(unittest.TestCase):
+    """Directive ``packages:diff``"""
+
+    def test_missing_snapshot(self):
+        """Missing snapshots are reported, without aborting the build."""
+        html, warnings, _ = build("""
+            Changes
+            =======
+
+            .. packages:diff:: missing.json.gz
+               :inventory: python
+            """)
+        self.assertIn("missing.json.gz", warnings)
+        self.assertIn("missing.json.gz", html)
+
+
+class TestConfig(unittest.TestCase):
+    """Configuration values"""
+
+    source = """
+        Modules
+        =======
+
+        .. packages:python::
+           :include: ^(csv|json)$
+        """
+
+    def test_virtual_table_rows(self):
+        """Numbers of rows set on the command line are converted."""
+        html, _, _ = build(self.source, overrides={"packages_virtual_table_rows": "1"})
+        self.assertIn("packages-virtual-table", html)
+
+    def test_invalid_virtual_table_rows(self):
+        """Invalid numbers of rows are reported."""
+        with self.assertRaisesRegex(ConfigError, "packages_virtual_table_rows"):
+            build(self.source, overrides={"packages_virtual_table_rows": "many"})
+
+
+if __name__ == "__main__":
+    unittest.main()
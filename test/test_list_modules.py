@@ -0,0 +1,148 @@
+#!/usr/bin python
+
+# Copyright 2015-2024 Louis Paternault
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests of list_modules.py (the script listing the modules of an interpreter)"""
+
+import importlib.resources
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from sphinxcontrib.packages.command import Command
+
+LIST_MODULES = (
+    importlib.resources.files("sphinxcontrib.packages")
+    / "data"
+    / "bin"
+    / "list_modules.py"
+)
+
+
+def list_modules(*arguments, **kwargs):
+    """Run list_modules.py, and return the completed process."""
+    return subprocess.run(
+        [sys.executable, str(LIST_MODULES), *arguments],
+        stdout=subprocess.PIPE,
+        text=True,
+        check=False,
+        **kwargs,
+    )
+
+
+def workers():
+    """Return the process IDs of the running workers of list_modules.py."""
+    pids = []
+    for pid in os.listdir("/proc"):
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as file:
+                args = file.read().split(b"\0")
+        except OSError:
+            continue
+        if os.fsencode(str(LIST_MODULES)) in args and b"--worker" in args:
+            pids.append(int(pid))
+    return pids
+
+
+class TestMetadata(unittest.TestCase):
+    """Versions read from metadata"""
+
+    def test_shared_namespace(self):
+        """A namespace shared by several distributions has no version."""
+        with tempfile.TemporaryDirectory() as directory:
+            for project, version in (("a", "1.0"), ("b", "2.0")):
+                os.makedirs(os.path.join(directory, "nspkg", project))
+                with open(
+                    os.path.join(directory, "nspkg", project, "__init__.py"),
+                    "w",
+                    encoding="utf8",
+                ):
+                    pass
+                info = os.path.join(directory, f"nspkg_{project}-{version}.dist-info")
+                os.makedirs(info)
+                for name, content in (
+                    ("METADATA", f"Name: nspkg-{project}\nVersion: {version}\n"),
+                    ("top_level.txt", "nspkg\n"),
+                    ("RECORD", f"nspkg/{project}/__init__.py,,\n"),
+                ):
+                    with open(os.path.join(info, name), "w", encoding="utf8") as file:
+                        file.write(content)
+            process = list_modules(
+                "--metadata",
+                "--depth",
+                "1",
+                "--include",
+                "^nspkg",
+                env={**os.environ, "PYTHONPATH": directory},
+            )
+        self.assertEqual(process.returncode, 0)
+        self.assertEqual(
+            [line.split("\t")[:2] for line in process.stdout.splitlines()],
+            [["nspkg", ""], ["nspkg.a", "1.0"], ["nspkg.b", "2.0"]],
+        )
+
+
+class TestWorkers(unittest.TestCase):
+    """Modules imported in worker processes"""
+
+    def test_max_memory(self):
+        """Workers exceeding --max-memory are replaced, without losing modules."""
+        # Every worker uses more than 1 MiB, and is replaced after each import
+        process = list_modules(
+            "--jobs", "1", "--max-memory", "1", "--include", "^(csv|json|string)$"
+        )
+        self.assertEqual(process.returncode, 0)
+        rows = [line.split("\t") for line in process.stdout.splitlines()]
+        self.assertEqual([row[0] for row in rows], ["csv", "json", "string"])
+        for row in rows:
+            self.assertEqual(row[3], "", row)
+
+    @unittest.skipUnless(os.path.isdir("/proc"), "Requires /proc.")
+    def test_timeout(self):
+        """Workers are killed with list_modules.py, when it times out."""
+        with tempfile.TemporaryDirectory() as directory:
+            with open(
+                os.path.join(directory, "sleepy.py"), "w", encoding="utf8"
+            ) as file:
+                file.write("import time\ntime.sleep(60)\n")
+            with mock.patch.dict(os.environ, {"PYTHONPATH": directory}):
+                with Command(
+                    [
+                        sys.executable,
+                        LIST_MODULES,
+                        "--jobs",
+                        "1",
+                        "--include",
+                        "^sleepy$",
+                    ],
+                    timeout=1,
+                ) as command:
+                    command.stdout.read()
+            self.assertIsNotNone(command.interrupted)
+
+        # Killed processes may take some time to disappear
+        deadline = time.monotonic() + 5
+        while workers() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.assertEqual(workers(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()